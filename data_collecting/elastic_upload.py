@@ -1,14 +1,19 @@
 import os
+import sys
 import json
 import re
 import unicodedata
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-from sentence_transformers import SentenceTransformer
 from pinecone import Pinecone, ServerlessSpec
 from elasticsearch import Elasticsearch, helpers
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.config import EMBED_MODEL_NAME, EMBED_BACKEND, EMBED_BATCH_SIZE
+from src.model_registry import get_embedding_model
+from src.embedding_artifact import EmbeddingArtifactWriter
+
 # ===============================
 # CONFIG
 # ===============================
@@ -16,13 +21,13 @@ from elasticsearch import Elasticsearch, helpers
 JSONL_PATH = "processed_laws1/all_laws_merged_clean_split.jsonl"
 
 PC_INDEX = "raglaw-final"
-MODEL_NAME = "BAAI/bge-m3"   # BGE-M3 (1024-dim)
+MODEL_NAME = EMBED_MODEL_NAME   # BGE-M3 (1024-dim), backend theo EMBED_BACKEND trong src/config.py
 
 ES_INDEX = "rag_law"
 MAX_METADATA_CHARS = 4000
 BATCH_SIZE = 32
 
-EMBED_JSONL_PATH = "embedded_laws.jsonl"  # <--- file lưu embedding
+EMBED_ARTIFACT_PATH = "embedded_laws.emb"  # <--- thư mục lưu embedding (vectors.npy float16 + id/metadata)
 
 # ===============================
 # Helpers
@@ -108,14 +113,15 @@ print(f"Loaded {len(docs)} cleaned law clauses.")
 # Embedding Model (BGE-M3)
 # ===============================
 
-print("Loading BGE-M3 embedding model...")
-embedder = SentenceTransformer(MODEL_NAME)
+print(f"Loading BGE-M3 embedding model ({EMBED_BACKEND})...")
+# model dùng chung của src (EMBED_BACKEND: torch fp32 hoặc onnx int8)
+embedder = get_embedding_model()
 
 # ===============================
 # MAIN LOOP
 # ===============================
 
-embedded_docs = []
+artifact = EmbeddingArtifactWriter(EMBED_ARTIFACT_PATH, len(docs), meta={"model": MODEL_NAME, "backend": EMBED_BACKEND, "source_path": JSONL_PATH})
 
 for i in tqdm(range(0, len(docs), BATCH_SIZE), desc="Processing batches"):
 
@@ -131,12 +137,15 @@ for i in tqdm(range(0, len(docs), BATCH_SIZE), desc="Processing batches"):
     # --- Embedding with BGE-M3 ---
     embeddings = embedder.encode(
         texts,
-        batch_size=BATCH_SIZE,
+        batch_size=EMBED_BATCH_SIZE,
         convert_to_numpy=True,
         show_progress_bar=False
     )
 
-    # --- Prepare vectors & save for JSONL ---
+    # --- Save to artifact (metadata = clause gốc, không truncate) ---
+    artifact.write(embeddings, ids, batch)
+
+    # --- Prepare vectors ---
     vectors = []
     for j, d in enumerate(batch):
         vector_item = {
@@ -152,17 +161,14 @@ for i in tqdm(range(0, len(docs), BATCH_SIZE), desc="Processing batches"):
             }
         }
         vectors.append(vector_item)
-        embedded_docs.append(vector_item)
 
     # --- Upload to Pinecone ---
     pindex.upsert(vectors=vectors)
 
 # ===============================
-# Save embedded JSONL
+# Save embedding artifact
 # ===============================
-with open(EMBED_JSONL_PATH, "w", encoding="utf-8") as f:
-    for item in embedded_docs:
-        f.write(json.dumps(item, ensure_ascii=False) + "\n")
+artifact.close()
 
-print(f"\nDONE! Embedded data saved to: {EMBED_JSONL_PATH}")
+print(f"\nDONE! Embedded data saved to: {EMBED_ARTIFACT_PATH}")
 print("Fresh data uploaded to Elasticsearch + Pinecone.")
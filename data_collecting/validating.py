@@ -3,7 +3,7 @@
 
 """
 validate_data.py
-Automatic data validation + visualization for embedded_laws.jsonl
+Automatic data validation + visualization for the embedded_laws.emb artifact
 Generates:
     - Histogram + boxplot of vector norms
     - Cosine similarity heatmap for duplicate detection
@@ -12,6 +12,7 @@ Generates:
 """
 
 import os
+import sys
 import json
 import numpy as np
 import pandas as pd
@@ -20,10 +21,14 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.metrics.pairwise import cosine_similarity
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.embedding_artifact import load_artifact, convert_jsonl
+
 # ================================
 # CONFIG
 # ================================
-INPUT_JSONL = "embedded_laws.jsonl"
+INPUT_ARTIFACT = "embedded_laws.emb"
+LEGACY_JSONL = "embedded_laws.jsonl"  # file cũ: chuyển sang artifact một lần nếu chưa có artifact
 OUT_DIR = "validation_report"
 os.makedirs(OUT_DIR, exist_ok=True)
 
@@ -31,23 +36,20 @@ os.makedirs(OUT_DIR, exist_ok=True)
 # ================================
 # LOAD DATA
 # ================================
-def load_jsonl(path):
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            rows.append(json.loads(line))
-    return rows
-
+if not os.path.exists(INPUT_ARTIFACT) and os.path.exists(LEGACY_JSONL):
+    print(f"Converting {LEGACY_JSONL} -> {INPUT_ARTIFACT}...")
+    convert_jsonl(LEGACY_JSONL, INPUT_ARTIFACT)
 
-print("Loading JSONL...")
-data = load_jsonl(INPUT_JSONL)
+print("Loading embedding artifact...")
+# vectors là ma trận (n, dim) memory-map, không tách thành array từng dòng
+artifact = load_artifact(INPUT_ARTIFACT)
 
+records = list(artifact.records())
 df = pd.DataFrame([{
-    "id": d["id"],
-    "text": d["metadata"]["text"],
-    "law_title": d["metadata"].get("law_title", ""),
-    "embedding": np.array(d["values"], dtype=np.float32)
-} for d in data])
+    "id": r["id"],
+    "text": r.get("clause_text", r.get("text", "")),
+    "law_title": r.get("law_title", ""),
+} for r in records])
 
 print(f"→ Loaded {len(df)} entries.")
 
@@ -56,7 +58,7 @@ print(f"→ Loaded {len(df)} entries.")
 # 1. VECTOR STATISTICS
 # ================================
 print("Computing vector norms...")
-df["norm"] = df["embedding"].apply(lambda x: np.linalg.norm(x))
+df["norm"] = np.linalg.norm(artifact.as_float32(), axis=1)
 
 # Histogram
 plt.figure(figsize=(8,5))
@@ -84,7 +86,7 @@ print("Computing cosine similarity matrix (may take time)...")
 
 # sample up to 200 rows to avoid giant matrix
 sample_df = df.sample(min(200, len(df)), random_state=42)
-emb_matrix = np.vstack(sample_df["embedding"].to_numpy())
+emb_matrix = artifact.as_float32(sample_df.index.to_numpy())
 sim_matrix = cosine_similarity(emb_matrix)
 
 plt.figure(figsize=(10,8))
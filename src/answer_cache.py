@@ -0,0 +1,84 @@
+# src/answer_cache.py
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from .config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL
+from .embedding_cache import normalize_query
+
+
+def answer_key(model_key, query, doc_ids):
+    """Key của câu trả lời: sha1 của (model key, query đã chuẩn hóa, id doc retrieve được theo thứ tự)."""
+    payload = json.dumps([model_key, normalize_query(query), [str(d) for d in doc_ids]], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời LLM theo answer_key: với do_sample=False, cùng prompt luôn sinh cùng câu trả lời,
+    nên câu hỏi lặp lại (sau decontextualize) với cùng context không cần decode lại.
+
+    Giữ tối đa `maxsize` câu trả lời (LRU), mỗi câu sống `ttl` giây (None = không hết hạn).
+    `version` là stamp của index + adapter + prompt lúc các câu trả lời được sinh: check_version(stamp)
+    xóa toàn bộ cache khi stamp đổi. Thread-safe.
+    """
+
+    def __init__(self, maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()            # key -> (answer, created)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def check_version(self, version):
+        """Xóa cache nếu version (stamp index / adapter) khác lúc các câu trả lời được ghi."""
+        with self._lock:
+            if version != self.version:
+                if self.version is not None and self._entries:
+                    print(f"[ANSWER CACHE] Version changed, flushed {len(self._entries)} answers")
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and self.ttl is not None and item[1] < time.time() - self.ttl:
+                del self._entries[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, answer):
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+
+# Cache dùng chung mọi session trong process
+answer_cache = AnswerCache()
@@ -0,0 +1,928 @@
+# src/bm25_index.py
+import os
+import json
+import math
+import shutil
+import hashlib
+import tempfile
+import threading
+from bisect import bisect_left
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:  # scipy không bắt buộc, top_k_many fallback về top_k từng query
+    sparse = None
+
+INDEX_FORMAT_VERSION = 4
+
+# Giống rank_bm25.BM25Okapi: idf âm được thay bằng epsilon * average_idf
+BM25_EPSILON = 0.25
+
+# Nới cận trên một chút để sai số làm tròn float không làm mất kết quả khi pruning
+_BOUND_SLACK = 1e-9
+
+_ARRAY_FILES = ("indptr", "postings_doc", "postings_tf", "doc_len", "idf", "max_tf")
+
+
+# ============================================================
+# Helpers
+# ============================================================
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compute_idf(df, n_docs, epsilon=BM25_EPSILON):
+    """
+    IDF theo đúng công thức (và thứ tự cộng) của BM25Okapi để điểm số khớp từng bit.
+    `df` là danh sách document frequency theo thứ tự term id; term có df = 0 (đã bị xóa hết
+    document) có idf 0 và không tính vào average_idf, như khi build lại từ đầu.
+    """
+    idf = []
+    idf_sum = 0.0
+    n_terms = 0
+    negative = []
+    for tid, freq in enumerate(df):
+        if not freq:
+            idf.append(0.0)
+            continue
+        value = math.log(n_docs - freq + 0.5) - math.log(freq + 0.5)
+        idf.append(value)
+        idf_sum += value
+        n_terms += 1
+        if value < 0:
+            negative.append(tid)
+    if n_terms:
+        eps = epsilon * (idf_sum / n_terms)
+        for tid in negative:
+            idf[tid] = eps
+    return np.asarray(idf, dtype=np.float64)
+
+
+def _tf_bound(tf, k1, b):
+    # tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl)) tăng theo tf và đạt max khi dl -> 0
+    denom = tf + k1 * (1 - b)
+    return tf * (k1 + 1) / denom if denom else k1 + 1
+
+
+def _accumulate(cand, acc, pending):
+    """Cộng các (docs, values) trong `pending` vào tập ứng viên thưa (cand tăng dần, acc)."""
+    if not pending:
+        return cand, acc
+    if not len(cand) and len(pending) == 1:
+        return pending[0][0].astype(np.int64), pending[0][1]
+    docs = np.concatenate([cand] + [d for d, _ in pending])
+    values = np.concatenate([acc] + [v for _, v in pending])
+    # mỗi mảng đã tăng dần: sort ổn định (timsort) chỉ cần trộn các run
+    order = np.argsort(docs, kind="stable")
+    docs = docs[order]
+    first = np.empty(len(docs), dtype=bool)
+    first[:1] = True
+    np.not_equal(docs[1:], docs[:-1], out=first[1:])
+    return docs[first], np.bincount(np.cumsum(first) - 1, weights=values[order])
+
+
+def _kth_largest(values, k):
+    return np.partition(values, len(values) - k)[len(values) - k]
+
+
+# ============================================================
+# BM25 scoring (dùng chung cho index tĩnh và index có cập nhật)
+# ============================================================
+class _BM25Scorer:
+    """
+    Scoring trên một index có: term_ids, idf, max_tf, n_docs (số doc id), deleted_ids (mọi document
+    đã xóa), tombstone_ids (document đã xóa nhưng postings vẫn còn), _postings(tid) -> (docs, tfs)
+    với docs tăng dần, và _doc_norm(k1, b).
+    """
+
+    # Ít hơn k document khớp thì bổ sung document điểm 0 (như BM25Okapi)
+    pad_zero_scores = True
+
+    def top_k(self, query_tokens, k, k1, b):
+        """
+        Top-k document theo BM25, chỉ duyệt postings của các term trong query (MaxScore pruning).
+
+        Các term được xử lý theo cận trên giảm dần; khi tổng cận trên của các term còn lại nhỏ hơn
+        điểm thứ k hiện tại thì document chỉ xuất hiện ở các term đó không thể vào top-k, nên các
+        term còn lại chỉ được tra cho những ứng viên đã có. Ứng viên cuối cùng được chấm lại đúng
+        thứ tự token như BM25Okapi để điểm số khớp tuyệt đối.
+
+        Trả về list (doc_id, score) theo điểm giảm dần, điểm bằng nhau thì doc_id tăng dần
+        (giống sorted(..., reverse=True) trên get_scores).
+        """
+        if k <= 0 or not self.n_docs:
+            return []
+
+        weights = self._query_weights(query_tokens)
+        if any(w < 0 for w in weights.values()):
+            # idf âm (term xuất hiện ở hơn nửa corpus, rất hiếm): document không khớp có thể xếp trên
+            return self._dense_top_k(query_tokens, k, k1, b)
+
+        norm = self._doc_norm(k1, b)
+        deleted = self.tombstone_ids
+        k1_plus = k1 + 1
+        bounds = {tid: w * _tf_bound(int(self.max_tf[tid]), k1, b) * (1 + _BOUND_SLACK)
+                  for tid, w in weights.items()}
+        terms = sorted(weights, key=lambda t: -bounds[t])
+        rest = [0.0] * (len(terms) + 1)
+        for i in range(len(terms) - 1, -1, -1):
+            rest[i] = rest[i + 1] + bounds[terms[i]]
+
+        # Essential terms (cận trên lớn, postings ngắn): cộng dồn toàn bộ postings vào tập ứng viên
+        # thưa (cand: doc id tăng dần, acc: điểm tương ứng), không cấp phát mảng theo số document.
+        # Khi tổng cận trên các term còn lại < điểm thứ k, document chỉ xuất hiện ở các term đó
+        # không thể vào top-k -> các term còn lại (term phổ biến, postings dài) chỉ cần tra cho
+        # tập ứng viên, và ứng viên bị loại dần khi ngưỡng tăng. Điểm thứ k nằm giữa kth_low
+        # (max điểm thứ k từng term) và max_sum (tổng điểm lớn nhất từng term), nên chỉ cộng dồn
+        # để tính đúng điểm thứ k khi hai cận này chưa đủ quyết định.
+        cand = np.zeros(0, dtype=np.int64)
+        acc = np.zeros(0, dtype=np.float64)
+        pending = []
+        kth_low = max_sum = 0.0
+        n_essential = len(terms)
+        for i, tid in enumerate(terms):
+            if i and rest[i] < max_sum:
+                if rest[i] < kth_low * (1 - _BOUND_SLACK):
+                    n_essential = i
+                    break
+                # chỉ cộng dồn khi phần chờ đã lớn cỡ tập ứng viên (tổng chi phí sort cỡ N log N)
+                if sum(len(d) for d, _ in pending) >= len(cand):
+                    cand, acc = _accumulate(cand, acc, pending)
+                    pending = []
+                if not pending and len(cand) >= k:
+                    kth_low = max(kth_low, _kth_largest(acc, k))
+                    if rest[i] < kth_low * (1 - _BOUND_SLACK):
+                        n_essential = i
+                        break
+            docs, tf = self._postings(tid)
+            if len(deleted):
+                alive = ~np.isin(docs, deleted)
+                docs, tf = docs[alive], tf[alive]
+            if not len(docs):
+                continue
+            values = weights[tid] * (tf * k1_plus / (tf + norm[docs]))
+            pending.append((docs, values))
+            top = values.max()
+            max_sum += top
+            if len(values) >= k and top > kth_low:
+                kth_low = max(kth_low, _kth_largest(values, k))
+        cand, acc = _accumulate(cand, acc, pending)
+
+        for j in range(n_essential, len(terms) + 1):
+            if len(cand) > k:
+                keep = acc + rest[j] >= _kth_largest(acc, k) * (1 - _BOUND_SLACK)
+                cand, acc = cand[keep], acc[keep]
+            if j == len(terms) or not len(cand):
+                break
+            docs, tf = self._postings(terms[j])
+            if not len(docs):
+                continue
+            # tra ứng viên trong postings (hoặc ngược lại), chọn chiều binary search rẻ hơn
+            if len(cand) * np.log2(len(docs) + 1) < len(docs) * np.log2(len(cand) + 1):
+                pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+                hit = docs[pos] == cand
+                rows, tf = np.flatnonzero(hit), tf[pos[hit]]
+            else:
+                pos = np.minimum(np.searchsorted(cand, docs), len(cand) - 1)
+                hit = cand[pos] == docs
+                rows, tf = pos[hit], tf[hit]
+            acc[rows] += weights[terms[j]] * (tf * k1_plus / (tf + norm[cand[rows]]))
+
+        return self._rank(query_tokens, weights, cand, k, k1, b)
+
+    def _query_weights(self, query_tokens):
+        """{term id: idf * số lần xuất hiện}; term trùng lặp được cộng nhiều lần (như BM25Okapi)."""
+        counts = {}
+        for q in query_tokens:
+            tid = self.term_ids.get(q)
+            if tid is not None and self.idf[tid]:
+                counts[tid] = counts.get(tid, 0) + 1
+        return {tid: float(self.idf[tid]) * m for tid, m in counts.items()}
+
+    def top_k_many(self, queries_tokens, k, k1, b, chunk_size=256):
+        """
+        top_k cho nhiều query cùng lúc: điểm thô của cả batch là một phép nhân ma trận thưa
+        (query x term) @ (term x document), top-k mỗi query lấy bằng argpartition trên các document
+        khớp, sau đó ứng viên được chấm lại bằng _rank nên kết quả giống hệt top_k.
+        Không có scipy thì chạy top_k lần lượt.
+        """
+        if sparse is None or k <= 0 or not self.n_docs:
+            return [self.top_k(tokens, k, k1, b) for tokens in queries_tokens]
+
+        term_doc = self._term_doc_matrix(k1, b)
+        deleted = np.zeros(self.n_docs, dtype=bool)
+        deleted[self.deleted_ids] = True
+        results = []
+        for start in range(0, len(queries_tokens), chunk_size):
+            chunk = queries_tokens[start:start + chunk_size]
+            weights = [self._query_weights(tokens) for tokens in chunk]
+            rows = np.repeat(np.arange(len(chunk)), [len(w) for w in weights])
+            cols = np.fromiter((tid for w in weights for tid in w), dtype=np.int64, count=len(rows))
+            vals = np.fromiter((v for w in weights for v in w.values()), dtype=np.float64, count=len(rows))
+            query_term = sparse.csr_matrix((vals, (rows, cols)), shape=(len(chunk), term_doc.shape[0]))
+            raw = sparse.csr_matrix(query_term @ term_doc)
+
+            for i, tokens in enumerate(chunk):
+                if any(w < 0 for w in weights[i].values()):
+                    results.append(self._dense_top_k(tokens, k, k1, b))
+                    continue
+                docs = raw.indices[raw.indptr[i]:raw.indptr[i + 1]]
+                scores = raw.data[raw.indptr[i]:raw.indptr[i + 1]]
+                keep = ~deleted[docs] & (scores > 0)
+                docs, scores = docs[keep], scores[keep]
+                if len(docs) > k:
+                    # ngưỡng nới một chút: tổng theo thứ tự khác có thể lệch vài ulp so với _rank
+                    kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+                    docs = docs[scores >= kth * (1 - _BOUND_SLACK)]
+                # indices của tích ma trận thưa không được sort; _rank cần doc id tăng dần
+                results.append(self._rank(tokens, weights[i], np.sort(docs), k, k1, b))
+        return results
+
+    def _term_doc_matrix(self, k1, b):
+        """Ma trận thưa term x document với giá trị tf*(k1+1)/(tf+norm), cache theo (k1, b)."""
+        key = ("term_doc", k1, b)
+        if key not in self._norm_cache:
+            indptr, docs, tf = self._csr()
+            norm = self._doc_norm(k1, b)
+            tf = tf.astype(np.float64)
+            values = tf * (k1 + 1) / (tf + norm[docs])
+            self._norm_cache[key] = sparse.csr_matrix(
+                (values, docs, indptr), shape=(len(indptr) - 1, self.n_docs)
+            )
+        return self._norm_cache[key]
+
+    def _csr(self):
+        """(indptr, postings_doc, postings_tf) của toàn bộ postings."""
+        parts = [self._postings(tid) for tid in range(len(self.vocab))]
+        indptr = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(docs) for docs, _ in parts], out=indptr[1:])
+        if not parts:
+            return indptr, np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        return indptr, np.concatenate([d for d, _ in parts]), np.concatenate([t for _, t in parts])
+
+    def _rank(self, query_tokens, weights, cand, k, k1, b):
+        """
+        Chấm lại ứng viên `cand` (doc id tăng dần): đóng góp từng term cộng theo đúng thứ tự
+        token của query như BM25Okapi, rồi lấy top-k (bổ sung document điểm 0 nếu thiếu).
+        """
+        norm = self._doc_norm(k1, b)
+        k1_plus = k1 + 1
+        contrib = {}
+        for tid in weights:
+            docs, tf = self._postings(tid)
+            if not len(docs):
+                continue
+            pos = np.minimum(np.searchsorted(docs, cand), len(docs) - 1)
+            hit = docs[pos] == cand
+            tf_hit = tf[pos[hit]]
+            values = np.zeros(len(cand), dtype=np.float64)
+            values[hit] = self.idf[tid] * (tf_hit * k1_plus / (tf_hit + norm[cand[hit]]))
+            contrib[tid] = values
+        scores = np.zeros(len(cand), dtype=np.float64)
+        for q in query_tokens:
+            tid = self.term_ids.get(q)
+            if tid in contrib:
+                scores += contrib[tid]
+
+        order = np.lexsort((cand, -scores))[:k]
+        ranked = [(int(cand[i]), float(scores[i])) for i in order]
+        if len(ranked) >= k or not self.pad_zero_scores:
+            return ranked
+
+        # Ít hơn k document khớp: bổ sung document điểm 0 theo thứ tự doc id như BM25Okapi
+        matched = set(cand.tolist())
+        matched.update(self.deleted_ids.tolist())
+        doc = 0
+        while len(ranked) < k and doc < self.n_docs:
+            if doc not in matched:
+                ranked.append((doc, 0.0))
+            doc += 1
+        return ranked
+
+    def _dense_top_k(self, query_tokens, k, k1, b):
+        scores = self.get_scores(query_tokens, k1, b)
+        scores[self.deleted_ids] = -np.inf
+        docs = np.arange(self.n_docs) if self.pad_zero_scores else np.flatnonzero(scores)
+        docs = docs[np.isfinite(scores[docs])]
+        order = docs[np.argsort(-scores[docs], kind="stable")[:k]]
+        return [(int(i), float(scores[i])) for i in order]
+
+    def get_scores(self, query_tokens, k1, b):
+        """Tương đương BM25Okapi.get_scores nhưng chỉ duyệt postings của các term trong query."""
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for q in query_tokens:
+            tid = self.term_ids.get(q)
+            if tid is None or not self.idf[tid]:
+                continue
+            docs, tf = self._postings(tid)
+            scores[docs] += self.idf[tid] * (tf * (k1 + 1) / (tf + self._doc_norm(k1, b)[docs]))
+        return scores
+
+
+# ============================================================
+# BM25 Index (CSR postings)
+# ============================================================
+class BM25Index(_BM25Scorer):
+    """
+    Inverted index BM25 dạng CSR, lưu ra đĩa và memory-map lại khi load.
+
+    - vocab:        list term theo term id (thứ tự xuất hiện đầu tiên, như BM25Okapi)
+    - indptr:       postings của term t nằm trong [indptr[t], indptr[t+1])
+    - postings_doc: doc id (tăng dần trong mỗi term)
+    - postings_tf:  term frequency tương ứng
+    - doc_len:      số token của mỗi document
+    - idf:          IDF của mỗi term
+    - max_tf:       tf lớn nhất trong postings của mỗi term (cận trên cho MaxScore pruning)
+    """
+
+    def __init__(self, vocab, indptr, postings_doc, postings_tf, doc_len, idf, max_tf=None, meta=None):
+        self.vocab = list(vocab)
+        self.term_ids = {term: tid for tid, term in enumerate(self.vocab)}
+        self.indptr = indptr
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.idf = idf
+        if max_tf is None:
+            max_tf = np.array([postings_tf[s:e].max() for s, e in zip(indptr[:-1], indptr[1:])], dtype=np.int32)
+        self.max_tf = max_tf
+        self._norm_cache = {}
+        self.n_docs = int(len(doc_len))
+        self.avgdl = float(int(np.sum(doc_len, dtype=np.int64)) / self.n_docs) if self.n_docs else 0.0
+        self.deleted_ids = self.tombstone_ids = np.zeros(0, dtype=np.int64)
+        self.meta = dict(meta or {})
+
+    def _doc_norm(self, k1, b):
+        """k1*(1-b+b*dl/avgdl) cho từng document, cache theo (k1, b)."""
+        key = (k1, b)
+        if key not in self._norm_cache:
+            self._norm_cache[key] = k1 * (1 - b + b * self.doc_len / self.avgdl)
+        return self._norm_cache[key]
+
+    def _postings(self, tid):
+        start, end = self.indptr[tid], self.indptr[tid + 1]
+        return self.postings_doc[start:end], self.postings_tf[start:end]
+
+    def _csr(self):
+        return self.indptr, self.postings_doc, self.postings_tf
+
+    # --------------------------------------------------------
+    # Build
+    # --------------------------------------------------------
+    @classmethod
+    def build(cls, tokenized_docs, meta=None):
+        term_ids = {}
+        post_docs, post_tfs = [], []
+        doc_len = np.zeros(len(tokenized_docs), dtype=np.int32)
+
+        for doc_id, tokens in enumerate(tokenized_docs):
+            doc_len[doc_id] = len(tokens)
+            freqs = {}
+            for tok in tokens:
+                freqs[tok] = freqs.get(tok, 0) + 1
+            for tok, tf in freqs.items():
+                tid = term_ids.get(tok)
+                if tid is None:
+                    tid = term_ids[tok] = len(term_ids)
+                    post_docs.append([])
+                    post_tfs.append([])
+                post_docs[tid].append(doc_id)
+                post_tfs[tid].append(tf)
+
+        df = [len(p) for p in post_docs]
+        indptr = np.zeros(len(df) + 1, dtype=np.int64)
+        if df:
+            np.cumsum(df, out=indptr[1:])
+        postings_doc = np.fromiter((d for p in post_docs for d in p), dtype=np.int32, count=int(indptr[-1]))
+        postings_tf = np.fromiter((t for p in post_tfs for t in p), dtype=np.int32, count=int(indptr[-1]))
+        idf = compute_idf(df, len(tokenized_docs))
+        max_tf = np.fromiter((max(p) for p in post_tfs), dtype=np.int32, count=len(post_tfs))
+
+        return cls(list(term_ids), indptr, postings_doc, postings_tf, doc_len, idf, max_tf=max_tf, meta=meta)
+
+    # --------------------------------------------------------
+    # Persist
+    # --------------------------------------------------------
+    def save(self, index_dir, sidecar=None):
+        """
+        Ghi index ra thư mục tạm rồi rename, để worker khác không đọc phải index ghi dở.
+        `sidecar(tmp_dir)` (nếu có) ghi thêm dữ liệu đi kèm index (vd. metadata) vào cùng thư mục tạm.
+
+        Trả về False nếu worker khác (cùng build song song) đã rename index của nó vào `index_dir`
+        trước: thư mục tạm bị xóa, index trên đĩa là của worker kia.
+        """
+        index_dir = os.path.abspath(index_dir)
+        # tên tạm riêng cho mỗi lần save (kể cả các thread cùng process)
+        tmp_dir = tempfile.mkdtemp(prefix=f"{os.path.basename(index_dir)}.tmp-", dir=os.path.dirname(index_dir))
+
+        for name in _ARRAY_FILES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp_dir, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        if sidecar is not None:
+            sidecar(tmp_dir)
+
+        meta = dict(self.meta)
+        meta.update({
+            "format_version": INDEX_FORMAT_VERSION,
+            "n_docs": self.n_docs,
+            "n_terms": len(self.vocab),
+            "n_postings": int(self.indptr[-1]) if len(self.indptr) else 0,
+            "avgdl": self.avgdl,
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        })
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self.meta = meta
+
+        old_dir = f"{tmp_dir}.old"
+        try:
+            if os.path.exists(index_dir):
+                os.rename(index_dir, old_dir)
+            os.rename(tmp_dir, index_dir)
+        except OSError:
+            # giữa lúc kiểm tra và rename, worker khác đã đặt index của nó vào index_dir
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        finally:
+            if os.path.exists(old_dir):
+                shutil.rmtree(old_dir, ignore_errors=True)
+        return True
+
+    @staticmethod
+    def read_meta(index_dir):
+        path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        meta = cls.read_meta(index_dir)
+        if meta is None:
+            raise FileNotFoundError(f"BM25 index not found: {index_dir}")
+        mode = "r" if mmap else None
+        # view ndarray trên vùng mmap: tránh overhead của np.memmap khi slice trên đường search
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mode).view(np.ndarray)
+            for name in _ARRAY_FILES
+        }
+        with open(os.path.join(index_dir, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        return cls(vocab, meta=meta, **arrays)
+
+
+# ============================================================
+# Live index: BM25Index + delta segment + tombstones
+# ============================================================
+class LiveBM25Index(_BM25Scorer):
+    """
+    Cho phép thêm / xóa document trên một BM25Index mà không build lại toàn bộ.
+
+    - Document mới được ghi vào delta segment (postings dạng list theo term) với doc id tiếp
+      nối index gốc, nên postings của mỗi term vẫn tăng dần: [postings gốc] + [postings delta].
+    - Document bị xóa được đánh dấu tombstone và loại khỏi kết quả; df, số document và tổng độ dài
+      được cập nhật ngay nên idf/avgdl giống như khi build lại trên corpus hiện tại.
+    - merge() gộp delta và bỏ postings của document đã xóa vào một BM25Index mới (doc id giữ
+      nguyên), có thể chạy ở thread nền; search vẫn dùng index cũ cho tới khi swap.
+    - Search chỉ giữ lock để chụp trạng thái (_LiveView) rồi chấm điểm ngoài lock, nên các search
+      đồng thời không chặn nhau; add / delete / merge chỉ chờ các lần chụp.
+
+    Khi chưa có thay đổi nào, idf/avgdl lấy nguyên từ index gốc nên điểm số khớp từng bit.
+    """
+
+    def __init__(self, base):
+        self._lock = threading.RLock()
+        self._merge_thread = None
+        self.base = base
+        self.vocab = list(base.vocab)
+        self.term_ids = dict(base.term_ids)
+        self.df = np.diff(np.asarray(base.indptr, dtype=np.int64)).tolist()
+        self._max_tf = np.asarray(base.max_tf, dtype=np.int32).tolist()
+        self._deleted = set()
+        self._tombstones = set()   # đã xóa nhưng postings còn trong index gốc / delta (chưa merge)
+        self.deleted_ids = self.tombstone_ids = np.zeros(0, dtype=np.int64)
+        self.n_live = base.n_docs
+        self.total_len = int(np.sum(base.doc_len, dtype=np.int64))
+        self.modified = False
+        # delta segment
+        self._delta_docs = []   # (doc_id, {tid: tf}, doc_len) theo doc id tăng dần
+        self._delta_post = {}   # tid -> ([doc_id], [tf])
+        self._delta_len = []
+        self._reset_caches()
+
+    def _reset_caches(self):
+        self._post_cache = {}
+        self._norm_cache = {}
+        self._idf = None
+        self._doc_len = None
+
+    # --------------------------------------------------------
+    # Trạng thái đọc cho _BM25Scorer
+    # --------------------------------------------------------
+    @property
+    def n_docs(self):
+        """Số doc id (gồm cả document đã xóa), không phải số document còn sống."""
+        return self.base.n_docs + len(self._delta_len)
+
+    @property
+    def n_delta(self):
+        return len(self._delta_docs)
+
+    @property
+    def n_tombstones(self):
+        return len(self._tombstones)
+
+    @property
+    def avgdl(self):
+        if not self.modified:
+            return self.base.avgdl
+        return self.total_len / self.n_live if self.n_live else 0.0
+
+    @property
+    def idf(self):
+        if not self.modified:
+            return self.base.idf
+        if self._idf is None:
+            self._idf = compute_idf(self.df, self.n_live)
+        return self._idf
+
+    @property
+    def max_tf(self):
+        # cận trên: không giảm khi xóa (vẫn đúng cho pruning), chính xác lại sau merge
+        return self._max_tf
+
+    @property
+    def doc_len(self):
+        if self._doc_len is None:
+            if self._delta_len:
+                self._doc_len = np.concatenate([self.base.doc_len, np.asarray(self._delta_len, dtype=np.int32)])
+            else:
+                self._doc_len = self.base.doc_len
+        return self._doc_len
+
+    def _doc_norm(self, k1, b):
+        if not self.modified:
+            return self.base._doc_norm(k1, b)
+        key = (k1, b)
+        if key not in self._norm_cache:
+            self._norm_cache[key] = k1 * (1 - b + b * self.doc_len / self.avgdl)
+        return self._norm_cache[key]
+
+    def _postings(self, tid):
+        cached = self._post_cache.get(tid)
+        if cached is not None:
+            return cached
+        if tid < len(self.base.vocab):
+            docs, tf = self.base._postings(tid)
+        else:
+            docs = tf = np.zeros(0, dtype=np.int32)
+        delta = self._delta_post.get(tid)
+        if delta:
+            docs = np.concatenate([docs, np.asarray(delta[0], dtype=np.int32)])
+            tf = np.concatenate([tf, np.asarray(delta[1], dtype=np.int32)])
+        self._post_cache[tid] = (docs, tf)
+        return docs, tf
+
+    def _view(self, k1, b, term_doc=False):
+        """Chụp trạng thái đọc dưới lock; scoring trên ảnh chụp chạy ngoài lock."""
+        with self._lock:
+            return _LiveView(self, k1, b, term_doc)
+
+    def top_k(self, query_tokens, k, k1, b):
+        return self._view(k1, b).top_k(query_tokens, k, k1, b)
+
+    def top_k_many(self, queries_tokens, k, k1, b, chunk_size=256):
+        view = self._view(k1, b, term_doc=sparse is not None)
+        return view.top_k_many(queries_tokens, k, k1, b, chunk_size=chunk_size)
+
+    def get_scores(self, query_tokens, k1, b):
+        return self._view(k1, b).get_scores(query_tokens, k1, b)
+
+    def _csr(self):
+        if not self._delta_post and len(self.vocab) == len(self.base.vocab):
+            return self.base._csr()
+        return super()._csr()
+
+    # --------------------------------------------------------
+    # Cập nhật
+    # --------------------------------------------------------
+    def atomic(self):
+        """with index.atomic(): nhiều add / delete liên tiếp, search không thấy trạng thái ở giữa."""
+        return self._lock
+
+    def add(self, tokens):
+        """Thêm một document (list token), trả về doc id mới."""
+        with self._lock:
+            doc_id = self.n_docs
+            freqs = {}
+            for tok in tokens:
+                tid = self.term_ids.get(tok)
+                if tid is None:
+                    tid = self.term_ids[tok] = len(self.vocab)
+                    self.vocab.append(tok)
+                    self.df.append(0)
+                    self._max_tf.append(0)
+                freqs[tid] = freqs.get(tid, 0) + 1
+            for tid, tf in freqs.items():
+                docs, tfs = self._delta_post.setdefault(tid, ([], []))
+                docs.append(doc_id)
+                tfs.append(tf)
+                self.df[tid] += 1
+                if tf > self._max_tf[tid]:
+                    self._max_tf[tid] = tf
+            # ảnh chụp cũ vẫn giữ cache postings của trạng thái trước
+            self._post_cache = {}
+            self._delta_docs.append((doc_id, freqs, len(tokens)))
+            self._delta_len.append(len(tokens))
+            self.n_live += 1
+            self.total_len += len(tokens)
+            self._mark_modified()
+            return doc_id
+
+    def delete(self, doc_id, tokens):
+        """
+        Xóa document `doc_id`. `tokens` là token của document đó (cần để giảm df); trả về False
+        nếu document không tồn tại hoặc đã bị xóa.
+        """
+        with self._lock:
+            if doc_id in self._deleted or not 0 <= doc_id < self.n_docs:
+                return False
+            for tid in {self.term_ids[tok] for tok in tokens if tok in self.term_ids}:
+                self.df[tid] -= 1
+            self._deleted.add(doc_id)
+            self._tombstones.add(doc_id)
+            self.deleted_ids = _id_array(self._deleted)
+            self.tombstone_ids = _id_array(self._tombstones)
+            self.n_live -= 1
+            self.total_len -= len(tokens)
+            self._mark_modified()
+            return True
+
+    def is_deleted(self, doc_id):
+        return doc_id in self._deleted
+
+    def _mark_modified(self):
+        self.modified = True
+        self._idf = None
+        self._norm_cache = {}
+        self._doc_len = None
+
+    # --------------------------------------------------------
+    # Merge delta -> BM25Index
+    # --------------------------------------------------------
+    def merge(self):
+        """
+        Gộp index gốc + delta (bỏ postings của document đã xóa) thành BM25Index mới rồi swap.
+        Phần nặng chạy ngoài lock; document thêm/xóa trong lúc merge vẫn được giữ lại.
+        """
+        with self._lock:
+            base = self.base
+            delta_docs = list(self._delta_docs)
+            tombstones = set(self._tombstones)
+            deleted = _id_array(self._deleted)
+            n_terms = len(self.vocab)
+            vocab = list(self.vocab)
+            doc_len = self.doc_len[:base.n_docs + len(delta_docs)].copy()
+
+        # postings gốc còn sống
+        base_df = np.diff(np.asarray(base.indptr, dtype=np.int64))
+        base_tid = np.repeat(np.arange(len(base_df), dtype=np.int64), base_df)
+        base_doc = np.asarray(base.postings_doc, dtype=np.int64)
+        base_tf = np.asarray(base.postings_tf, dtype=np.int32)
+        parts_tid, parts_doc, parts_tf = [base_tid], [base_doc], [base_tf]
+        # postings delta
+        for doc_id, freqs, _ in delta_docs:
+            parts_tid.append(np.fromiter(freqs.keys(), dtype=np.int64, count=len(freqs)))
+            parts_doc.append(np.full(len(freqs), doc_id, dtype=np.int64))
+            parts_tf.append(np.fromiter(freqs.values(), dtype=np.int32, count=len(freqs)))
+        tid = np.concatenate(parts_tid)
+        doc = np.concatenate(parts_doc)
+        tf = np.concatenate(parts_tf)
+        keep = ~np.isin(doc, deleted)
+        tid, doc, tf = tid[keep], doc[keep], tf[keep]
+        order = np.lexsort((doc, tid))
+        tid, doc, tf = tid[order], doc[order], tf[order]
+
+        counts = np.bincount(tid, minlength=n_terms)
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        max_tf = np.zeros(n_terms, dtype=np.int32)
+        np.maximum.at(max_tf, tid, tf)
+        # idf của index gộp chỉ dùng khi chưa có cập nhật nào; LiveBM25Index tự tính lại theo df
+        merged = BM25Index(
+            vocab, indptr, doc.astype(np.int32), tf, doc_len,
+            compute_idf(counts.tolist(), len(doc_len) - int(np.count_nonzero(deleted < len(doc_len)))),
+            max_tf=max_tf, meta=base.meta,
+        )
+
+        with self._lock:
+            n_merged = len(delta_docs)
+            self.base = merged
+            self._delta_docs = self._delta_docs[n_merged:]
+            self._delta_len = self._delta_len[n_merged:]
+            self._delta_post = {}
+            for doc_id, freqs, _ in self._delta_docs:
+                for t, f in freqs.items():
+                    docs, tfs = self._delta_post.setdefault(t, ([], []))
+                    docs.append(doc_id)
+                    tfs.append(f)
+            max_tf = max_tf.tolist()
+            for t, (_, tfs) in self._delta_post.items():
+                if t < len(max_tf):
+                    max_tf[t] = max(max_tf[t], max(tfs))
+            self._max_tf = max_tf + self._max_tf[len(max_tf):]
+            # postings của các tombstone lúc bắt đầu merge đã bị bỏ, không cần lọc khi search nữa
+            self._tombstones -= tombstones
+            self.tombstone_ids = _id_array(self._tombstones)
+            self._reset_caches()
+        return merged
+
+    def merge_in_background(self):
+        """Chạy merge() ở thread daemon nếu chưa có merge nào đang chạy. Trả về thread hoặc None."""
+        with self._lock:
+            if self._merge_thread is not None and self._merge_thread.is_alive():
+                return None
+            thread = threading.Thread(target=self._merge_safely, name="bm25-merge", daemon=True)
+            self._merge_thread = thread
+        thread.start()
+        return thread
+
+    def _merge_safely(self):
+        try:
+            self.merge()
+        except Exception as e:
+            print(f"[BM25] Background merge failed: {e}")
+
+    def wait_for_merge(self, timeout=None):
+        thread = self._merge_thread
+        if thread is not None:
+            thread.join(timeout)
+
+
+def _id_array(ids):
+    return np.fromiter(sorted(ids), dtype=np.int64, count=len(ids))
+
+
+class _TermIdsView:
+    """term_ids của LiveBM25Index giới hạn ở các term có lúc chụp (term thêm sau đó coi như chưa có)."""
+
+    __slots__ = ("term_ids", "n_terms")
+
+    def __init__(self, term_ids, n_terms):
+        self.term_ids = term_ids
+        self.n_terms = n_terms
+
+    def get(self, term, default=None):
+        tid = self.term_ids.get(term)
+        return tid if tid is not None and tid < self.n_terms else default
+
+
+class _LiveView(_BM25Scorer):
+    """
+    Trạng thái đọc của LiveBM25Index tại một thời điểm (tạo dưới lock của index). Index gốc bất
+    biến (merge thay bằng index mới), delta chỉ được append, idf / norm / doc id đã xóa được thay
+    bằng mảng mới mỗi lần cập nhật, nên ảnh chụp chỉ giữ tham chiếu cùng số doc id / term lúc chụp
+    và bỏ qua phần delta thêm sau đó.
+    """
+
+    def __init__(self, live, k1, b, term_doc=False):
+        self.base = live.base
+        self.n_docs = live.n_docs
+        self.term_ids = _TermIdsView(live.term_ids, len(live.vocab))
+        self.idf = live.idf
+        self.max_tf = live.max_tf
+        self.deleted_ids = live.deleted_ids
+        self.tombstone_ids = live.tombstone_ids
+        self._delta_post = live._delta_post
+        # cache postings dùng chung giữa các ảnh chụp cùng trạng thái (add / merge thay cache mới)
+        self._post_cache = live._post_cache
+        self._norm_cache = {(k1, b): live._doc_norm(k1, b)}
+        if term_doc:
+            self._norm_cache[("term_doc", k1, b)] = live._term_doc_matrix(k1, b)
+
+    def _doc_norm(self, k1, b):
+        return self._norm_cache[(k1, b)]
+
+    def _postings(self, tid):
+        cached = self._post_cache.get(tid)
+        if cached is not None:
+            return cached
+        if tid < len(self.base.vocab):
+            docs, tf = self.base._postings(tid)
+        else:
+            docs = tf = np.zeros(0, dtype=np.int32)
+        delta = self._delta_post.get(tid)
+        n = bisect_left(delta[0], self.n_docs) if delta else 0
+        if n:
+            docs = np.concatenate([docs, np.asarray(delta[0][:n], dtype=np.int32)])
+            tf = np.concatenate([tf, np.asarray(delta[1][:n], dtype=np.int32)])
+        self._post_cache[tid] = (docs, tf)
+        return docs, tf
+
+
+# ============================================================
+# Partition theo law_title
+# ============================================================
+class BM25Partitions:
+    """
+    Chia postings của index (BM25Index hoặc LiveBM25Index) theo partition, vd. theo law_title.
+
+    Trong mỗi term, postings được sắp lại theo partition (doc id vẫn tăng dần trong từng
+    partition), nên postings của một term trong một partition là một lát cắt liên tục tìm bằng
+    hai lần binary search (nhiều partition: ghép các lát cắt). Scoring trong partition chỉ duyệt các lát cắt đó; idf/avgdl vẫn là của
+    toàn corpus nên điểm số giống hệt điểm khi search global.
+
+    `doc_part` là list partition id theo doc id; document thêm lúc chạy thì append vào list này.
+    """
+
+    def __init__(self, index, doc_part):
+        self.index = index
+        self.doc_part = doc_part
+        self._base = None
+        self._layout_lock = threading.Lock()
+
+    def _layout(self, base):
+        """(base, indptr, docs, tfs, keys) cho index gốc `base`; build lại khi index gốc đổi (merge)."""
+        with self._layout_lock:
+            if self._base is None or self._base[0] is not base:
+                indptr = np.asarray(base.indptr, dtype=np.int64)
+                docs = np.asarray(base.postings_doc)
+                term_of = np.repeat(np.arange(len(indptr) - 1, dtype=np.int64), np.diff(indptr))
+                doc_part = np.asarray(self.doc_part[:base.n_docs], dtype=np.int32)
+                keys = doc_part[docs]
+                # lexsort ổn định: trong cùng (term, partition) doc id vẫn tăng dần
+                order = np.lexsort((keys, term_of))
+                self._base = (base, indptr, docs[order], np.asarray(base.postings_tf)[order], keys[order])
+            return self._base
+
+    def postings(self, view, tid, parts):
+        """
+        Postings của term `tid` trong các partition `parts` (tuple partition id tăng dần), theo ảnh
+        chụp `view` của index. Nhiều partition: ghép các lát cắt rồi sắp lại theo doc id.
+        """
+        base, indptr, docs, tfs, keys = self._layout(getattr(view, "base", view))
+        p_docs, p_tfs = [], []
+        if tid < len(indptr) - 1:
+            start, end = indptr[tid], indptr[tid + 1]
+            term_keys = keys[start:end]
+            for part in parts:
+                lo = start + np.searchsorted(term_keys, part, side="left")
+                hi = start + np.searchsorted(term_keys, part, side="right")
+                if hi > lo:
+                    p_docs.append(docs[lo:hi])
+                    p_tfs.append(tfs[lo:hi])
+        delta = getattr(view, "_delta_post", {}).get(tid)
+        if delta:
+            n = bisect_left(delta[0], view.n_docs)
+            sel = [i for i in range(n) if self.doc_part[delta[0][i]] in parts]
+            if sel:
+                p_docs.append(np.asarray([delta[0][i] for i in sel], dtype=np.int32))
+                p_tfs.append(np.asarray([delta[1][i] for i in sel], dtype=np.int32))
+        if not p_docs:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        if len(p_docs) == 1:
+            return p_docs[0], p_tfs[0]
+        p_docs, p_tfs = np.concatenate(p_docs), np.concatenate(p_tfs)
+        order = np.argsort(p_docs, kind="stable")
+        return p_docs[order], p_tfs[order]
+
+    def top_k(self, parts, query_tokens, k, k1, b):
+        """Top-k trong hợp các partition `parts` (một id hoặc tuple id), chỉ gồm document có điểm > 0."""
+        if isinstance(parts, (int, np.integer)):
+            parts = (parts,)
+        view = self.index._view(k1, b) if isinstance(self.index, LiveBM25Index) else self.index
+        return _PartitionScorer(self, view, tuple(parts)).top_k(query_tokens, k, k1, b)
+
+
+class _PartitionScorer(_BM25Scorer):
+    """_BM25Scorer trên postings của một partition, dùng idf/avgdl của toàn index."""
+
+    pad_zero_scores = False
+
+    def __init__(self, partitions, view, parts):
+        self.partitions = partitions
+        self.view = view
+        self.parts = parts
+        self.term_ids = view.term_ids
+        self.idf = view.idf
+        self.max_tf = view.max_tf
+        self.n_docs = view.n_docs
+        self.deleted_ids = view.deleted_ids
+        self.tombstone_ids = view.tombstone_ids
+
+    def _doc_norm(self, k1, b):
+        return self.view._doc_norm(k1, b)
+
+    def _postings(self, tid):
+        return self.partitions.postings(self.view, tid, self.parts)
@@ -2,12 +2,19 @@ import os
 import json
 import string
 import re
-from rank_bm25 import BM25Okapi
-from unidecode import unidecode
+import time
+import hashlib
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from .config import (
     STOPWORDS_FILE, BASE_DIR, LAW_SHORT_NAMES,
-    BM25_K1, BM25_B, BM25_TOPK
+    BM25_K1, BM25_B, BM25_TOPK, BM25_PERSIST_INDEX, TOKENIZER_CACHE_SIZE,
+    BM25_DELTA_MERGE_DOCS, BM25_TOMBSTONE_MERGE_DOCS, BM25_LAW_PARTITION, BM25_PARTITION_FALLBACK, CITATION_MAX_CLAUSES
 )
+from .bm25_tokenizer import VietnameseTokenizer, law_token_of, parse_citations
+from .bm25_metadata import MetadataStore
+from .bm25_index import BM25Index, LiveBM25Index, BM25Partitions, file_sha256, INDEX_FORMAT_VERSION
 
 # ============================================================
 # Load stopwords
@@ -20,7 +27,14 @@ def load_stopwords(file_path=STOPWORDS_FILE):
             return set([line.strip().lower() for line in f if line.strip()])
     return set()
 
-STOPWORDS = load_stopwords()
+_stopwords = None
+
+def get_stopwords():
+    """Stopwords từ STOPWORDS_FILE, đọc lần đầu khi cần (import module không đọc file)."""
+    global _stopwords
+    if _stopwords is None:
+        _stopwords = load_stopwords()
+    return _stopwords
 
 # ============================================================
 # Text preprocessing
@@ -36,97 +50,429 @@ def normalize_text(text):
         text = text.replace(p, ' ')
     return text.lower()
 
+_tokenizer = None
+
+def get_tokenizer():
+    """VietnameseTokenizer dùng chung (precompiled patterns, Aho-Corasick cho LAW_SHORT_NAMES, LRU cache query)."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = VietnameseTokenizer(get_stopwords(), LAW_SHORT_NAMES, cache_size=TOKENIZER_CACHE_SIZE)
+    return _tokenizer
+
 def custom_tokenizer(text):
-    text = clean_text(text)
-    text = normalize_text(text)
+    return get_tokenizer().tokenize(text)
 
-    law_token = ""
-    for name in LAW_SHORT_NAMES:
-        if name in text:
-            law_token = "_".join(unidecode(name).split())
-            text = text.replace(name, "")
-            break
+# Tăng khi thay đổi logic custom_tokenizer để index đã lưu được build lại
+TOKENIZER_VERSION = 1
 
-    text = re.sub(r"điều\s*(\d+)", r"dieu_\1", text, flags=re.IGNORECASE)
-    text = re.sub(r"khoản\s*(\d+)", r"khoan_\1", text, flags=re.IGNORECASE)
+def tokenizer_fingerprint():
+    """Hash cấu hình tokenizer (version, law short names, stopwords)."""
+    payload = json.dumps({
+        "version": TOKENIZER_VERSION,
+        "law_short_names": LAW_SHORT_NAMES,
+        "stopwords": sorted(get_stopwords()),
+    }, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    if law_token:
-        text = law_token + " " + text.strip()
+# ============================================================
+# Khóa chỉ mục trích dẫn: partition | article_id | clause_no, mỗi trường 21 bit trong một int64
+# ============================================================
+_CITATION_BITS = 21
+_CITATION_FIELD = 1 << _CITATION_BITS
 
-    words = text.split()
-    return [w for w in words if w not in STOPWORDS]
+def _citation_key(part, article_id, clause_no):
+    return (part << (2 * _CITATION_BITS)) | (article_id << _CITATION_BITS) | clause_no
 
 # ============================================================
 # BM25 Retriever Class
 # ============================================================
 class BM25Retriever:
-    def __init__(self, jsonl_path=None):
+    def __init__(self, jsonl_path=None, index_dir=None, persist=BM25_PERSIST_INDEX):
         self.index = None
         self.metadata = None
+        self.persist = persist
+        self.jsonl_path = None
+        self.index_dir = None
+        self._doc_ids = None
+        self.source_fingerprint = None
+        # Tăng mỗi lần corpus thay đổi (add/upsert/delete), dùng để invalidate cache phía trên
+        self.version = 0
+        self._update_lock = threading.Lock()
         if jsonl_path is not None:
-            self.init_index(jsonl_path)
+            self.init_index(jsonl_path, index_dir=index_dir)
 
-    def init_index(self, jsonl_path):
+    def index_stamp(self):
+        """Stamp phiên bản corpus: đổi khi file nguồn, tokenizer hoặc index (add/upsert/delete) thay đổi."""
+        return f"{self.source_fingerprint}-v{self.version}"
+
+    @staticmethod
+    def default_index_dir(jsonl_path):
+        return os.path.splitext(jsonl_path)[0] + ".bm25"
+
+    def init_index(self, jsonl_path, index_dir=None):
+        """
+        Load index BM25 cho jsonl_path.
+        Nếu index đã lưu trên đĩa khớp checksum file nguồn + cấu hình tokenizer thì memory-map lại
+        (cùng metadata, partition và chỉ mục trích dẫn, không đọc lại JSONL), ngược lại tokenize
+        toàn bộ corpus, build index mới và lưu ra đĩa.
+        """
         if not os.path.isabs(jsonl_path):
             jsonl_path = os.path.join(BASE_DIR, jsonl_path)
         if not os.path.exists(jsonl_path):
             raise FileNotFoundError(f"BM25 JSONL file not found: {jsonl_path}")
+        if index_dir is None:
+            index_dir = self.default_index_dir(jsonl_path)
+        self.jsonl_path = jsonl_path
+        self.index_dir = index_dir
+
+        start = time.time()
+        stat = os.stat(jsonl_path)
+        source = {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+        expected = {
+            "format_version": INDEX_FORMAT_VERSION,
+            "tokenizer": tokenizer_fingerprint(),
+        }
+
+        index = None
+        saved = BM25Index.read_meta(index_dir) if self.persist else None
+        if saved and all(saved.get(k) == v for k, v in expected.items()):
+            # size + mtime của file nguồn không đổi: dùng checksum đã lưu thay vì hash lại cả file
+            if all(saved.get(k) == v for k, v in source.items()):
+                expected["source_sha256"] = saved.get("source_sha256")
+            else:
+                expected["source_sha256"] = file_sha256(jsonl_path)
+            if saved.get("source_sha256") == expected["source_sha256"]:
+                index, metadata, law_tokens = self._load_saved(index_dir)
+                action = "Mapped"
+
+        if index is None:
+            expected.setdefault("source_sha256", file_sha256(jsonl_path))
+            meta = []
+            with open(jsonl_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        meta.append(json.loads(line))
+            tokenized = get_tokenizer().tokenize_many([item["clause_text"] for item in meta])
+            index = BM25Index.build(tokenized, meta=dict(expected, source_path=jsonl_path, **source))
+            # list dict chỉ dùng lúc khởi tạo; khi chạy giữ metadata dạng cột, text hiển thị tính sẵn
+            metadata = MetadataStore.from_items(meta)
+            law_tokens = {}
+            for doc_id, item in enumerate(meta):
+                for token in self._law_tokens_of(item):
+                    law_tokens.setdefault(token, set()).add(metadata.law_titles.column[doc_id])
+            law_tokens = {token: sorted(parts) for token, parts in law_tokens.items()}
+            action = "Built"
+            if self.persist:
+                def sidecar(tmp_dir):
+                    metadata.save(os.path.join(tmp_dir, "metadata"))
+                    with open(os.path.join(tmp_dir, "partitions.json"), "w", encoding="utf-8") as f:
+                        json.dump(law_tokens, f, ensure_ascii=False)
+                if not index.save(index_dir, sidecar=sidecar):
+                    # worker khác build xong trước: dùng index của nó (memory-map) nếu cùng nguồn
+                    saved = BM25Index.read_meta(index_dir)
+                    if saved and all(saved.get(k) == v for k, v in expected.items()):
+                        index, metadata, law_tokens = self._load_saved(index_dir)
+                        action = "Mapped"
+
+        self.index = LiveBM25Index(index)
+        self.source_fingerprint = f"{expected['source_sha256'][:16]}-{expected['tokenizer'][:8]}"
+        self.metadata = metadata
+        self._doc_ids = None
+        self._init_partitions(law_tokens)
+        self._init_citations()
+        self.version += 1
+        print(f"[BM25] {action} index for {len(metadata)} documents from {jsonl_path} ({time.time() - start:.3f}s)")
+
+    @staticmethod
+    def _load_saved(index_dir):
+        """Index, metadata và partition đã lưu trong index_dir (memory-map)."""
+        index = BM25Index.load(index_dir)
+        # metadata dạng cột lưu cùng index, memory-map: các worker dùng chung page cache
+        metadata = MetadataStore.load(os.path.join(index_dir, "metadata"))
+        with open(os.path.join(index_dir, "partitions.json"), "r", encoding="utf-8") as f:
+            law_tokens = json.load(f)
+        return index, metadata, law_tokens
+
+    @property
+    def doc_ids(self):
+        """id -> [doc id] của các document chưa xóa; build lần đầu khi cần (add/upsert/delete)."""
+        if self._doc_ids is None:
+            doc_ids = {}
+            for doc_id in range(len(self.metadata)):
+                if not self.metadata.is_deleted(doc_id):
+                    doc_ids.setdefault(self.metadata.ids[doc_id], []).append(doc_id)
+            self._doc_ids = doc_ids
+        return self._doc_ids
+
+    # --------------------------------------------------------
+    # Cập nhật index không cần build lại
+    # --------------------------------------------------------
+    def add_documents(self, items):
+        """
+        Thêm document (dict cùng schema với keywords_db.jsonl) vào delta segment của index.
+        Khi delta đạt BM25_DELTA_MERGE_DOCS document thì merge ở thread nền.
+        Index trên đĩa không bị sửa: lần load sau, checksum file nguồn thay đổi sẽ build lại.
+        """
+        self._require_index()
+        items = list(items)
+        tokenized = get_tokenizer().tokenize_many([item.get("clause_text", "") for item in items])
+        with self._update_lock:
+            self._add_locked(items, tokenized)
+        self._maybe_merge()
+        return len(items)
+
+    def delete_documents(self, ids):
+        """
+        Xóa mọi document có id nằm trong `ids`, trả về số document đã xóa. Khi có đủ
+        BM25_TOMBSTONE_MERGE_DOCS document đã xóa chưa merge thì merge ở thread nền.
+        """
+        self._require_index()
+        with self._update_lock:
+            deleted = self._delete_locked(ids)
+        self._maybe_merge()
+        return deleted
+
+    def upsert_documents(self, items):
+        """
+        Thay document cùng id (nếu có) bằng bản mới. Xóa và thêm nằm trong cùng một lần giữ lock
+        của index: search đồng thời thấy bản cũ hoặc bản mới, không bao giờ thiếu điều khoản.
+        """
+        self._require_index()
+        items = list(items)
+        tokenized = get_tokenizer().tokenize_many([item.get("clause_text", "") for item in items])
+        with self._update_lock, self.index.atomic():
+            self._delete_locked([item.get("id") for item in items])
+            self._add_locked(items, tokenized)
+        self._maybe_merge()
+        return len(items)
+
+    def _add_locked(self, items, tokenized):
+        doc_ids = self.doc_ids
+        for item, tokens in zip(items, tokenized):
+            # metadata (cả partition: mã law_title) phải có trước khi doc id xuất hiện trong kết quả search
+            self.metadata.append(item)
+            doc_id = self.index.add(tokens)
+            for token in self._law_tokens_of(item):
+                self.partition_of_token.setdefault(token, set()).add(self.doc_part[doc_id])
+            self._index_citation(doc_id)
+            doc_ids.setdefault(self.metadata.ids[doc_id], []).append(doc_id)
+        self.version += 1
 
-        docs, meta = [], []
-        with open(jsonl_path, "r", encoding="utf-8") as f:
-            for line in f:
-                item = json.loads(line)
-                docs.append(item["clause_text"])
-                meta.append(item)
+    def _delete_locked(self, ids):
+        tokenizer = get_tokenizer()
+        deleted = 0
+        for item_id in ids:
+            for doc_id in self.doc_ids.pop(str(item_id), []):
+                tokens = tokenizer.tokenize(self.metadata.clause_text(doc_id))
+                if self.index.delete(doc_id, tokens):
+                    self.metadata.delete(doc_id)
+                    deleted += 1
+        if deleted:
+            self.version += 1
+        return deleted
 
-        tokenized = [custom_tokenizer(doc) for doc in docs]
-        self.index = BM25Okapi(tokenized, k1=BM25_K1, b=BM25_B)
-        self.metadata = meta
-        print(f"[BM25] Loaded {len(docs)} documents from {jsonl_path}")
+    # --------------------------------------------------------
+    # Partition theo law_title
+    # --------------------------------------------------------
+    def _init_partitions(self, law_tokens):
+        # partition id của document = mã intern law_title trong metadata (cột lưu cùng index)
+        self.partition_ids = self.metadata.law_titles.codes()    # law_title -> partition id
+        self.doc_part = self.metadata.law_titles.column
+        # law token (vd. "luat_lao_dong") -> set partition id: nhiều law_title có thể cùng một tag
+        # (luật gốc và văn bản sửa đổi / hợp nhất), search theo luật chấm điểm trên hợp các partition
+        self.partition_of_token = {token: set(parts) for token, parts in law_tokens.items()}
+        self.partitions = BM25Partitions(self.index, self.doc_part)
 
-    def search(self, text, top_k=BM25_TOPK):
+    @staticmethod
+    def _law_tokens_of(item):
+        """Law token của document: tag đầu clause_text (vd. "luat_lao_dong dieu_6 ...") và law_title."""
+        tag = item.get("clause_text", "").split(" ", 1)[0]
+        tokens = (tag, law_token_of(item.get("law_title", "").lower()))
+        return [token for token in tokens if "_" in token and token.isascii() and token.islower()]
+
+    def partitions_of(self, law_token):
+        """Tuple partition id (tăng dần) của law token, hoặc None."""
+        parts = self.partition_of_token.get(law_token)
+        return tuple(sorted(parts)) if parts else None
+
+    def query_partition(self, query_tokens):
+        """Các partition của luật được nêu trong query (law token do tokenizer sinh ra), hoặc None."""
+        for token in query_tokens:
+            parts = self.partitions_of(token)
+            if parts is not None:
+                return parts
+        return None
+
+    def _partition_top_k(self, parts, query_tokens, top_k):
+        """
+        Chỉ chấm điểm postings của các partition `parts`. Nếu có ít hơn top_k document khớp thì xử lý
+        theo BM25_PARTITION_FALLBACK: "fill" bù bằng kết quả global, "global" dùng kết quả global,
+        None giữ nguyên kết quả của partition.
+        """
+        ranked = self.partitions.top_k(parts, query_tokens, top_k, k1=BM25_K1, b=BM25_B)
+        if len(ranked) >= top_k or not BM25_PARTITION_FALLBACK:
+            return ranked
+        global_ranked = self.index.top_k(query_tokens, top_k, k1=BM25_K1, b=BM25_B)
+        if BM25_PARTITION_FALLBACK == "global":
+            return global_ranked
+        seen = {doc_id for doc_id, _ in ranked}
+        return ranked + [r for r in global_ranked if r[0] not in seen][:top_k - len(ranked)]
+
+    # --------------------------------------------------------
+    # Tra cứu trích dẫn (luật, điều, khoản)
+    # --------------------------------------------------------
+    def _init_citations(self):
+        """
+        Chỉ mục trích dẫn build từ các cột metadata (không cần dict từng dòng): khóa
+        (partition, article_id, clause_no) đóng gói thành int64, sắp xếp cùng doc id, tra bằng
+        binary search. Document thêm lúc chạy và dòng có article_id/clause_no ngoài các cột int
+        (lưu trong extra) nằm trong clause_index/article_index.
+        """
+        n = len(self.metadata)
+        part = np.asarray(self.doc_part[:n], dtype=np.int64)
+        article = np.asarray(self.metadata.article_ids[:n], dtype=np.int64)
+        clause = np.asarray(self.metadata.clause_nos[:n], dtype=np.int64)
+        packed = (article >= 0) & (article < _CITATION_FIELD) & (clause >= 0) & (clause < _CITATION_FIELD)
+        keys = _citation_key(part[packed], article[packed], clause[packed])
+        order = np.argsort(keys, kind="stable")
+        self._citation_keys = keys[order]
+        self._citation_docs = np.flatnonzero(packed)[order]
+
+        self.clause_index = {}    # (partition, article_id, clause_no) -> [doc_id]
+        self.article_index = {}   # (partition, article_id) -> [doc_id]
+        for doc_id in np.flatnonzero(~packed):
+            self._index_citation(int(doc_id))
+
+    def _index_citation(self, doc_id):
+        try:
+            article_id = int(self.metadata.article_id(doc_id))
+            clause_no = int(self.metadata.clause_no(doc_id))
+        except (TypeError, ValueError):
+            return
+        part = int(self.doc_part[doc_id])
+        self.clause_index.setdefault((part, article_id, clause_no), []).append(doc_id)
+        self.article_index.setdefault((part, article_id), []).append(doc_id)
+
+    def _cited_docs(self, part, article_id, clause_no):
+        """Doc id của khoản (part, article_id, clause_no); clause_no None: mọi khoản của điều, theo thứ tự khoản."""
+        found = []
+        if 0 <= article_id < _CITATION_FIELD and (clause_no is None or 0 <= clause_no < _CITATION_FIELD):
+            lo = _citation_key(part, article_id, clause_no or 0)
+            hi = lo + (_CITATION_FIELD if clause_no is None else 1)
+            i, j = np.searchsorted(self._citation_keys, (lo, hi))
+            found = self._citation_docs[i:j].tolist()
+        if clause_no is None:
+            extra = self.article_index.get((part, article_id))
+            if extra:
+                found = sorted(sorted(found + extra), key=self.metadata.clause_no)
+        else:
+            extra = self.clause_index.get((part, article_id, clause_no))
+            if extra:
+                found = sorted(found + extra)
+        return found
+
+    def lookup_citations(self, text, max_clauses=CITATION_MAX_CLAUSES):
+        """
+        Query trích dẫn trực tiếp ("Điều 6 Khoản 2 luật lao động", "khoản 2 điều 6 ...") -> các khoản
+        được trích, theo cùng format với search() (score None). Trích cả điều ("Điều 6 luật lao động")
+        -> mọi khoản của điều đó theo thứ tự khoản (tối đa max_clauses).
+        Query nêu nhiều luật ("so sánh Điều 5 luật doanh nghiệp với Điều 7 luật đầu tư"): mỗi trích
+        dẫn tra trong luật gần nó nhất (xem VietnameseTokenizer.citations_by_law).
+        Trả về None nếu query không nêu luật + điều, hoặc có trích dẫn không tìm thấy trong DB.
+        """
+        self._require_index()
+        tokenizer = get_tokenizer()
+        by_law = tokenizer.citations_by_law(text)
+        if by_law is None:
+            query_tokens = tokenizer.tokenize_query(text)
+            citations = parse_citations(query_tokens)
+            parts = self.query_partition(query_tokens) if citations else None
+            by_law = [(parts, citations)] if parts is not None else []
+        else:
+            by_law = [(self.partitions_of(law_token), citations) for law_token, citations in by_law]
+        if not by_law or any(parts is None for parts, _ in by_law):
+            return None
+
+        doc_ids = []
+        for parts, citations in by_law:
+            for article_id, clause_no in citations:
+                found = [d for part in parts for d in self._cited_docs(part, article_id, clause_no)
+                         if not self.metadata.is_deleted(d)]
+                if not found:
+                    return None
+                doc_ids.extend(d for d in found if d not in doc_ids)
+        return self._format_results([(doc_id, None) for doc_id in doc_ids[:max_clauses]])
+
+    def _maybe_merge(self):
+        # merge khi delta đủ lớn, hoặc khi đủ nhiều tombstone (bỏ postings của document đã xóa)
+        if (BM25_DELTA_MERGE_DOCS and self.index.n_delta >= BM25_DELTA_MERGE_DOCS) or \
+                (BM25_TOMBSTONE_MERGE_DOCS and self.index.n_tombstones >= BM25_TOMBSTONE_MERGE_DOCS):
+            self.index.merge_in_background()
+
+    def _require_index(self):
         if self.index is None:
             raise RuntimeError("BM25 index not initialized. Call init_index() first or provide jsonl_path at class init.")
-        
-        query_tokens = custom_tokenizer(text)
-        scores = self.index.get_scores(query_tokens)
-        ranked = sorted(enumerate(scores), key=lambda x: x[1], reverse=True)[:top_k]
-
-        results = []
-        for idx, score in ranked:
-            meta = self.metadata[idx]
-
-            # Xử lý clause_text: bỏ tag cũ (lấy từ space thứ 3 trở đi)
-            clause_text = meta.get("clause_text", "")
-            parts = clause_text.split(" ", 3)
-            if len(parts) >= 4:
-                actual_text = parts[3].strip()
-            else:
-                actual_text = clause_text
 
-            # Thêm prefix "Khoản a, Điều b, Luật c:"
-            clause_no = meta.get("clause_no", "")
-            article_title = meta.get("article_title", "")
-            law_title = meta.get("law_title", "")
+    def search(self, text, top_k=BM25_TOPK, law_partition=BM25_LAW_PARTITION):
+        self._require_index()
+
+        query_tokens = get_tokenizer().tokenize_query(text)
+        parts = self.query_partition(query_tokens) if law_partition else None
+        if parts is not None:
+            # Query nêu tên luật: chỉ chấm điểm các điều khoản của luật đó
+            ranked = self._partition_top_k(parts, query_tokens, top_k)
+        else:
+            # Top-k có pruning: chỉ duyệt postings của các term trong query, không sort toàn corpus
+            ranked = self.index.top_k(query_tokens, top_k, k1=BM25_K1, b=BM25_B)
+        return self._format_results(ranked)
 
-            if str(clause_no) == "0":
-                prefix = f"{article_title}, {law_title}:"
+    def search_many(self, queries, top_k=BM25_TOPK, workers=1, chunk_size=256, law_partition=BM25_LAW_PARTITION):
+        """
+        search() cho cả list query (eval, sinh dữ liệu), trả về list kết quả theo đúng thứ tự.
+        Tokenize theo batch, chấm điểm cả batch bằng nhân ma trận thưa (BM25Index.top_k_many).
+        workers > 1: chia batch cho process pool, mỗi worker memory-map lại index đã lưu
+        (chỉ khi index được persist và chưa có cập nhật lúc chạy).
+        """
+        self._require_index()
+        queries = list(queries)
+        if workers > 1 and len(queries) > chunk_size and self.persist and not self.index.modified:
+            chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_search_worker,
+                                     initargs=(self.jsonl_path, self.index_dir)) as pool:
+                parts = pool.map(_search_worker_chunk, chunks, [top_k] * len(chunks), [law_partition] * len(chunks))
+                return [results for part in parts for results in part]
+
+        tokenized = get_tokenizer().tokenize_many(queries, use_cache=True)
+        ranked = [None] * len(tokenized)
+        batch = []
+        for i, tokens in enumerate(tokenized):
+            parts = self.query_partition(tokens) if law_partition else None
+            if parts is None:
+                batch.append(i)
             else:
-                prefix = f"Khoản {clause_no}, {article_title}, {law_title}:"
+                ranked[i] = self._partition_top_k(parts, tokens, top_k)
+        batch_ranked = self.index.top_k_many([tokenized[i] for i in batch], top_k, k1=BM25_K1, b=BM25_B,
+                                             chunk_size=chunk_size)
+        for i, r in zip(batch, batch_ranked):
+            ranked[i] = r
+        return [self._format_results(r) for r in ranked]
+
+    def _format_results(self, ranked):
+        # chỉ hydrate dict cho các document trong top-k (theo index lúc chấm điểm: document bị xóa
+        # sau đó vẫn trả về, như search chạy trước lần xóa)
+        return [self.metadata.result(idx, score) for idx, score in ranked]
 
-            full_text = f"{prefix} {actual_text}"
+# ============================================================
+# Process pool cho search_many
+# ============================================================
+_worker_retriever = None
 
-            results.append({
-                "id": meta["id"],
-                "score": float(score),
-                "law_title": law_title,
-                "article_title": article_title,
-                "clause_no": clause_no,
-                "article_link": meta.get("article_link", ""), 
-                "text": full_text
-            })
+def _init_search_worker(jsonl_path, index_dir):
+    global _worker_retriever
+    _worker_retriever = BM25Retriever(jsonl_path=jsonl_path, index_dir=index_dir)
 
-        return results
+def _search_worker_chunk(queries, top_k, law_partition):
+    return _worker_retriever.search_many(queries, top_k, law_partition=law_partition)
 
 # ============================================================
 # TEST
@@ -0,0 +1,332 @@
+# src/bm25_metadata.py
+import os
+import json
+import mmap
+from array import array
+import numpy as np
+
+# Cột số nguyên không có giá trị (hoặc giá trị không phải số, lưu nguyên bản trong extra)
+_MISSING = -1
+
+_COLUMNS = ("id", "law_title", "article_id", "article_title", "article_link", "clause_no", "clause_text")
+
+
+def display_parts(item):
+    """
+    (prefix, start, end) của text hiển thị "Khoản a, Điều b, Luật c: <nội dung>": nội dung là
+    clause_text[start:end] (bỏ tag ở 3 từ đầu clause_text), text hiển thị = prefix + " " + nội dung.
+    """
+    # Xử lý clause_text: bỏ tag cũ (lấy từ space thứ 3 trở đi)
+    clause_text = item.get("clause_text", "")
+    parts = clause_text.split(" ", 3)
+    if len(parts) >= 4:
+        rest = parts[3]
+        start = len(clause_text) - len(rest) + (len(rest) - len(rest.lstrip()))
+        end = start + len(rest.strip())
+    else:
+        start, end = 0, len(clause_text)
+
+    prefix = display_prefix(item.get("clause_no", ""), item.get("article_title", ""), item.get("law_title", ""))
+    return prefix, start, end
+
+
+def display_prefix(clause_no, article_title, law_title):
+    """Prefix "Khoản a, Điều b, Luật c:" của text hiển thị (clause_no 0: cả điều, bỏ "Khoản")."""
+    if clause_no is None:
+        clause_no = ""
+    if str(clause_no) == "0":
+        return f"{article_title}, {law_title}:"
+    return f"Khoản {clause_no}, {article_title}, {law_title}:"
+
+
+# ============================================================
+# Column helpers
+# ============================================================
+_NUMPY_DTYPES = {"i": np.int32, "q": np.int64}
+
+
+class _IntColumn:
+    """
+    Cột int: `array` khi build / append, hoặc ndarray memory-map khi load từ đĩa (các worker dùng
+    chung page cache, không chép). Lần append đầu tiên vào cột memory-map thì chép ra `array`.
+    """
+
+    def __init__(self, typecode, data=None):
+        self.typecode = typecode
+        self.data = array(typecode) if data is None else data
+
+    def append(self, value):
+        if not isinstance(self.data, array):
+            data = array(self.typecode)
+            data.frombytes(np.ascontiguousarray(self.data).tobytes())
+            self.data = data
+        self.data.append(value)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __len__(self):
+        return len(self.data)
+
+    def nbytes(self):
+        return self.data.itemsize * len(self.data)
+
+    def save(self, path):
+        np.save(path, np.asarray(self.data, dtype=_NUMPY_DTYPES[self.typecode]))
+
+    @classmethod
+    def load(cls, typecode, path, mmap_mode="r"):
+        return cls(typecode, np.load(path, mmap_mode=mmap_mode).view(np.ndarray))
+
+
+def _map_bytes(path):
+    """Nội dung file dạng read-only mmap (slice trả về bytes), b"" nếu file rỗng."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _StringTable:
+    """Cột string lặp lại nhiều (law_title, article_title, link): mỗi giá trị lưu một lần, cột là mã int."""
+
+    def __init__(self, values=None, column=None):
+        self.values = [] if values is None else values
+        self._codes = None
+        self.column = _IntColumn("i") if column is None else column
+
+    def codes(self):
+        """value -> mã int, build lần đầu khi cần (load từ đĩa chỉ có list giá trị)."""
+        if self._codes is None:
+            self._codes = {value: code for code, value in enumerate(self.values)}
+        return self._codes
+
+    def append(self, value):
+        codes = self.codes()
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values)
+            self.values.append(value)
+        self.column.append(code)
+        return code
+
+    def __getitem__(self, row):
+        return self.values[self.column[row]]
+
+
+class _TextColumn:
+    """Cột string gần như không lặp lại: một blob UTF-8 liên tục + offsets."""
+
+    def __init__(self, blob=None, offsets=None):
+        self.blob = bytearray() if blob is None else blob
+        self.offsets = _IntColumn("q", array("q", [0])) if offsets is None else offsets
+
+    def append(self, value):
+        if not isinstance(self.blob, bytearray):
+            # blob memory-map: chép ra bytearray ở lần append đầu tiên
+            self.blob = bytearray(self.blob)
+        self.blob += value.encode("utf-8")
+        self.offsets.append(len(self.blob))
+
+    def __getitem__(self, row):
+        return self.blob[self.offsets[row]:self.offsets[row + 1]].decode("utf-8")
+
+    def nbytes(self):
+        return len(self.blob) + self.offsets.nbytes()
+
+    def save(self, path):
+        with open(f"{path}.bin", "wb") as f:
+            f.write(self.blob)
+        self.offsets.save(f"{path}.offsets.npy")
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        if mmap_mode:
+            blob = _map_bytes(f"{path}.bin")
+        else:
+            with open(f"{path}.bin", "rb") as f:
+                blob = bytearray(f.read())
+        return cls(blob, _IntColumn.load("q", f"{path}.offsets.npy", mmap_mode))
+
+
+# ============================================================
+# Metadata store
+# ============================================================
+class MetadataStore:
+    """
+    Metadata của các clause theo doc id, lưu dạng cột thay cho list dict:
+
+    - law_title, article_title, article_link: intern (mã int32 + bảng giá trị)
+    - article_id, clause_no:                  int32
+    - id, clause_text:                        blob UTF-8 + offsets
+    - display text ("Khoản X, Điều Y, Luật Z: ..."): lúc build chỉ lưu khoảng byte của nội dung trong
+      blob clause_text; prefix dựng lại khi hydrate từ clause_no + mã intern article_title / law_title
+      (prefix gần như khác nhau theo từng khoản, intern không tiết kiệm gì)
+
+    Dict kết quả chỉ được tạo (hydrate) cho các doc id trong top-k. Field khác ngoài các cột trên
+    (hiếm) được giữ trong `extra`.
+
+    save()/load() ghi các cột ra một thư mục (.npy, blob .bin, bảng intern trong tables.json) và
+    memory-map lại khi load, nên nhiều worker cùng load một index không giữ bản sao riêng.
+    """
+
+    _TABLES = ("law_titles", "article_titles", "article_links")
+    _TEXTS = ("ids", "clause_texts")
+    _INTS = (("article_ids", "i"), ("clause_nos", "i"), ("text_spans", "q"))
+
+    def __init__(self):
+        self.ids = _TextColumn()
+        self.law_titles = _StringTable()
+        self.article_titles = _StringTable()
+        self.article_links = _StringTable()
+        self.article_ids = _IntColumn("i")
+        self.clause_nos = _IntColumn("i")
+        self.clause_texts = _TextColumn()
+        self.text_spans = _IntColumn("q")   # [start, end) byte của nội dung hiển thị trong blob clause_text
+        self.extra = {}
+        self.deleted = set()
+
+    @classmethod
+    def from_items(cls, items):
+        store = cls()
+        for item in items:
+            store.append(item)
+        return store
+
+    def __len__(self):
+        return len(self.article_ids)
+
+    # --------------------------------------------------------
+    # Persist
+    # --------------------------------------------------------
+    def save(self, store_dir):
+        """Ghi các cột vào store_dir (document đã xóa không được ghi nhận: chỉ lưu lúc build)."""
+        os.makedirs(store_dir, exist_ok=True)
+        for name in self._TABLES:
+            getattr(self, name).column.save(os.path.join(store_dir, f"{name}.npy"))
+        for name, _ in self._INTS:
+            getattr(self, name).save(os.path.join(store_dir, f"{name}.npy"))
+        for name in self._TEXTS:
+            getattr(self, name).save(os.path.join(store_dir, name))
+        tables = {name: getattr(self, name).values for name in self._TABLES}
+        tables["extra"] = {str(doc_id): extra for doc_id, extra in self.extra.items()}
+        with open(os.path.join(store_dir, "tables.json"), "w", encoding="utf-8") as f:
+            json.dump(tables, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, store_dir, mmap=True):
+        mode = "r" if mmap else None
+        with open(os.path.join(store_dir, "tables.json"), "r", encoding="utf-8") as f:
+            tables = json.load(f)
+        store = cls()
+        for name in cls._TABLES:
+            column = _IntColumn.load("i", os.path.join(store_dir, f"{name}.npy"), mode)
+            setattr(store, name, _StringTable(tables[name], column))
+        for name, typecode in cls._INTS:
+            setattr(store, name, _IntColumn.load(typecode, os.path.join(store_dir, f"{name}.npy"), mode))
+        for name in cls._TEXTS:
+            setattr(store, name, _TextColumn.load(os.path.join(store_dir, name), mode))
+        store.extra = {int(doc_id): extra for doc_id, extra in tables["extra"].items()}
+        return store
+
+    def append(self, item):
+        """Thêm một clause (dict cùng schema với keywords_db.jsonl), trả về doc id."""
+        doc_id = len(self)
+        extra = {k: v for k, v in item.items() if k not in _COLUMNS}
+        self.ids.append(str(item.get("id", "")))
+        self.law_titles.append(item.get("law_title", ""))
+        self.article_titles.append(item.get("article_title", ""))
+        self.article_links.append(item.get("article_link", ""))
+        for name, column in (("article_id", self.article_ids), ("clause_no", self.clause_nos)):
+            value = item.get(name)
+            if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+                column.append(value)
+            else:
+                column.append(_MISSING)
+                extra[name] = value
+
+        clause_text = item.get("clause_text", "")
+        _, start, end = display_parts(item)
+        start_byte = self.clause_texts.offsets[-1] + len(clause_text[:start].encode("utf-8"))
+        self.text_spans.append(start_byte)
+        self.text_spans.append(start_byte + len(clause_text[start:end].encode("utf-8")))
+        self.clause_texts.append(clause_text)
+
+        if extra:
+            self.extra[doc_id] = extra
+        return doc_id
+
+    def delete(self, doc_id):
+        self.deleted.add(doc_id)
+
+    def is_deleted(self, doc_id):
+        return doc_id in self.deleted
+
+    # --------------------------------------------------------
+    # Đọc
+    # --------------------------------------------------------
+    def _int_field(self, doc_id, name, column):
+        value = int(column[doc_id])
+        if value == _MISSING:
+            return self.extra.get(doc_id, {}).get(name, "")
+        return value
+
+    def article_id(self, doc_id):
+        return self._int_field(doc_id, "article_id", self.article_ids)
+
+    def clause_no(self, doc_id):
+        return self._int_field(doc_id, "clause_no", self.clause_nos)
+
+    def clause_text(self, doc_id):
+        return self.clause_texts[doc_id]
+
+    def display_text(self, doc_id):
+        start, end = self.text_spans[2 * doc_id], self.text_spans[2 * doc_id + 1]
+        prefix = display_prefix(self.clause_no(doc_id), self.article_titles[doc_id], self.law_titles[doc_id])
+        return prefix + " " + self.clause_texts.blob[start:end].decode("utf-8")
+
+    def get(self, doc_id):
+        """Dict metadata đầy đủ của doc_id (như dòng JSONL gốc), None nếu đã xóa."""
+        if doc_id in self.deleted:
+            return None
+        item = {
+            "law_title": self.law_titles[doc_id],
+            "article_id": self.article_id(doc_id),
+            "article_title": self.article_titles[doc_id],
+            "article_link": self.article_links[doc_id],
+            "clause_no": self.clause_no(doc_id),
+            "clause_text": self.clause_texts[doc_id],
+            "id": self.ids[doc_id],
+        }
+        item.update(self.extra.get(doc_id, {}))
+        return item
+
+    def result(self, doc_id, score):
+        """
+        Dict kết quả search cho doc_id (text hiển thị đã tính sẵn). Không kiểm tra xóa: dòng đã xóa
+        vẫn còn dữ liệu, và kết quả search phản ánh index tại lúc chấm điểm.
+        """
+        # truy cập thẳng các cột: hàm này nằm trên đường search, gọi cho từng kết quả top-k
+        ids, spans = self.ids, self.text_spans
+        clause_no = int(self.clause_nos[doc_id])
+        if clause_no == _MISSING:
+            clause_no = self.clause_no(doc_id)
+        law_title = self.law_titles.values[self.law_titles.column[doc_id]]
+        article_title = self.article_titles.values[self.article_titles.column[doc_id]]
+        start, end = spans[2 * doc_id], spans[2 * doc_id + 1]
+        return {
+            "id": ids.blob[ids.offsets[doc_id]:ids.offsets[doc_id + 1]].decode("utf-8"),
+            "score": None if score is None else float(score),
+            "law_title": law_title,
+            "article_title": article_title,
+            "clause_no": clause_no,
+            "article_link": self.article_links.values[self.article_links.column[doc_id]],
+            "text": display_prefix(clause_no, article_title, law_title) + " "
+                    + self.clause_texts.blob[start:end].decode("utf-8"),
+        }
+
+    def nbytes(self):
+        """Ước lượng bộ nhớ của các cột (không tính extra và bảng intern)."""
+        columns = (self.law_titles.column, self.article_titles.column, self.article_links.column,
+                   self.article_ids, self.clause_nos, self.text_spans)
+        return sum(c.nbytes() for c in columns) + self.ids.nbytes() + self.clause_texts.nbytes()
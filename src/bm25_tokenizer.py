@@ -0,0 +1,243 @@
+# src/bm25_tokenizer.py
+import re
+import string
+from functools import lru_cache
+from unidecode import unidecode
+
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick không bắt buộc, fallback về quét tuần tự
+    ahocorasick = None
+
+# ============================================================
+# Compiled patterns / tables
+# ============================================================
+_TAG_RE = re.compile(r"<.*?>")
+# Text đã lower() trước khi thay "điều N"/"khoản N", nên không cần IGNORECASE (chậm gấp đôi).
+# Ký tự duy nhất còn lại mà IGNORECASE khớp thêm là "ı" (dotless i) cho "i".
+_DIEU_RE = re.compile(r"đ[iı]ều\s*(\d+)")
+_KHOAN_RE = re.compile(r"khoản\s*(\d+)")
+# Token trích dẫn sau khi tokenize: "dieu_6", "khoan_2"
+_CITATION_TOKEN_RE = re.compile(r"(dieu|khoan)_(\d+)")
+# Trích dẫn trong text đã chuẩn hóa (chưa tokenize), đứng riêng thành từ như token "dieu_6"
+_CITATION_TEXT_RE = re.compile(r"(?<!\S)(đ[iı]ều|khoản)\s*(\d+)(?!\S)")
+
+# Với text tiếng Việt (non-ASCII), str.translate chậm hơn nhiều so với str.replace từng ký tự
+_PUNCTUATION = tuple(string.punctuation.replace("_", ""))
+
+
+def law_token_of(name):
+    """'luật lao động' -> 'luat_lao_dong'"""
+    return "_".join(unidecode(name).split())
+
+
+# ============================================================
+# Tokenizer
+# ============================================================
+class VietnameseTokenizer:
+    """
+    Tokenizer cho BM25, cho kết quả giống hệt custom_tokenizer cũ (xem tests/bm25_reference.py):
+    bỏ tag HTML, gộp khoảng trắng, bỏ dấu câu, lower, nhận diện tên luật (tên đầu tiên trong
+    law_short_names xuất hiện trong text), chuẩn hóa "điều N"/"khoản N" và lọc stopwords.
+
+    - tokenize(text):        không cache, dùng khi index document
+    - tokenize_query(text):  có LRU cache giới hạn `cache_size` cho query lặp lại
+    - tokenize_many(texts):  tokenize theo batch, text trùng chỉ tokenize một lần
+    """
+
+    def __init__(self, stopwords, law_short_names, cache_size=4096):
+        self.stopwords = frozenset(stopwords)
+        self.law_short_names = list(law_short_names)
+        self._law_tokens = [law_token_of(name) for name in self.law_short_names]
+
+        self._automaton = None
+        if ahocorasick is not None and self.law_short_names:
+            automaton = ahocorasick.Automaton()
+            for priority, name in enumerate(self.law_short_names):
+                # tên trùng lặp: giữ độ ưu tiên của lần xuất hiện đầu tiên như vòng for cũ
+                if name not in automaton:
+                    automaton.add_word(name, priority)
+            automaton.make_automaton()
+            self._automaton = automaton
+
+        self._cached = lru_cache(maxsize=cache_size)(self._tokenize_tuple)
+
+    def _find_law(self, text):
+        """Index của tên luật đầu tiên (theo thứ tự danh sách) xuất hiện trong text, hoặc None."""
+        if self._automaton is None:
+            for priority, name in enumerate(self.law_short_names):
+                if name in text:
+                    return priority
+            return None
+        best = None
+        for _, priority in self._automaton.iter(text):
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return best
+
+    def _law_mentions(self, text):
+        """
+        Các tên luật xuất hiện trong text đã chuẩn hóa -> list (start, end, law token) theo vị trí.
+        Hai tên chồng lên nhau thì giữ tên bắt đầu trước (cùng vị trí thì giữ tên dài hơn).
+        """
+        if self._automaton is None:
+            found = []
+            for priority, name in enumerate(self.law_short_names):
+                start = text.find(name)
+                while start >= 0:
+                    found.append((start, start + len(name), priority))
+                    start = text.find(name, start + 1)
+        else:
+            found = [(end + 1 - len(self.law_short_names[priority]), end + 1, priority)
+                     for end, priority in self._automaton.iter(text)]
+        found.sort(key=lambda m: (m[0], m[0] - m[1]))
+
+        mentions = []
+        for start, end, priority in found:
+            if mentions and start < mentions[-1][1]:
+                continue
+            mentions.append((start, end, self._law_tokens[priority]))
+        return mentions
+
+    def citations_by_law(self, text):
+        """
+        Trích dẫn theo từng luật cho query nêu nhiều luật ("so sánh Điều 5 luật doanh nghiệp với
+        Điều 7 luật đầu tư") -> list (law token, citations) theo thứ tự trích dẫn, citations như
+        parse_citations. Các "điều N"/"khoản N" liền nhau (không có tên luật xen giữa, vd. "khoản 2
+        điều 7") là một chuỗi trích dẫn, gắn với tên luật gần chuỗi nhất trong text (cách đều thì gắn
+        với tên luật đứng sau, như "Điều 5 luật X"); luật không có trích dẫn nào bị bỏ qua.
+
+        Trả về None nếu text nêu ít hơn hai luật khác nhau: khi đó tokenize() đã cho đúng law token
+        và dùng parse_citations trên token.
+        """
+        text = self._normalize(text)
+        mentions = self._law_mentions(text)
+        if len({token for _, _, token in mentions}) < 2:
+            return None
+
+        # chuỗi trích dẫn: [start, end, refs], tách khi có tên luật nằm giữa hai trích dẫn
+        chains = []
+        for m in _CITATION_TEXT_RE.finditer(text):
+            ref = ("dieu" if m.group(1) != "khoản" else "khoan", int(m.group(2)))
+            if chains and not any(chains[-1][1] <= m_start < m.start() for m_start, _, _ in mentions):
+                chains[-1][1] = m.end()
+                chains[-1][2].append(ref)
+            else:
+                chains.append([m.start(), m.end(), [ref]])
+
+        by_law = {}
+        for start, end, refs in chains:
+            # khoảng cách tới từng tên luật, cách đều thì ưu tiên tên đứng sau
+            _, law_token = min(
+                ((max(m_start - end, start - m_end, 0), m_start < start), token)
+                for m_start, m_end, token in mentions
+            )
+            by_law.setdefault(law_token, []).extend(group_citations(refs))
+        return [(law_token, list(dict.fromkeys(citations))) for law_token, citations in by_law.items()]
+
+    @staticmethod
+    def _normalize(text):
+        if "<" in text:
+            text = _TAG_RE.sub("", text)
+        # tương đương re.sub(r"\s+", " ", text.strip())
+        text = " ".join(text.split())
+        for p in _PUNCTUATION:
+            text = text.replace(p, " ")
+        return text.lower()
+
+    def tokenize(self, text):
+        text = self._normalize(text)
+
+        law_token = ""
+        priority = self._find_law(text)
+        if priority is not None:
+            law_token = self._law_tokens[priority]
+            text = text.replace(self.law_short_names[priority], "")
+
+        if "đ" in text:
+            text = _DIEU_RE.sub(r"dieu_\1", text)
+        if "khoản" in text:
+            text = _KHOAN_RE.sub(r"khoan_\1", text)
+
+        if law_token:
+            text = law_token + " " + text.strip()
+
+        stopwords = self.stopwords
+        return [w for w in text.split() if w not in stopwords]
+
+    def _tokenize_tuple(self, text):
+        return tuple(self.tokenize(text))
+
+    def tokenize_query(self, text):
+        return list(self._cached(text))
+
+    def tokenize_many(self, texts, use_cache=False):
+        tokenize = self.tokenize_query if use_cache else self.tokenize
+        memo = {}
+        results = []
+        for text in texts:
+            tokens = memo.get(text)
+            if tokens is None:
+                tokens = memo[text] = tokenize(text)
+            results.append(list(tokens))
+        return results
+
+    def cache_info(self):
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        self._cached.cache_clear()
+
+
+# ============================================================
+# Citation
+# ============================================================
+def parse_citations(tokens):
+    """
+    Trích dẫn trong query đã tokenize -> list (số điều, số khoản hoặc None nếu trích cả điều).
+
+    Khoản gắn với điều đứng trước ("điều 6 khoản 2 và khoản 3"), trừ khi trích dẫn bắt đầu bằng
+    khoản ("khoản 2 điều 6") thì khoản gắn với điều đứng sau.
+    """
+    refs = []
+    for tok in tokens:
+        m = _CITATION_TOKEN_RE.fullmatch(tok)
+        if m:
+            refs.append((m.group(1), int(m.group(2))))
+    return group_citations(refs)
+
+
+def group_citations(refs):
+    """List ("dieu" | "khoan", số) theo thứ tự trong query -> list (số điều, số khoản hoặc None)."""
+    if not refs:
+        return []
+
+    citations = []
+
+    def add(article, clauses):
+        if clauses:
+            citations.extend((article, c) for c in clauses)
+        else:
+            citations.append((article, None))
+
+    clauses = []
+    if refs[0][0] == "khoan":
+        for kind, number in refs:
+            if kind == "khoan":
+                clauses.append(number)
+            else:
+                add(number, clauses)
+                clauses = []
+    else:
+        article = None
+        for kind, number in refs:
+            if kind == "khoan":
+                clauses.append(number)
+                continue
+            if article is not None:
+                add(article, clauses)
+            article, clauses = number, []
+        add(article, clauses)
+    return list(dict.fromkeys(citations))
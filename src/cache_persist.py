@@ -0,0 +1,55 @@
+# src/cache_persist.py
+import os
+import tempfile
+import threading
+import numpy as np
+
+
+def save_npz(path, **arrays):
+    """
+    Ghi arrays ra file .npz: ghi vào file tạm tên duy nhất (mkstemp) trong cùng thư mục rồi rename,
+    nên nhiều lần ghi đồng thời (thread / process) không đụng file tạm của nhau.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.tmp-", suffix=".npz", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class BackgroundSaver:
+    """
+    Gọi `save()` ở một thread daemon thay vì trên thread xử lý request: request() chỉ đánh dấu và
+    trả về ngay, nhiều request liên tiếp trong lúc đang ghi được gộp thành một lần ghi tiếp theo.
+    Lần ghi cuối khi thoát vẫn do atexit (gọi save() trực tiếp) đảm nhận.
+    """
+
+    def __init__(self, save, name="cache-save"):
+        self._save = save
+        self._name = name
+        self._pending = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def request(self):
+        self._pending.set()
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            try:
+                self._save()
+            except Exception as e:
+                print(f"[CACHE] Background save ({self._name}) failed: {e}")
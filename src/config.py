@@ -16,6 +16,20 @@ MONGO_COLLECTION = os.environ.get("MONGO_COLLECTION")
 PINECONE_API_KEY = os.environ.get("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.environ.get("PINECONE_INDEX_NAME")
 PINECONE_TOP_K = 5
+
+# ----------------- Vector backend -----------------
+# "pinecone": query Pinecone qua mạng; "local": index IVF trong process (build bằng python -m src.vector_store);
+# "pq": index nén PQ/OPQ + re-rank exact (xem PQ_* bên dưới)
+VECTOR_BACKEND = "pinecone"
+LOCAL_VECTOR_INDEX_DIR = os.path.join(BASE_DIR, "data", "vector_index")
+# Số cụm IVF được duyệt mỗi query (nhiều hơn: recall cao hơn, chậm hơn)
+LOCAL_VECTOR_NPROBE = 16
+# Index nén PQ (VECTOR_BACKEND = "pq", build: python -m src.pq_index build <artifact>): số subspace
+# (mỗi vector còn PQ_SUBSPACES byte), có xoay OPQ hay không, số ứng viên được re-rank exact
+PQ_INDEX_DIR = os.path.join(BASE_DIR, "data", "pq_index")
+PQ_SUBSPACES = 64
+PQ_OPQ = True
+PQ_RERANK = 200
 # ----------------- HuggingFace -----------------
 HF_TOKEN = os.environ.get("HF_TOKEN")
 
@@ -26,6 +40,59 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 BM25_K1 = 1.0
 BM25_B = 0.2
 BM25_TOPK = 5
+# Lưu index BM25 ra đĩa (thư mục <tên file jsonl>.bm25 cạnh file nguồn) và memory-map khi load
+BM25_PERSIST_INDEX = True
+# Số document trong delta segment (add/upsert lúc chạy) trước khi merge vào index chính ở thread nền
+BM25_DELTA_MERGE_DOCS = 2000
+# Số document đã xóa (tombstone) chưa merge trước khi merge ở thread nền để bỏ postings của chúng
+BM25_TOMBSTONE_MERGE_DOCS = 2000
+# Query nêu tên luật (vd. "Theo luật lao động, ...") thì chỉ chấm điểm các điều khoản của luật đó
+BM25_LAW_PARTITION = True
+# Partition có ít hơn top_k kết quả: "fill" (bù bằng kết quả global), "global" (dùng kết quả global), None
+BM25_PARTITION_FALLBACK = "fill"
+# Số query đã tokenize được giữ trong LRU cache của tokenizer
+TOKENIZER_CACHE_SIZE = 4096
+
+# ----------------- Citation fast path -----------------
+# Query trích dẫn trực tiếp (luật + điều [+ khoản]) lấy thẳng điều khoản từ keywords DB,
+# bỏ qua embedding, Pinecone và RRF
+CITATION_FAST_PATH = True
+# Số khoản tối đa khi trích dẫn cả điều ("Điều N luật X" -> mọi khoản của Điều N)
+CITATION_MAX_CLAUSES = 30
+
+# ----------------- Retrieval song song -----------------
+# BM25 và vector search chạy song song; mỗi backend có hạn chót (giây) tính từ lúc bắt đầu retrieval.
+# Backend trễ hạn / lỗi bị bỏ, RRF chỉ dùng kết quả các backend đã trả về.
+# Hạn của "vector" tính cả thời gian embed query (embed chạy trong task vector, song song với BM25).
+RETRIEVAL_TIMEOUTS = {"bm25": 2.0, "vector": 3.0}
+# Số thread của mỗi backend (mỗi backend một pool riêng)
+RETRIEVAL_WORKERS = 8
+# Timeout phía client (giây) của một lần query Pinecone: request treo bị hủy thay vì giữ thread của pool
+PINECONE_REQUEST_TIMEOUT = 3.0
+
+# ----------------- Generation -----------------
+# Dừng decode ngay khi model sinh tới cụm clean_text sẽ cắt ("Câu hỏi:", "### Ngữ cảnh...", ...);
+# mỗi bước chỉ decode GEN_STOP_WINDOW_TOKENS token cuối để kiểm tra
+GEN_STOP_ON_CUTOFF = True
+GEN_STOP_WINDOW_TOKENS = 32
+# Số token mới tối đa mỗi câu trả lời
+GEN_MAX_NEW_TOKENS = 1024
+# Continuous batching: một scheduler giữ model, gộp câu trả lời của mọi session vào một batch decode
+# (tối đa GEN_MAX_BATCH sequence, hàng đợi GEN_QUEUE_SIZE prompt). False = mỗi chat_fn gọi gen_pipe riêng.
+# Chưa đo tokens/s trên model thật -> để mặc định tắt.
+GEN_SCHEDULER = False
+GEN_MAX_BATCH = 8
+GEN_QUEUE_SIZE = 256
+# Prefill các prompt mới theo nhóm: mỗi lần forward tối đa GEN_PREFILL_TOKENS token (số dòng x prompt dài nhất,
+# tính cả pad); prompt còn lại được prefill ở các bước decode sau để batch đang chạy không bị dừng lâu
+GEN_PREFILL_TOKENS = 8192
+
+# ----------------- Tracing -----------------
+# Đo thời gian từng stage của chat_fn / build_context theo request: p50/p95/p99 mỗi stage giữ trong
+# tracing.metrics (TRACE_HISTOGRAM_SIZE mẫu gần nhất), mỗi request ghi một dòng JSON vào TRACE_LOG_PATH (None = không ghi)
+TRACING_ENABLED = True
+TRACE_LOG_PATH = os.path.join(BASE_DIR, "logs", "traces.jsonl")
+TRACE_HISTOGRAM_SIZE = 2048
 
 # ----------------- RRF -----------------
 RRF_K = 60
@@ -33,9 +100,41 @@ RRF_K = 60
 # ----------------- Memory -----------------
 MAX_MEMORY_CHARS = 2000
 COSINE_THRESHOLD = 0.75
+# Cache retrieval theo query vector (mỗi session): số entry tối đa (LRU) và thời gian sống (giây, None = không hết hạn)
+RETRIEVAL_CACHE_SIZE = 256
+RETRIEVAL_CACHE_TTL = 3600
+# Cache retrieval dùng chung mọi session (thay cho cache riêng từng session): số entry tối đa và file lưu
+# lại qua restart (None = chỉ trong RAM). Bị xóa khi corpus BM25 / vector index thay đổi.
+SHARED_RETRIEVAL_CACHE = True
+SHARED_RETRIEVAL_CACHE_SIZE = 4096
+RETRIEVAL_CACHE_PATH = os.path.join(BASE_DIR, "data", "retrieval_cache.npz")
+# Cache câu trả lời (greedy decoding: cùng model + query + doc retrieve được thì cùng câu trả lời):
+# số câu trả lời tối đa (LRU) và thời gian sống (giây, None = không hết hạn). Bị xóa khi index / adapter đổi.
+ANSWER_CACHE = True
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 24 * 3600
 
 # ----------------- Embedding model -----------------
 EMBED_MODEL_NAME = "BAAI/bge-m3"
+# "torch": SentenceTransformer fp32 (GPU nếu có) | "onnx": bge-m3 int8 qua onnxruntime (CPU)
+EMBED_BACKEND = "torch"
+# Thư mục model ONNX (python -m src.onnx_embedder export)
+ONNX_EMBED_DIR = os.path.join(BASE_DIR, "models", "bge-m3-onnx-int8")
+# Số thread intra-op của onnxruntime (0 = mặc định: số core vật lý)
+ONNX_NUM_THREADS = 0
+# Batch size khi embed nhiều text (ingest, build index) và số token tối đa mỗi text
+EMBED_BATCH_SIZE = 32
+EMBED_MAX_LENGTH = 512
+# Gom query embed đồng thời (nhiều user) thành một batch: flush khi đủ EMBED_MAX_BATCH text hoặc
+# sau EMBED_MAX_WAIT_MS ms; hàng đợi tối đa EMBED_QUEUE_SIZE text. False = mỗi query encode riêng
+EMBED_MICRO_BATCHING = True
+EMBED_MAX_BATCH = 32
+EMBED_MAX_WAIT_MS = 5
+EMBED_QUEUE_SIZE = 1024
+# LRU cache embedding của query (theo text đã chuẩn hóa)
+EMBED_CACHE_SIZE = 4096
+# File lưu cache (vector float16) để dùng lại sau khi restart; None = chỉ giữ trong RAM
+EMBED_CACHE_PATH = os.path.join(BASE_DIR, "data", "embed_cache.npz")
 
 # ----------------- Law short names -----------------
 LAW_SHORT_NAMES = [
@@ -87,7 +186,7 @@ MODEL_OPTIONS = {
 
 # # ----------------- Stopwords -----------------
 
-STOPWORDS_FILE = os.path.join(BASE_DIR, r"data\vietnamese-stopwords.txt")
+STOPWORDS_FILE = os.path.join(BASE_DIR, "data", "vietnamese-stopwords.txt")
 MODEL_KEY = "qwen2-3b"
 if __name__ == "__main__":
     print("===== DEBUG CONFIG =====")
@@ -1,8 +1,6 @@
 # src/decontextualizer.py
 
-import time
 from typing import List
-import google.generativeai as genai
 from .config import GEMINI_API_KEY
 
 
@@ -0,0 +1,215 @@
+# src/embedding_artifact.py
+import os
+import json
+import shutil
+from datetime import datetime, timezone
+import numpy as np
+
+ARTIFACT_FORMAT_VERSION = 1
+
+
+class _BlobWriter:
+    """Cột string dạng blob UTF-8 + offsets int64 (ghi dần theo batch)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(f"{path}.bin", "wb")
+        self.offsets = [0]
+
+    def append(self, value):
+        data = value.encode("utf-8")
+        self.file.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self.file.close()
+        np.save(f"{self.path}.offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+
+
+class _BlobColumn:
+    def __init__(self, path, mmap=True):
+        self.offsets = np.load(f"{path}.offsets.npy", mmap_mode="r" if mmap else None)
+        size = int(self.offsets[-1])
+        if size == 0:
+            self.blob = b""
+        elif mmap:
+            self.blob = np.memmap(f"{path}.bin", dtype=np.uint8, mode="r")
+        else:
+            with open(f"{path}.bin", "rb") as f:
+                self.blob = f.read()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return bytes(self.blob[int(self.offsets[row]):int(self.offsets[row + 1])]).decode("utf-8")
+
+
+# ============================================================
+# Writer
+# ============================================================
+class EmbeddingArtifactWriter:
+    """
+    Ghi artifact embedding theo batch (ingest): thư mục gồm
+
+    - vectors.npy:                   ma trận (n, dim) float16 (mặc định) hoặc float32, memory-map được
+    - ids.bin + ids.offsets.npy:     id của từng dòng
+    - records.bin + records.offsets.npy: metadata của từng dòng (JSON)
+    - meta.json:                     format, dtype, dim, model, thời gian build
+
+    Ghi vào thư mục tạm, close() mới rename sang `path` (đọc song song không thấy artifact ghi dở).
+    Cần biết trước số dòng `n` để ghi thẳng vào vectors.npy bằng memmap.
+    """
+
+    def __init__(self, path, n, dtype="float16", meta=None):
+        self.path = os.path.abspath(path)
+        self.n = n
+        self.dtype = np.dtype(dtype)
+        self.meta = dict(meta or {})
+        self.tmp_dir = f"{self.path}.tmp-{os.getpid()}"
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+        self._vectors = None
+        self._rows = 0
+        self._ids = _BlobWriter(os.path.join(self.tmp_dir, "ids"))
+        self._records = _BlobWriter(os.path.join(self.tmp_dir, "records"))
+
+    def write(self, vectors, ids, records=None):
+        vectors = np.asarray(vectors)
+        if len(vectors) != len(ids):
+            raise ValueError(f"{len(vectors)} vectors for {len(ids)} ids")
+        if self._rows + len(vectors) > self.n:
+            raise ValueError(f"Artifact was created for {self.n} rows")
+        if self._vectors is None:
+            self._vectors = np.lib.format.open_memmap(
+                os.path.join(self.tmp_dir, "vectors.npy"), mode="w+", dtype=self.dtype,
+                shape=(self.n, vectors.shape[1]))
+        self._vectors[self._rows:self._rows + len(vectors)] = vectors
+        self._rows += len(vectors)
+        for i, doc_id in enumerate(ids):
+            self._ids.append(str(doc_id))
+            self._records.append(json.dumps(records[i] if records is not None else {}, ensure_ascii=False))
+
+    def close(self):
+        if self._rows != self.n:
+            raise ValueError(f"Artifact has {self._rows} rows, expected {self.n}")
+        if self._vectors is None:
+            np.save(os.path.join(self.tmp_dir, "vectors.npy"), np.zeros((0, 0), dtype=self.dtype))
+            dim = 0
+        else:
+            dim = int(self._vectors.shape[1])
+            self._vectors.flush()
+            self._vectors = None
+        self._ids.close()
+        self._records.close()
+
+        meta = dict(self.meta)
+        meta.update({
+            "format_version": ARTIFACT_FORMAT_VERSION,
+            "n_vectors": self.n,
+            "dim": dim,
+            "dtype": self.dtype.name,
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        })
+        with open(os.path.join(self.tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        old_dir = f"{self.path}.old-{os.getpid()}"
+        if os.path.exists(self.path):
+            os.rename(self.path, old_dir)
+        os.rename(self.tmp_dir, self.path)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+        return self.path
+
+
+def write_artifact(path, vectors, ids, records=None, dtype="float16", meta=None):
+    writer = EmbeddingArtifactWriter(path, len(ids), dtype=dtype, meta=meta)
+    writer.write(vectors, ids, records)
+    return writer.close()
+
+
+# ============================================================
+# Reader
+# ============================================================
+class EmbeddingArtifact:
+    """
+    Artifact đã ghi, mở trong thời gian hằng (memory-map, không parse toàn bộ file):
+
+    - vectors:      ma trận (n, dim) theo dtype lúc ghi (mmap, read-only)
+    - id(i), record(i), index_of(id)
+    - records():    duyệt metadata từng dòng (dict, thêm key "id")
+    - as_float32(): ma trận float32 (copy) để tính toán
+    """
+
+    def __init__(self, path, mmap=True):
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"Embedding artifact not found: {path}")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        if self.meta.get("format_version") != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding artifact format {self.meta.get('format_version')} in {path}")
+        self.path = path
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)
+        self._ids = _BlobColumn(os.path.join(path, "ids"), mmap=mmap)
+        self._records = _BlobColumn(os.path.join(path, "records"), mmap=mmap)
+        self._row_of = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def dim(self):
+        return int(self.meta.get("dim", 0))
+
+    def id(self, row):
+        return self._ids[row]
+
+    def ids(self):
+        return [self._ids[i] for i in range(len(self))]
+
+    def record(self, row):
+        item = json.loads(self._records[row])
+        item.setdefault("id", self._ids[row])
+        return item
+
+    def records(self):
+        for row in range(len(self)):
+            yield self.record(row)
+
+    def index_of(self, doc_id):
+        if self._row_of is None:
+            self._row_of = {self._ids[i]: i for i in range(len(self))}
+        return self._row_of.get(doc_id)
+
+    def as_float32(self, rows=None):
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return np.asarray(vectors, dtype=np.float32)
+
+
+def load_artifact(path, mmap=True):
+    return EmbeddingArtifact(path, mmap=mmap)
+
+
+# ============================================================
+# Chuyển file JSONL cũ (embedded_laws.jsonl: {id, values, metadata}) sang artifact
+# ============================================================
+def convert_jsonl(jsonl_path, path, dtype="float16"):
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    vectors = np.asarray([r["values"] for r in rows], dtype=np.float32)
+    return write_artifact(path, vectors, [r["id"] for r in rows], [r.get("metadata", {}) for r in rows],
+                          dtype=dtype, meta={"source_path": os.path.abspath(jsonl_path)})
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m src.embedding_artifact embedded_laws.jsonl [embedded_laws.emb]
+    jsonl_path = sys.argv[1]
+    out_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(jsonl_path)[0] + ".emb"
+    convert_jsonl(jsonl_path, out_path)
+    artifact = load_artifact(out_path)
+    print(f"✔ Wrote {len(artifact)} vectors ({artifact.dim}-dim, {artifact.meta['dtype']}) to {out_path}")
@@ -0,0 +1,103 @@
+# src/embedding_batcher.py
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """
+    Gom các lần embed đồng thời (mỗi chat_fn thread một query) thành một lần encode theo batch.
+
+    submit(text) đưa text vào hàng đợi và trả về Future; một worker thread lấy text đầu tiên, gom
+    thêm tới khi đủ `max_batch_size` text hoặc hết `max_wait_ms` ms, gọi `encode(list_text)` một lần
+    rồi trả vector về Future của từng caller. Text trùng trong cùng batch chỉ encode một lần.
+
+    Hàng đợi giới hạn `max_queue` text: khi đầy, submit chờ tới khi worker lấy bớt.
+    """
+
+    def __init__(self, encode, max_batch_size=32, max_wait_ms=5, max_queue=1024):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "batched": 0, "encoded": 0,
+                       "max_batch": 0, "max_queue_depth": 0, "encode_seconds": 0.0}
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                    worker.start()
+                    self._worker = worker
+
+    def submit(self, text):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+        return future
+
+    def embed(self, text, timeout=None):
+        """Vector của một text (chờ batch chứa nó được encode xong)."""
+        return self.submit(text).result(timeout)
+
+    # --------------------------------------------------------
+    # Worker
+    # --------------------------------------------------------
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # hết hạn chờ thì vẫn lấy nốt những gì đã nằm sẵn trong hàng đợi
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # bỏ các Future caller đã cancel
+            batch = [(text, f) for text, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            unique = list(dict.fromkeys(text for text, _ in batch))
+            start = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode(unique), dtype=np.float32)
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+            row_of = {text: i for i, text in enumerate(unique)}
+            for text, f in batch:
+                f.set_result(vectors[row_of[text]])
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["batched"] += len(batch)
+                self._stats["encoded"] += len(unique)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+                self._stats["encode_seconds"] += elapsed
+
+    # --------------------------------------------------------
+    # Metrics
+    # --------------------------------------------------------
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["mean_batch"] = stats["batched"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
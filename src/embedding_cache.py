@@ -0,0 +1,138 @@
+# src/embedding_cache.py
+import os
+import atexit
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from .cache_persist import BackgroundSaver, save_npz
+
+
+def normalize_query(text):
+    """Key của cache: NFC + gộp khoảng trắng, để query chỉ khác nhau ở khoảng trắng / tổ hợp dấu dùng chung vector."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_query(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    LRU cache embedding theo text đã chuẩn hóa, giới hạn `maxsize` vector.
+
+    Nếu có `path`, cache được lưu ra đĩa (.npz: sha1 của text -> vector float16) khi thoát và sau
+    mỗi `save_every` vector mới, rồi load lại khi khởi động; file của model khác bị bỏ qua.
+    Lần lưu sau `save_every` vector chạy ở thread nền, put() không chờ ghi file.
+    Vector load từ đĩa là bản float16 (sai số ~1e-3, không ảnh hưởng xếp hạng cosine).
+    """
+
+    def __init__(self, maxsize=4096, path=None, model_name="", save_every=64):
+        self.maxsize = maxsize
+        self.path = path
+        self.model_name = model_name
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        # chỉ một lần ghi file tại một thời điểm (thread nền và atexit)
+        self._save_lock = threading.Lock()
+        self._saver = BackgroundSaver(self.save, name="embed-cache-save")
+        # file cache được đọc ở lần get/put đầu tiên, không phải lúc khởi tạo (import)
+        self._loaded = not path
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self._loaded = True
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, text):
+        self._ensure_loaded()
+        key = text_key(text)
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, text, vec):
+        self._ensure_loaded()
+        key = text_key(text)
+        vec = np.asarray(vec, dtype=np.float32)
+        with self._lock:
+            self._entries[key] = vec
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            should_save = self.path and self._unsaved >= self.save_every
+        if should_save:
+            self._saver.request()
+
+    def get_or_compute(self, text, encode):
+        """Vector của text; cache miss thì tính bằng encode(text_đã_chuẩn_hóa) và lưu vào cache."""
+        vec = self.get(text)
+        if vec is None:
+            vec = np.asarray(encode(normalize_query(text)), dtype=np.float32)
+            self.put(text, vec)
+        return vec
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    # --------------------------------------------------------
+    # Persist
+    # --------------------------------------------------------
+    def save(self):
+        """Ghi cache ra `path` nếu có vector mới từ lần ghi trước (không có gì mới thì bỏ qua)."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if not self._entries or not self._unsaved:
+                    return
+                keys = list(self._entries.keys())
+                vectors = list(self._entries.values())
+                self._unsaved = 0
+            # stack / ép float16 / nén ngoài _lock: get/put không phải chờ
+            save_npz(self.path, keys=np.array(keys), vectors=np.stack(vectors).astype(np.float16),
+                     model=np.array(self.model_name))
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path) as data:
+                if str(data["model"]) != self.model_name:
+                    return 0
+                keys, vectors = data["keys"], data["vectors"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[EMBED CACHE] Ignoring unreadable cache file {self.path}: {e}")
+            return 0
+        with self._lock:
+            # giữ các vector mới nhất (cuối file) nếu file lớn hơn maxsize
+            for key, vec in list(zip(keys, vectors))[-self.maxsize:]:
+                self._entries[str(key)] = vec.astype(np.float32)
+        return len(self._entries)
@@ -1,74 +1,110 @@
-from .config import RRF_K, COSINE_THRESHOLD, BM25_TOPK, PINECONE_TOP_K, EMBED_MODEL_NAME
+import re
+import time
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from .config import (
+    RRF_K, BM25_TOPK, PINECONE_TOP_K, CITATION_FAST_PATH, SHARED_RETRIEVAL_CACHE,
+    RETRIEVAL_TIMEOUTS, RETRIEVAL_WORKERS
+)
+import numpy as np
 from .bm25_manager import BM25Retriever
-from .pinecone_manager import search_pinecone, embed_text
-from scipy.spatial.distance import cosine
-from sentence_transformers import SentenceTransformer
+from .pinecone_manager import embed_text
+from .vector_store import search_vectors, get_vector_backend
+from .model_registry import get_embedding_model
+from .semantic_cache import SemanticCache, get_shared_cache
+from .tracing import span, record, annotate
 
 # ============================================================
 # RRF Ensemble
 # ============================================================
-def ensemble_rrf(bm25_results, pinecone_results, k=RRF_K, pinecone_weight=1.0, top_k=6, debug_print=False):
-    scores = {}
-    debug = {}
+_ARTICLE_NO = re.compile(r"\d+")
 
-    # ----------------------
-    # BM25
-    # ----------------------
-    for rank, r in enumerate(bm25_results, start=1):
-        doc_id = r["id"]
-        scores[doc_id] = scores.get(doc_id, 0) + 1/(k + rank)
-
-        if doc_id not in debug:
-            debug[doc_id] = {"id": doc_id}
-
-        debug[doc_id]["bm25"] = {
-            "rank": rank,
-            "score": r.get("score", 0),
-            "law_title": r.get("law_title", ""),
-            "article_title": r.get("article_title", ""),
-            "clause_no": r.get("clause_no", ""),
-            "article_link": r.get("article_link", ""),
-            "text": r.get("text", "")
-        }
+def _as_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return str(value).strip()
 
-    # ----------------------
-    # Pinecone
-    # ----------------------
-    for rank, r in enumerate(pinecone_results, start=1):
-        doc_id = r["id"]
-        scores[doc_id] = scores.get(doc_id, 0) + pinecone_weight * (1/(k + rank))
-
-        if doc_id not in debug:
-            debug[doc_id] = {"id": doc_id}
-
-        debug[doc_id]["pinecone"] = {
-            "rank": rank,
-            "score": r.get("score", 0),
-            "law_title": r.get("law_title", ""),
-            "article_title": r.get("article_title", ""),
-            "clause_no": r.get("clause_no", ""),
-            "article_link": r.get("article_link", ""),
-            "text": r.get("text", "")
-        }
+def clause_key(result):
+    """
+    Key chuẩn của một điều khoản (luật | điều | khoản), giống nhau giữa các nguồn dù id khác scheme
+    (keywords DB: luat_..._dieu_1_khoan_0, Pinecone: normalize_id(law_title_article_clause)).
+    Kết quả thiếu tên luật / số điều thì dùng id.
+    """
+    law = result.get("law_title")
+    article = result.get("article_id")
+    if article in (None, ""):
+        m = _ARTICLE_NO.search(str(result.get("article_title", "")))
+        article = m.group() if m else None
+    if not law or article is None:
+        return str(result.get("id"))
+    law = " ".join(unicodedata.normalize("NFC", law).casefold().split())
+    return f"{law}|{_as_int(article)}|{_as_int(result.get('clause_no', ''))}"
 
-    # ----------------------
-    # Sort by RRF score
-    # ----------------------
-    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+def _payload(result, rank):
+    payload = {k: v for k, v in result.items() if k != "id"}
+    payload["rank"] = rank
+    return payload
 
-    # ----------------------
-    # Lấy top-k
-    # ----------------------
-    ranked = ranked[:top_k]
+def fuse_rrf(ranked_lists, k=RRF_K, top_k=6, debug=False):
+    """
+    Reciprocal Rank Fusion của N danh sách: ranked_lists = [(tên nguồn, kết quả đã xếp hạng, trọng số)].
+    score(doc) = sum(trọng số / (k + rank)) trên các nguồn chứa doc; doc được gộp theo clause_key
+    (mỗi nguồn chỉ tính lần xuất hiện đầu tiên của một điều khoản).
 
-    # ----------------------
-    # Format output
-    # ----------------------
+    Mỗi doc trả về: {"id", "key", "rrf_score", "sources": {tên: rank}, <nguồn đầu tiên chứa doc>: payload}.
+    Payload (metadata + text) chỉ được tạo cho top_k doc; debug=True thêm payload của mọi nguồn.
+    """
+    slot_of = {}
+    hits = []                                    # slot -> [(chỉ số nguồn, vị trí trong nguồn)]
+    scores = []
+    for li, (_, results, weight) in enumerate(ranked_lists):
+        slots, ranks = [], []
+        for pos, r in enumerate(results):
+            key = clause_key(r)
+            slot = slot_of.get(key)
+            if slot is None:
+                slot = slot_of[key] = len(hits)
+                hits.append([])
+            elif hits[slot] and hits[slot][-1][0] == li:
+                continue                         # trùng điều khoản trong cùng nguồn
+            hits[slot].append((li, pos))
+            slots.append(slot)
+            ranks.append(pos + 1)
+        scores.append((np.asarray(slots, dtype=np.int64), weight / (k + np.asarray(ranks, dtype=np.float64))))
+
+    n = len(hits)
+    if n == 0:
+        return []
+    total = np.zeros(n)
+    for slots, contrib in scores:
+        total[slots] += contrib                  # slot không trùng trong một nguồn
+
+    # top-k bằng argpartition, hòa điểm giữ thứ tự xuất hiện (như sort ổn định)
+    top = np.argpartition(-total, top_k - 1)[:top_k] if n > top_k else np.arange(n)
+    top = top[np.lexsort((top, -total[top]))]
+
+    keys = list(slot_of)
     results = []
-    for doc_id, rrf_score in ranked:
-        entry = debug[doc_id]
-        entry["rrf_score"] = rrf_score
+    for slot in top:
+        first_li, first_pos = hits[slot][0]
+        entry = {
+            "id": ranked_lists[first_li][1][first_pos]["id"],
+            "key": keys[slot],
+            "rrf_score": float(total[slot]),
+            "sources": {ranked_lists[li][0]: pos + 1 for li, pos in hits[slot]},
+        }
+        for li, pos in (hits[slot] if debug else hits[slot][:1]):
+            name, source_results, _ = ranked_lists[li]
+            entry[name] = _payload(source_results[pos], pos + 1)
         results.append(entry)
+    return results
+
+def ensemble_rrf(bm25_results, pinecone_results, k=RRF_K, pinecone_weight=1.0, top_k=6, debug_print=False):
+    """RRF của BM25 + vector search (xem fuse_rrf); debug_print in payload của cả hai nguồn."""
+    results = fuse_rrf([("bm25", bm25_results, 1.0), ("pinecone", pinecone_results, pinecone_weight)],
+                       k=k, top_k=top_k, debug=debug_print)
 
     # ----------------------
     # Debug print
@@ -94,43 +130,168 @@ def extract_text(doc):
         return doc["pinecone"]["text"]
     return ""
 
+# ============================================================
+# Retrieval song song
+# ============================================================
+# Mỗi backend một pool: lời gọi treo của một backend (vd. Pinecone) chỉ chiếm thread của chính nó, task
+# của backend khác không phải xếp hàng sau. Backend trễ hạn vẫn chạy nốt trên pool nhưng không được chờ
+# (request Pinecone có thêm timeout phía client, xem PINECONE_REQUEST_TIMEOUT).
+_retrieval_pools = {}
+_pools_lock = threading.Lock()
+
+def _retrieval_pool(name):
+    """Pool của backend `name`, tạo ở lần submit đầu tiên."""
+    pool = _retrieval_pools.get(name)
+    if pool is None:
+        with _pools_lock:
+            pool = _retrieval_pools.get(name)
+            if pool is None:
+                pool = _retrieval_pools[name] = ThreadPoolExecutor(
+                    max_workers=RETRIEVAL_WORKERS, thread_name_prefix=f"retrieval-{name}")
+    return pool
+
+def parallel_retrieve(tasks, timeouts=None):
+    """
+    Chạy các backend retrieval song song: tasks = {tên: hàm không tham số}.
+    Backend `name` có hạn chót timeouts[name] giây (None / không có = chờ tới khi xong) tính từ lúc
+    gọi hàm. Trả về (results, dropped, latency):
+    - results: {tên: kết quả} của các backend trả về kịp
+    - dropped: {tên: lý do} của backend trễ hạn hoặc lỗi
+    - latency: {tên: giây} của các backend trả về kịp
+    """
+    timeouts = RETRIEVAL_TIMEOUTS if timeouts is None else timeouts
+    start = time.perf_counter()
+    finished = {}
+
+    def timed(name, fn):
+        result = fn()
+        finished[name] = time.perf_counter() - start
+        return result
+
+    futures = {name: _retrieval_pool(name).submit(timed, name, fn) for name, fn in tasks.items()}
+    results, dropped = {}, {}
+    for name, future in futures.items():
+        budget = timeouts.get(name)
+        remaining = None if budget is None else max(0.0, start + budget - time.perf_counter())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeout:
+            future.cancel()
+            dropped[name] = f"timeout after {budget:.1f}s"
+        except Exception as e:
+            dropped[name] = f"{type(e).__name__}: {e}"
+    latency = {name: finished[name] for name in results}
+    return results, dropped, latency
+
 # ============================================================
 # Build context
 # ============================================================
-def build_context(query, retrieval_cache, bm25_retriever=None, embedding_model=None, top_k=6, pinecone_weight=1.5):
-    query_vec = embed_text(query) if embedding_model else None
-    cache_hit = False
-    cosine_score = None
-
-    # Check cache
-    for item in retrieval_cache:
-        if query_vec:
-            sim = 1 - cosine(query_vec, item["query_vec"])
-            if sim >= COSINE_THRESHOLD:
-                cache_hit = True
-                cosine_score = sim
-                context_text = "\n\n".join([extract_text(d) for d in item["docs"][:top_k]])
-                return context_text, item["docs"][:top_k], retrieval_cache, cache_hit, cosine_score
+def citation_docs(query, bm25_retriever):
+    """
+    Fast path cho query trích dẫn trực tiếp: trả về docs (format giống ensemble_rrf, key "bm25")
+    lấy thẳng từ citation index của BM25Retriever, hoặc None nếu query không phải trích dẫn.
+    """
+    cited = bm25_retriever.lookup_citations(query)
+    if not cited:
+        return None
+    docs = []
+    for rank, r in enumerate(cited, start=1):
+        entry = {k: v for k, v in r.items() if k != "id"}
+        entry["rank"] = rank
+        docs.append({"id": r["id"], "bm25": entry, "citation": True})
+    return docs
+
+def index_stamp(bm25_retriever):
+    """Stamp corpus cho cache retrieval: index BM25 (file nguồn + cập nhật) và vector backend."""
+    backend = get_vector_backend()
+    vector_stamp = f"{backend.name}:{(getattr(backend, 'meta', None) or {}).get('built_at', '')}"
+    bm25_stamp = bm25_retriever.index_stamp() if bm25_retriever is not None else ""
+    return f"{bm25_stamp}|{vector_stamp}"
+
+def build_context(query, retrieval_cache, bm25_retriever=None, embedding_model=None, top_k=6, pinecone_weight=1.5,
+                  retrieval_info=None):
+    """
+    retrieval_cache: SemanticCache của session (list cũ / [] được chuyển thành SemanticCache,
+    trả lại trong kết quả để caller giữ cho lượt sau). Với SHARED_RETRIEVAL_CACHE, lookup / ghi
+    dùng cache chung của process (get_shared_cache) và retrieval_cache chỉ được trả lại nguyên vẹn.
+
+    retrieval_info: dict (tùy chọn) nhận {"dropped": {backend: lý do}, "latency": {backend: giây}}
+    của lần retrieval này (BM25 và vector search chạy song song, xem parallel_retrieve).
+    """
+    if not isinstance(retrieval_cache, SemanticCache):
+        retrieval_cache = SemanticCache.from_entries(retrieval_cache)
+    cache = get_shared_cache() if SHARED_RETRIEVAL_CACHE else retrieval_cache
+
+    # Trích dẫn trực tiếp (luật + điều [+ khoản]): không cần embedding / Pinecone / RRF
+    if CITATION_FAST_PATH and bm25_retriever is not None:
+        with span("citation_lookup"):
+            cited_docs = citation_docs(query, bm25_retriever)
+        if cited_docs:
+            annotate(citation_fast_path=True)
+            context_text = "\n\n".join([extract_text(d) for d in cited_docs])
+            return context_text, cited_docs, retrieval_cache, False, None
+
+    def vector_task():
+        """Embed query, tra cache (một phép nhân ma trận-vector), cache miss thì search vector backend."""
+        embed_start = time.perf_counter()
+        query_vec = embed_text(query)
+        lookup_start = time.perf_counter()
+        # corpus / index đổi (upsert, build lại) thì entry cũ bị xóa
+        cache.check_version(index_stamp(bm25_retriever))
+        item, sim = cache.lookup(query_vec)
+        timings = {"embed": (embed_start, lookup_start - embed_start),
+                   "cache_lookup": (lookup_start, time.perf_counter() - lookup_start)}
+        hits = search_vectors(query_vec, PINECONE_TOP_K) if item is None else None
+        return {"query_vec": query_vec, "cached": item, "cosine": sim, "hits": hits, "timings": timings}
+
+    # BM25 chạy song song với embed + vector search (backend cấu hình trong VECTOR_BACKEND). Cache hit thì
+    # kết quả BM25 bị bỏ: BM25 chỉ tốn vài ms, còn embed không còn nằm trước BM25 trên đường chính.
+    tasks = {}
+    if bm25_retriever is not None:
+        tasks["bm25"] = lambda: bm25_retriever.search(query, BM25_TOPK)
+    if embedding_model:
+        tasks["vector"] = vector_task
+    if not tasks:
+        raise ValueError("bm25_retriever must be provided and initialized")
+    retrieve_start = time.perf_counter()
+    results, dropped, latency = parallel_retrieve(tasks)
+
+    query_vec = None
+    vector = results.pop("vector", None)
+    if vector is not None:
+        for name, (start, seconds) in vector["timings"].items():
+            record(name, seconds, start)
+        query_vec = vector["query_vec"]
+        if vector["cached"] is not None:
+            docs = vector["cached"]["docs"][:top_k]
+            context_text = "\n\n".join([extract_text(d) for d in docs])
+            return context_text, docs, retrieval_cache, True, vector["cosine"]
+        results["vector"] = vector["hits"]
 
     if bm25_retriever is None:
         raise ValueError("bm25_retriever must be provided and initialized")
 
-    bm25_docs = bm25_retriever.search(query, BM25_TOPK)
-    pine_docs = search_pinecone(query_vec, PINECONE_TOP_K)
-    final_docs = ensemble_rrf(bm25_docs, pine_docs, k=RRF_K, pinecone_weight=pinecone_weight)
+    for name, seconds in latency.items():
+        record(name, seconds, retrieve_start)
+    annotate(**{f"{name}_hits": len(docs) for name, docs in results.items()})
+    if retrieval_info is not None:
+        retrieval_info.update({"dropped": dropped, "latency": latency})
+    if dropped:
+        print(f"[RETRIEVAL] Dropped backends: {dropped}")
+        if not results:
+            raise RuntimeError(f"All retrieval backends failed: {dropped}")
 
-    # Cắt top_k doc sau RRF
-    final_docs = final_docs[:top_k]
+    # Điều khoản trùng giữa hai nguồn (id khác scheme) được gộp theo clause_key
+    with span("rrf"):
+        final_docs = ensemble_rrf(results.get("bm25", []), results.get("vector", []),
+                                  k=RRF_K, pinecone_weight=pinecone_weight, top_k=top_k)
 
-    # Update cache
-    retrieval_cache.append({
-        "query_text": query,
-        "query_vec": query_vec,
-        "docs": final_docs
-    })
+    # Update cache (kết quả thiếu backend không được cache, lượt sau retrieval lại đầy đủ)
+    if query_vec and not dropped:
+        cache.add(query, query_vec, final_docs)
 
     context_text = "\n\n".join([extract_text(d) for d in final_docs])
-    return context_text, final_docs, retrieval_cache, cache_hit, cosine_score
+    return context_text, final_docs, retrieval_cache, False, None
 
 # ============================================================
 # Test main
@@ -140,7 +301,7 @@ if __name__ == "__main__":
 
     retrieval_cache = []
     bm25_retriever = BM25Retriever(jsonl_path="data/keywords_db.jsonl")
-    embedding_model = SentenceTransformer(EMBED_MODEL_NAME)
+    embedding_model = get_embedding_model()
 
     context_text, final_docs, retrieval_cache, cache_hit, cosine_score = build_context(
         query,
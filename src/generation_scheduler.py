@@ -0,0 +1,400 @@
+# src/generation_scheduler.py
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from .config import GEN_MAX_BATCH, GEN_MAX_NEW_TOKENS, GEN_PREFILL_TOKENS, GEN_QUEUE_SIZE, GEN_STOP_ON_CUTOFF
+from .stop_sequences import tail_has_cutoff
+
+# torch / transformers chỉ import trong worker thread (import module này phải nhẹ)
+
+
+# ============================================================
+# Request
+# ============================================================
+class GenerationRequest:
+    """
+    Một prompt đang chờ / đang sinh trong scheduler.
+
+    - result(timeout): câu trả lời đầy đủ (chỉ phần sinh thêm, không gồm prompt)
+    - stream():        yield từng đoạn text mới khi decode
+    - cancel():        bỏ request (vd client ngắt kết nối), sequence rời batch ở bước decode kế tiếp
+    - finish_reason:   "eos" | "length" | "stop_sequence" | "cancelled" | "error"
+    """
+
+    def __init__(self, prompt, max_new_tokens, stop_on_cutoff):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.stop_on_cutoff = stop_on_cutoff
+        self.prompt_ids = None       # token của prompt, tokenize khi worker lấy request ra khỏi hàng đợi
+        self.future = Future()
+        self.token_ids = []
+        self.text = ""
+        self.finish_reason = None
+        self.cancelled = False
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self._updates = queue.Queue()
+        # decode tăng dần (như TextStreamer): chỉ decode token từ _token_start, đã phát _printed ký tự
+        self._token_start = 0
+        self._printed = 0
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def stream(self):
+        while True:
+            chunk = self._updates.get()
+            if chunk is None:
+                break
+            yield chunk
+        self.future.result()         # raise lỗi của scheduler nếu có
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# ============================================================
+# Scheduler
+# ============================================================
+class GenerationScheduler:
+    """
+    Continuous batching cho LLM dùng chung giữa các session: một worker thread giữ model và một batch
+    decode đang chạy. Mỗi bước decode sinh một token cho mọi sequence trong batch; giữa các bước,
+    prompt mới trong hàng đợi (tới `max_batch_size`) được prefill chung một lần forward (left-pad, tối đa
+    `max_prefill_tokens` token mỗi lần, phần còn lại để bước sau) rồi nhập vào batch; sequence xong
+    (eos, max_new_tokens riêng của request, cụm clean_text sẽ cắt, cancel) rời batch ngay.
+
+    KV cache của batch là Cache object model trả về (tensor (batch, heads, seq, head_dim) mỗi layer), giữ
+    nguyên qua các bước decode; chỉ khi nhập / bỏ sequence mới thay tensor từng layer (ghép theo chiều
+    batch, left-pad theo sequence dài nhất + attention_mask 0 ở phần pad). position_ids tính theo số token
+    thật của từng sequence. Khi sequence dài nhất rời batch, các cột pad chung ở đầu bị cắt bỏ. Decode
+    greedy (giống gen_pipe, do_sample=False).
+    """
+
+    def __init__(self, model, tokenizer, max_batch_size=GEN_MAX_BATCH, max_new_tokens=GEN_MAX_NEW_TOKENS,
+                 max_queue=GEN_QUEUE_SIZE, max_prefill_tokens=GEN_PREFILL_TOKENS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.max_prefill_tokens = max_prefill_tokens
+        self.eos_token_ids = self._eos_ids(model, tokenizer)
+        self._pad_id = self._pad_token_id(tokenizer, self.eos_token_ids)
+        self._pending = queue.Queue(maxsize=max_queue)
+        self._waiting = deque()      # đã lấy khỏi hàng đợi, chờ prefill
+        self._running = []           # request theo thứ tự dòng trong batch
+        self._cache = None           # past_key_values của batch (Cache object của model, sửa tensor tại chỗ)
+        self._mask = None            # (batch, seq) attention mask
+        self._next = None            # (batch, 1) token đưa vào bước decode kế tiếp
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "completed": 0, "steps": 0, "generated_tokens": 0,
+                       "batch_rows": 0, "max_running": 0, "prefills": 0, "prefill_rows": 0,
+                       "busy_seconds": 0.0, "errors": 0}
+
+    @staticmethod
+    def _eos_ids(model, tokenizer):
+        eos = getattr(getattr(model, "generation_config", None), "eos_token_id", None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        return set(eos if isinstance(eos, (list, tuple)) else [eos]) - {None}
+
+    @staticmethod
+    def _pad_token_id(tokenizer, eos_token_ids):
+        """Token điền vào phần pad của prefill (bị attention_mask che nên giá trị không quan trọng)."""
+        if tokenizer.pad_token_id is not None:
+            return tokenizer.pad_token_id
+        return min(eos_token_ids) if eos_token_ids else 0
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    worker = threading.Thread(target=self._run, name="generation-scheduler", daemon=True)
+                    worker.start()
+                    self._worker = worker
+
+    def submit(self, prompt, max_new_tokens=None, stop_on_cutoff=GEN_STOP_ON_CUTOFF):
+        """Đưa prompt vào hàng đợi (chờ nếu hàng đợi đầy), trả về GenerationRequest."""
+        self._ensure_worker()
+        request = GenerationRequest(prompt, min(max_new_tokens or self.max_new_tokens, self.max_new_tokens),
+                                    stop_on_cutoff)
+        self._pending.put(request)
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        return request
+
+    def generate(self, prompt, max_new_tokens=None, timeout=None):
+        return self.submit(prompt, max_new_tokens).result(timeout)
+
+    # --------------------------------------------------------
+    # Worker
+    # --------------------------------------------------------
+    def _run(self):
+        while True:
+            self._tick()
+
+    def _tick(self, block=True):
+        """Một vòng của worker: nhận request mới, prefill một nhóm, chạy một bước decode."""
+        import torch
+
+        if block and not self._running and not self._waiting:
+            self._waiting.append(self._pending.get())        # batch rỗng: chờ request mới
+        while len(self._running) + len(self._waiting) < self.max_batch_size:
+            try:
+                self._waiting.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        group = self._prefill_group()
+        if group:
+            self._admit(group)
+        if not self._running:
+            return
+        start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                self._step()
+        except Exception as e:
+            print(f"[GEN] Decode step failed for {len(self._running)} sequences: {e}")
+            for request in self._running:
+                self._finish(request, "error", error=e)
+            self._running, self._cache, self._mask, self._next = [], None, None, None
+            with self._stats_lock:
+                self._stats["errors"] += 1
+        with self._stats_lock:
+            self._stats["busy_seconds"] += time.perf_counter() - start
+
+    def _prefill_group(self):
+        """
+        Lấy từ đầu _waiting các request sẽ prefill chung lần này: tổng token sau left-pad
+        (số dòng x prompt dài nhất) không vượt max_prefill_tokens, luôn lấy ít nhất một request.
+        """
+        group, longest = [], 0
+        while self._waiting:
+            request = self._waiting[0]
+            if request.cancelled:
+                self._waiting.popleft()
+                self._finish(request, "cancelled")
+                continue
+            if request.prompt_ids is None:
+                try:
+                    request.prompt_ids = self.tokenizer(request.prompt)["input_ids"]
+                except Exception as e:
+                    self._waiting.popleft()
+                    print(f"[GEN] Tokenize failed: {e}")
+                    self._finish(request, "error", error=e)
+                    continue
+            length = max(longest, len(request.prompt_ids))
+            if group and length * (len(group) + 1) > self.max_prefill_tokens:
+                break
+            group.append(self._waiting.popleft())
+            longest = length
+        return group
+
+    def _admit(self, requests):
+        """Prefill prompt của các request trong một lần forward (left-pad) rồi nhập vào batch đang chạy."""
+        import torch
+
+        start = time.perf_counter()
+        try:
+            device = self.model.device
+            longest = max(len(request.prompt_ids) for request in requests)
+            input_ids = torch.full((len(requests), longest), self._pad_id, dtype=torch.long)
+            mask = torch.zeros((len(requests), longest), dtype=torch.long)
+            for row, request in enumerate(requests):
+                ids = request.prompt_ids
+                input_ids[row, longest - len(ids):] = torch.tensor(ids, dtype=torch.long)
+                mask[row, longest - len(ids):] = 1
+            input_ids, mask = input_ids.to(device), mask.to(device)
+            # vị trí theo token thật của từng dòng, khớp với position_ids của _step
+            position_ids = (mask.cumsum(dim=1) - 1).clamp(min=0)
+            with torch.no_grad():
+                out = self.model(input_ids=input_ids, attention_mask=mask, position_ids=position_ids,
+                                 use_cache=True)
+            tokens = out.logits[:, -1].argmax(dim=-1)
+            cache = out.past_key_values
+            # KV ở cột pad = 0 như _left_pad (query toàn pad có thể cho NaN, dù đã bị mask che)
+            pad = (mask == 0)[:, None, :, None]
+            if bool(pad.any()):
+                cache = _set_cache_kv(cache, [(k.masked_fill(pad, 0), v.masked_fill(pad, 0))
+                                              for k, v in _cache_kv(cache)])
+        except Exception as e:
+            print(f"[GEN] Prefill failed for {len(requests)} prompts: {e}")
+            for request in requests:
+                self._finish(request, "error", error=e)
+            with self._stats_lock:
+                self._stats["errors"] += 1
+            return
+        finally:
+            with self._stats_lock:
+                self._stats["busy_seconds"] += time.perf_counter() - start
+        with self._stats_lock:
+            self._stats["prefills"] += 1
+            self._stats["prefill_rows"] += len(requests)
+
+        keep = [row for row, (request, token) in enumerate(zip(requests, tokens.tolist()))
+                if not self._emit(request, token)]
+        if not keep:
+            return
+        next_token = tokens[:, None]
+        if len(keep) < len(requests):
+            cache, mask, next_token = _select_rows(cache, mask, next_token, keep)
+        if not self._running:
+            self._cache, self._mask, self._next = cache, mask, next_token
+        else:
+            # left-pad bên ngắn hơn để KV cùng độ dài rồi ghép theo chiều batch vào cache đang chạy
+            length = max(self._mask.shape[1], mask.shape[1])
+            old_kv, old_mask = _left_pad(_cache_kv(self._cache), self._mask, length - self._mask.shape[1])
+            new_kv, new_mask = _left_pad(_cache_kv(cache), mask, length - mask.shape[1])
+            self._cache = _set_cache_kv(self._cache, [(torch.cat([k0, k1]), torch.cat([v0, v1]))
+                                                      for (k0, v0), (k1, v1) in zip(old_kv, new_kv)])
+            self._mask = torch.cat([old_mask, new_mask])
+            self._next = torch.cat([self._next, next_token])
+        self._running.extend(requests[row] for row in keep)
+
+    def _step(self):
+        import torch
+
+        batch = len(self._running)
+        # vị trí token mới = số token thật đã có của từng sequence (không tính pad)
+        position_ids = self._mask.sum(dim=1, keepdim=True)
+        self._mask = torch.cat([self._mask, self._mask.new_ones((batch, 1))], dim=1)
+        out = self.model(input_ids=self._next, attention_mask=self._mask, position_ids=position_ids,
+                         past_key_values=self._cache, use_cache=True)
+        self._cache = out.past_key_values
+        tokens = out.logits[:, -1].argmax(dim=-1)
+        self._next = tokens[:, None]
+
+        keep = [row for row, (request, token) in enumerate(zip(self._running, tokens.tolist()))
+                if not self._emit(request, token)]
+        with self._stats_lock:
+            self._stats["steps"] += 1
+            self._stats["batch_rows"] += batch
+            self._stats["max_running"] = max(self._stats["max_running"], batch)
+        if len(keep) < batch:
+            self._retire(keep)
+
+    def _retire(self, keep):
+        """Bỏ các dòng đã xong khỏi batch, cắt các cột chỉ còn pad ở đầu."""
+        self._running = [self._running[row] for row in keep]
+        if not keep:
+            self._cache, self._mask, self._next = None, None, None
+            return
+        self._cache, self._mask, self._next = _select_rows(self._cache, self._mask, self._next, keep)
+
+    def _emit(self, request, token):
+        """Nhận một token mới cho request; True nếu request đã xong (rời batch)."""
+        if request.cancelled:
+            self._finish(request, "cancelled")
+            return True
+        if request.first_token_at is None:
+            request.first_token_at = time.perf_counter()
+        with self._stats_lock:
+            self._stats["generated_tokens"] += 1
+        if token in self.eos_token_ids:
+            self._finish(request, "eos")
+            return True
+        request.token_ids.append(token)
+        text = self.tokenizer.decode(request.token_ids[request._token_start:], skip_special_tokens=True)
+        if text.endswith("\n"):
+            chunk = text[request._printed:]
+            request._token_start, request._printed = len(request.token_ids), 0
+        elif text.endswith("\ufffd"):
+            chunk = ""               # ký tự UTF-8 chưa decode trọn
+        else:
+            chunk = text[request._printed:text.rfind(" ") + 1]
+            request._printed += len(chunk)
+        if chunk:
+            request.text += chunk
+            request._updates.put(chunk)
+        if request.stop_on_cutoff and tail_has_cutoff(self.tokenizer, request.token_ids):
+            self._finish(request, "stop_sequence")
+            return True
+        if len(request.token_ids) >= request.max_new_tokens:
+            self._finish(request, "length")
+            return True
+        return False
+
+    def _finish(self, request, reason, error=None):
+        if request.future.done():
+            return
+        rest = self.tokenizer.decode(request.token_ids[request._token_start:], skip_special_tokens=True)
+        rest = rest[request._printed:]
+        if rest:
+            request.text += rest
+            request._updates.put(rest)
+        request.finish_reason = reason
+        request._updates.put(None)
+        if error is not None:
+            request.future.set_exception(error)
+        else:
+            request.future.set_result(request.text)
+        with self._stats_lock:
+            self._stats["completed"] += 1
+
+    # --------------------------------------------------------
+    # Metrics
+    # --------------------------------------------------------
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._pending.qsize() + len(self._waiting)
+        stats["running"] = len(self._running)
+        stats["max_batch_size"] = self.max_batch_size
+        stats["mean_occupancy"] = (stats["batch_rows"] / stats["steps"] / self.max_batch_size
+                                   if stats["steps"] else 0.0)
+        stats["tokens_per_second"] = (stats["generated_tokens"] / stats["busy_seconds"]
+                                      if stats["busy_seconds"] else 0.0)
+        return stats
+
+
+# ============================================================
+# KV cache helpers
+# ============================================================
+def _cache_kv(cache):
+    """[(key, value)] mỗi layer của past_key_values (Cache object hoặc tuple), không copy tensor."""
+    if hasattr(cache, "layers"):                 # transformers >= 4.56
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    if hasattr(cache, "key_cache"):              # DynamicCache cũ
+        return list(zip(cache.key_cache, cache.value_cache))
+    return [(layer[0], layer[1]) for layer in cache]
+
+
+def _set_cache_kv(cache, kv):
+    """Thay tensor từng layer của cache bằng `kv` (giữ Cache object); trả về cache (tuple mới nếu cache là tuple)."""
+    if hasattr(cache, "layers"):
+        for layer, (k, v) in zip(cache.layers, kv):
+            layer.keys, layer.values = k, v
+        return cache
+    if hasattr(cache, "key_cache"):
+        cache.key_cache[:] = [k for k, _ in kv]
+        cache.value_cache[:] = [v for _, v in kv]
+        return cache
+    return tuple(kv)
+
+
+def _left_pad(kv, mask, n):
+    """Thêm n cột pad (KV = 0, mask = 0) vào đầu chiều seq."""
+    import torch
+
+    if n <= 0:
+        return kv, mask
+    padded = []
+    for k, v in kv:
+        pad_k = k.new_zeros(k.shape[:2] + (n,) + k.shape[3:])
+        pad_v = v.new_zeros(v.shape[:2] + (n,) + v.shape[3:])
+        padded.append((torch.cat([pad_k, k], dim=2), torch.cat([pad_v, v], dim=2)))
+    return padded, torch.cat([mask.new_zeros((mask.shape[0], n)), mask], dim=1)
+
+
+def _select_rows(cache, mask, next_tokens, keep):
+    """Giữ các dòng `keep` của batch, cắt các cột chỉ còn pad ở đầu."""
+    index = mask.new_tensor(keep)
+    mask = mask.index_select(0, index)
+    first = int((mask.sum(dim=0) > 0).nonzero()[0])
+    cache = _set_cache_kv(cache, [(k.index_select(0, index)[:, :, first:], v.index_select(0, index)[:, :, first:])
+                                  for k, v in _cache_kv(cache)])
+    return cache, mask[:, first:], next_tokens.index_select(0, index)
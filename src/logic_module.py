@@ -1,25 +1,39 @@
 # logic_module.py
 import os
+import time
 import uuid
+import hashlib
+import threading
 from datetime import datetime, timezone
-from pymongo import MongoClient, DESCENDING
-from sentence_transformers import SentenceTransformer
-from transformers import pipeline, AutoTokenizer
-import torch
 
 from .config import *
 from .bm25_manager import BM25Retriever
-from .pinecone_manager import search_pinecone
-from .ensemble_retriever import build_context
-from .model_loader import build_pipeline
+from .ensemble_retriever import build_context, index_stamp
+from .model_loader import build_pipeline, adapter_stamp, stream_pipeline
+from .answer_cache import answer_cache, answer_key
+from .tracing import start_trace, new_trace, activate, span, annotate, current_trace
+from .model_registry import registry, get_embedding_model, get_llm, EMBEDDING
+from .generation_scheduler import GenerationScheduler
 from .decontextualizer import decontextualize_conversation  
-from .postprocessing import clean_text
+from .postprocessing import clean_text, StreamingCleaner
+from .stop_sequences import cutoff_stopping_criteria
+
+# Import module không kết nối DB / load model: mỗi service được tạo lần đầu dùng (qua model
+# registry), hoặc load trước song song bằng warmup(). Các tên cũ (sessions_col, bm25_retriever,
+# embedding_model, gen_pipe, tokenizer) vẫn import được, xem __getattr__ cuối file.
 
 # -------------------- 1️⃣ MongoDB --------------------
-client = MongoClient(MONGO_URI)
-db = client[MONGO_DB]
-sessions_col = db[MONGO_COLLECTION]
-sessions_col.create_index([("updated_at", DESCENDING)])
+def _connect_sessions():
+    from pymongo import MongoClient, DESCENDING
+    client = MongoClient(MONGO_URI)
+    col = client[MONGO_DB][MONGO_COLLECTION]
+    col.create_index([("updated_at", DESCENDING)])
+    return col
+
+registry.register("sessions", _connect_sessions)
+
+def get_sessions_col():
+    return registry.get("sessions")
 
 
 def create_session(name=None):
@@ -33,24 +47,24 @@ def create_session(name=None):
         "messages": [],
         "recent_history": []  # chỉ lưu conversation
     }
-    sessions_col.insert_one(doc)
+    get_sessions_col().insert_one(doc)
     return sid
 
 
 def list_sessions(limit=100):
-    docs = sessions_col.find(
+    docs = get_sessions_col().find(
         {}, {"session_id": 1, "name": 1, "updated_at": 1}
     ).sort("updated_at", -1).limit(limit)
     return [(f"{d['name']} — {d['updated_at'].strftime('%Y-%m-%d %H:%M:%S')}", d['session_id']) for d in docs]
 
 
 def load_session_doc(session_id):
-    return sessions_col.find_one({"session_id": session_id})
+    return get_sessions_col().find_one({"session_id": session_id})
 
 
 def save_message(session_id, role, text):
     now = datetime.now(timezone.utc)
-    sessions_col.update_one(
+    get_sessions_col().update_one(
         {"session_id": session_id},
         {"$push": {"messages": {"role": role, "text": text, "ts": now}},
          "$set": {"updated_at": now}}
@@ -59,28 +73,58 @@ def save_message(session_id, role, text):
 
 def save_recent_history(session_id, recent_history):
     """recent_history = list of {user: "...", assistant: "..."}"""
-    sessions_col.update_one(
+    get_sessions_col().update_one(
         {"session_id": session_id},
         {"$set": {"recent_history": recent_history, "updated_at": datetime.now(timezone.utc)}}
     )
 
 
 def delete_session(session_id):
-    sessions_col.delete_one({"session_id": session_id})
+    get_sessions_col().delete_one({"session_id": session_id})
 
 
 # -------------------- 2️⃣ BM25 + Embedding --------------------
 input_path = os.path.join(BASE_DIR, "data/keywords_db.jsonl")
-bm25_retriever = BM25Retriever(jsonl_path=input_path)
-embedding_model = SentenceTransformer(EMBED_MODEL_NAME)
+registry.register("bm25", lambda: BM25Retriever(jsonl_path=input_path))
+
+def get_bm25_retriever():
+    return registry.get("bm25")
 
 # -------------------- 3️⃣ Load model pipeline --------------------
 model_key = MODEL_KEY
-gen_pipe, tokenizer = build_pipeline(
-    model_key=model_key,
-    max_new_tokens=1024,
-    temperature=0.2
-)
+# stamp adapter của model đang nằm trong bộ nhớ (tính lúc load), dùng để invalidate answer cache
+_model_stamp = None
+
+def _load_gen_pipe():
+    global _model_stamp
+    _model_stamp = adapter_stamp(model_key)
+    return build_pipeline(
+        model_key=model_key,
+        max_new_tokens=GEN_MAX_NEW_TOKENS,
+        temperature=0.2
+    )
+
+registry.register("gen_pipe", _load_gen_pipe)
+
+def get_gen_pipe():
+    """(gen_pipe, tokenizer) của MODEL_KEY."""
+    return registry.get("gen_pipe")
+
+# GEN_SCHEDULER: mọi session sinh câu trả lời qua một scheduler continuous batching (cùng model với gen_pipe)
+registry.register("gen_scheduler", lambda: GenerationScheduler(*get_llm(model_key)))
+
+def get_gen_scheduler():
+    return registry.get("gen_scheduler")
+
+# -------------------- Startup --------------------
+# Các service độc lập nhau, warmup() load song song
+STARTUP_SERVICES = ("sessions", "bm25", EMBEDDING, "gen_pipe") + (("gen_scheduler",) if GEN_SCHEDULER else ())
+
+def warmup(parallel=True, services=STARTUP_SERVICES):
+    """Load trước các service (gọi lúc khởi động server), in bảng thời gian load từng phần."""
+    wall = registry.warmup(services, parallel=parallel)
+    print(registry.report(wall))
+    return wall
 
 # -------------------- 4️⃣ Chat function --------------------
 custom_template = """
@@ -94,62 +138,223 @@ Bạn là trợ lý pháp lý AI. Luôn trả lời chính xác theo luật Vi
 
 ### Trả lời:
 """
+_PROMPT_STAMP = hashlib.sha1(custom_template.encode("utf-8")).hexdigest()[:8]
+
+
+def answer_version(bm25_retriever):
+    """Stamp của answer cache: model + adapter đang dùng, prompt template và index retrieval."""
+    return f"{model_key}:{_model_stamp}|{_PROMPT_STAMP}|{index_stamp(bm25_retriever)}"
+
+
+def _stop_criteria(tokenizer):
+    """StoppingCriteriaList cho một lần generate: dừng ở cụm clean_text sẽ cắt nếu GEN_STOP_ON_CUTOFF."""
+    from transformers import StoppingCriteriaList
+    return StoppingCriteriaList([cutoff_stopping_criteria(tokenizer)] if GEN_STOP_ON_CUTOFF else [])
 
 
 def chat_fn(session_id, gr_history, user_input, retrieval_cache):
     """Chat function chính, chỉ quan tâm user_input và recent_history"""
+    # mỗi lượt chat là một trace: thời gian từng stage vào tracing.metrics + một dòng trong TRACE_LOG_PATH
+    with start_trace("chat_fn", session_id=session_id):
+        return _chat_turn(session_id, gr_history, user_input, retrieval_cache)
+
+
+def _chat_turn(session_id, gr_history, user_input, retrieval_cache):
     if not session_id:
         session_id = create_session("Phiên mới")
 
     if not user_input.strip():
         return session_id, gr_history or [], retrieval_cache, "<div style='color:red'>Vui lòng nhập câu hỏi.</div>"
 
+    turn = _prepare_turn(session_id, user_input, retrieval_cache)
+
+    # -------- 4) LLM generate (nếu answer cache miss) ----------
+    ans, raw_ans = turn["answer"], None
+    if ans is None and GEN_SCHEDULER:
+        request = get_gen_scheduler().submit(turn["prompt"])
+        with span("llm_generate"):
+            raw_ans = request.result().strip()
+        annotate(stopped_at_cutoff=request.finish_reason == "stop_sequence")
+        with span("postprocess"):
+            ans = clean_text(raw_ans)
+    elif ans is None:
+        gen_pipe, tokenizer = get_gen_pipe()
+        criteria = _stop_criteria(tokenizer)
+        with span("llm_generate"):
+            ans_full = gen_pipe(turn["prompt"], stopping_criteria=criteria)[0]["generated_text"]
+        annotate(stopped_at_cutoff=any(c.fired for c in criteria))
+        with span("postprocess"):
+            split_token = "### Trả lời:"
+            raw_ans = ans_full.split(split_token, 1)[1].strip() if split_token in ans_full else ans_full.strip()
+            ans = clean_text(raw_ans)
+
+    return _finish_turn(turn, gr_history, ans, raw_ans)
+
+
+def chat_fn_stream(session_id, gr_history, user_input, retrieval_cache):
+    """
+    Bản streaming của chat_fn (generator, dùng trực tiếp làm callback Gradio): yield
+    (session_id, gr_history, retrieval_cache, refs_html) mỗi khi câu trả lời dài thêm, lượt cuối giống
+    kết quả chat_fn. Ref cards có ngay sau retrieval; câu trả lời chỉ được lưu vào Mongo khi sinh xong.
+    """
+    if not session_id:
+        session_id = create_session("Phiên mới")
+
+    if not user_input.strip():
+        yield session_id, gr_history or [], retrieval_cache, "<div style='color:red'>Vui lòng nhập câu hỏi.</div>"
+        return
+
+    # generator không giữ trace qua yield: chỉ activate trong các đoạn chạy liền
+    trace = new_trace("chat_fn_stream", session_id=session_id)
+    gr_history = gr_history or []
+    error = "cancelled"
+    try:
+        with activate(trace):
+            turn = _prepare_turn(session_id, user_input, retrieval_cache)
+        refs_html = render_refs(turn["refs"], turn["dropped"])
+
+        ans, raw_ans = turn["answer"], None
+        if ans is None:
+            if GEN_SCHEDULER:
+                request = get_gen_scheduler().submit(turn["prompt"])
+                chunks, halt = request.stream(), request.cancel
+                stopped_at_cutoff = lambda: request.finish_reason == "stop_sequence"
+            else:
+                gen_pipe, tokenizer = get_gen_pipe()
+                criteria = _stop_criteria(tokenizer)
+                stop = threading.Event()
+                chunks = stream_pipeline(gen_pipe, turn["prompt"], stop_event=stop, stopping_criteria=criteria)
+                halt = stop.set
+                stopped_at_cutoff = lambda: any(c.fired for c in criteria)
+            cleaner = StreamingCleaner()
+            gen_start = time.perf_counter()
+            shown = None
+            yield session_id, gr_history + [(user_input, "")], turn["retrieval_cache"], refs_html
+            try:
+                for chunk in chunks:
+                    text = cleaner.feed(chunk)
+                    if cleaner.done:
+                        halt()               # gặp cụm cần cắt: phần sau bị bỏ, không decode tiếp
+                    if text and text != shown:
+                        if shown is None and trace is not None:
+                            # thời gian tới khi người dùng thấy chữ đầu tiên, tính từ đầu lượt chat
+                            trace.record("time_to_first_token", trace.elapsed())
+                        shown = text
+                        yield session_id, gr_history + [(user_input, text)], turn["retrieval_cache"], refs_html
+            finally:
+                halt()
+            if trace is not None:
+                trace.record("llm_generate", time.perf_counter() - gen_start, gen_start)
+                trace.annotate(stopped_at_cutoff=stopped_at_cutoff())
+            raw_ans, ans = cleaner.raw.strip(), cleaner.finish()
+
+        with activate(trace):
+            result = _finish_turn(turn, gr_history, ans, raw_ans)
+        error = None
+        yield result
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if trace is not None:
+            trace.finish(error)
+
+
+def _prepare_turn(session_id, user_input, retrieval_cache):
+    """Bước 1-3 của một lượt chat + tra answer cache; trả về dict trạng thái cho _finish_turn."""
     # -------- 1) Load recent_history (top 3 gần nhất) ----------
-    doc = load_session_doc(session_id)
+    with span("mongo_load"):
+        doc = load_session_doc(session_id)
     recent_history = doc.get("recent_history", []) or []
 
     # -------- 2) Decontextualize query ----------
     if len(recent_history) == 0:
         # Không có history → Không cần decontext
         dectx_query = user_input.strip()
-        cache_hit = False
     else:
         # Có history → Chạy decontext
         context_lines = []
         for item in recent_history:
             context_lines.append(f"Q: {item['user']}")
             context_lines.append(f"A: {item['assistant']}")
-        dectx_query = decontextualize_conversation(context_lines, user_input, DEBUG=True)
+        with span("decontextualize"):
+            dectx_query = decontextualize_conversation(context_lines, user_input, DEBUG=True)
 
     # -------- 3) Retrieval ----------
-    context, refs, retrieval_cache, cache_hit, cosine_score = build_context(
-        dectx_query,
-        retrieval_cache,
-        bm25_retriever=bm25_retriever,
-        embedding_model=embedding_model
-    )
+    bm25_retriever = get_bm25_retriever()
+    retrieval_info = {}
+    with span("retrieval"):
+        context, refs, retrieval_cache, cache_hit, cosine_score = build_context(
+            dectx_query,
+            retrieval_cache,
+            bm25_retriever=bm25_retriever,
+            embedding_model=get_embedding_model(),
+            retrieval_info=retrieval_info
+        )
+    dropped = retrieval_info.get("dropped") or {}
+    annotate(retrieval_cache_hit=cache_hit, n_refs=len(refs), dropped_backends=list(dropped))
+
+    # -------- Answer cache ----------
+    ans, ans_key = None, None
+    # kết quả thiếu backend (trễ hạn / lỗi) không dùng / ghi answer cache
+    use_answer_cache = ANSWER_CACHE and not dropped
+    if use_answer_cache:
+        get_gen_pipe()                       # stamp adapter có sau khi model được load
+        answer_cache.check_version(answer_version(bm25_retriever))
+        ans_key = answer_key(model_key, dectx_query, [d["id"] for d in refs])
+        ans = answer_cache.get(ans_key)
+    annotate(answer_cache_hit=ans is not None)
+
+    with span("prompt"):
+        full_prompt = custom_template.format(context=context, input=dectx_query)
+
+    return {
+        "session_id": session_id,
+        "user_input": user_input,
+        "recent_history": recent_history,
+        "dectx_query": dectx_query,
+        "refs": refs,
+        "dropped": dropped,
+        "retrieval_cache": retrieval_cache,
+        "prompt": full_prompt,
+        "answer": ans,
+        "answer_key": ans_key if use_answer_cache else None,
+    }
+
+
+def _finish_turn(turn, gr_history, ans, raw_ans=None):
+    """Lưu câu trả lời (answer cache, Mongo) và trả kết quả chat_fn; raw_ans = text LLM vừa sinh (None nếu lấy từ cache)."""
+    session_id, user_input = turn["session_id"], turn["user_input"]
+    if raw_ans is not None:
+        if current_trace() is not None:
+            # tokenize lại chỉ khi đang trace
+            _, tokenizer = get_gen_pipe()
+            annotate(prompt_tokens=len(tokenizer(turn["prompt"])["input_ids"]),
+                     output_tokens=len(tokenizer(raw_ans, add_special_tokens=False)["input_ids"]))
+        if turn["answer_key"] is not None:
+            answer_cache.put(turn["answer_key"], ans)
 
-    # -------- 4) LLM generate ----------
-    full_prompt = custom_template.format(context=context, input=dectx_query)
-    ans_full = gen_pipe(full_prompt)[0]["generated_text"]
-    split_token = "### Trả lời:"
-    ans = ans_full.split(split_token, 1)[1].strip() if split_token in ans_full else ans_full.strip()
-    ans = clean_text(ans)
     # -------- 5) Update UI history ----------
     gr_history = gr_history or []
     gr_history.append((user_input, ans))
 
     # -------- 6) Save messages ----------
-    save_message(session_id, "user", user_input)
-    save_message(session_id, "assistant", ans)
-
     # -------- 7) Update recent_history top 3 ----------
-    recent_history.append({"user": dectx_query, "assistant": ans})
+    recent_history = turn["recent_history"]
+    recent_history.append({"user": turn["dectx_query"], "assistant": ans})
     if len(recent_history) > 3:
         recent_history = recent_history[-3:]
-    save_recent_history(session_id, recent_history)
+    with span("mongo_write"):
+        save_message(session_id, "user", user_input)
+        save_message(session_id, "assistant", ans)
+        save_recent_history(session_id, recent_history)
 
     # -------- 8) Build ref cards ----------
+    return session_id, gr_history, turn["retrieval_cache"], render_refs(turn["refs"], turn["dropped"])
+
+
+def render_refs(refs, dropped=None):
+    """HTML ref cards của các doc dùng làm context."""
     refs_html = """
     <style>
     .ref-card { padding:10px 14px; border-radius:10px; margin-bottom:10px; background:#f7f9fc; border:1px solid #e3e8ef; transition:all 0.2s ease; }
@@ -167,6 +372,8 @@ def chat_fn(session_id, gr_history, user_input, retrieval_cache):
     
     <div class="ref-container">
     """
+    if dropped:
+        refs_html += f"<div class='ref-meta'>⚠️ Bỏ qua nguồn tìm kiếm chậm / lỗi: {', '.join(dropped)}</div>"
     
     for ref in refs:  # giữ tất cả refs, nhưng container scrollable
         data = ref.get("bm25") or ref.get("pinecone")
@@ -185,9 +392,7 @@ def chat_fn(session_id, gr_history, user_input, retrieval_cache):
         """
     
     refs_html += "</div>"
-
-
-    return session_id, gr_history, retrieval_cache, refs_html
+    return refs_html
 
 
 # -------------------- 5️⃣ Session handlers --------------------
@@ -226,3 +431,19 @@ def delete_session_handler(session_label):
     delete_session(sid)
     new_sid = create_session("Phiên mới")
     return new_sid, [], [], "<div>Deleted session and created a new one.</div>"
+
+
+# -------------------- Tên cũ (lazy) --------------------
+_LEGACY_SERVICES = {
+    "sessions_col": get_sessions_col,
+    "bm25_retriever": get_bm25_retriever,
+    "embedding_model": get_embedding_model,
+    "gen_pipe": lambda: get_gen_pipe()[0],
+    "tokenizer": lambda: get_gen_pipe()[1],
+}
+
+def __getattr__(name):
+    # `from src.logic_module import bm25_retriever` trong notebook: load service khi truy cập
+    if name in _LEGACY_SERVICES:
+        return _LEGACY_SERVICES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
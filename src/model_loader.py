@@ -1,11 +1,10 @@
 # src/model_loader.py
 import os
-import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, BitsAndBytesConfig
-from peft import PeftModel
+import hashlib
 from .config import MODEL_OPTIONS, HF_TOKEN, BASE_DIR
+from .model_registry import get_llm
 
-print(torch.cuda.is_available())
+# torch / transformers / peft chỉ import khi load model: import module này phải nhẹ
 
 def load_model_with_adapter(model_key="qwen2-3b"):
     """
@@ -15,6 +14,10 @@ def load_model_with_adapter(model_key="qwen2-3b"):
         model: HuggingFace causal LM with adapter merged
         tokenizer: corresponding tokenizer
     """
+    import torch
+    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+    from peft import PeftModel
+
     if model_key not in MODEL_OPTIONS:
         raise ValueError(f"Model key '{model_key}' not found in MODEL_OPTIONS.")
 
@@ -50,11 +53,30 @@ def load_model_with_adapter(model_key="qwen2-3b"):
 
     return model, tokenizer
 
+def adapter_stamp(model_key="qwen2-3b"):
+    """
+    Stamp phiên bản (base model + adapter) của model_key: đổi khi adapter được train lại / ghi đè
+    (tên, kích thước, mtime các file trong adapter_dir). Không cần load model.
+    """
+    cfg = MODEL_OPTIONS[model_key]
+    parts = [model_key, cfg["base_model"]]
+    adapter_dir = cfg["adapter_dir"]
+    if os.path.isdir(adapter_dir):
+        for name in sorted(os.listdir(adapter_dir)):
+            path = os.path.join(adapter_dir, name)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                parts.append(f"{name}:{st.st_size}:{int(st.st_mtime)}")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
 def build_pipeline(model_key="qwen2-3b", max_new_tokens=512, temperature=0.2):
     """
     Returns a HuggingFace pipeline ready for text-generation
+    (model + tokenizer lấy từ model registry, không load lại nếu đã có)
     """
-    model, tokenizer = load_model_with_adapter(model_key)
+    from transformers import pipeline
+
+    model, tokenizer = get_llm(model_key)
     gen_pipe = pipeline(
         "text-generation",
         model=model,
@@ -65,6 +87,44 @@ def build_pipeline(model_key="qwen2-3b", max_new_tokens=512, temperature=0.2):
     )
     return gen_pipe, tokenizer
 
+def stream_pipeline(gen_pipe, prompt, stop_event=None, **generate_kwargs):
+    """
+    Chạy gen_pipe(prompt) trên worker thread, yield từng đoạn text mới (không gồm prompt) ngay khi
+    được decode (TextIteratorStreamer). stop_event (threading.Event) được set thì dừng decode ở token kế tiếp
+    (vd đã gặp cụm cần cắt, hoặc client ngắt kết nối).
+    """
+    import threading
+    import torch
+    from transformers import TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+
+    streamer = TextIteratorStreamer(gen_pipe.tokenizer, skip_prompt=True, skip_special_tokens=True)
+    criteria = list(generate_kwargs.pop("stopping_criteria", None) or [])
+    if stop_event is not None:
+        class StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), stop_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+        criteria.append(StopOnEvent())
+    if criteria:
+        generate_kwargs["stopping_criteria"] = StoppingCriteriaList(criteria)
+
+    errors = []
+
+    def run():
+        try:
+            gen_pipe(prompt, streamer=streamer, **generate_kwargs)
+        except Exception as e:
+            errors.append(e)
+            streamer.end()           # mở khóa vòng lặp đọc streamer
+
+    worker = threading.Thread(target=run, name="llm-stream", daemon=True)
+    worker.start()
+    for text in streamer:
+        yield text
+    worker.join()
+    if errors:
+        raise errors[0]
+
 # ======= DEBUG / TEST =======
 if __name__ == "__main__":
     key = "qwen2-3b"
@@ -0,0 +1,149 @@
+# src/model_registry.py
+import gc
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .config import EMBED_MODEL_NAME, EMBED_BACKEND, MODEL_OPTIONS, MODEL_KEY
+
+EMBEDDING = "embedding"
+
+
+def llm_name(model_key):
+    """Tên trong registry của LLM (base model + adapter) theo key của MODEL_OPTIONS."""
+    return f"llm:{model_key}"
+
+
+# ============================================================
+# Registry
+# ============================================================
+class ModelRegistry:
+    """
+    Registry model (và tài nguyên nặng khác: BM25, kết nối DB) dùng chung cho cả process: mỗi
+    model được load một lần (lazy, lần đầu get), mọi module gọi get(name) nhận cùng một object.
+
+    - register(name, loader): khai báo cách load, chưa load gì
+    - get(name):              load nếu chưa có rồi trả về instance dùng chung
+    - warmup(names):          load trước (vd lúc khởi động server), song song các model độc lập
+    - unload(name):           bỏ instance, giải phóng RAM / VRAM; get sau đó sẽ load lại
+    - report():               bảng thời gian load từng model
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._load_seconds = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Model '{name}' is not registered")
+        # lock riêng từng model: thread khác chờ đúng model đang load, không load trùng,
+        # và load LLM không chặn get embedding
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._loaders[name]()
+                self._load_seconds[name] = time.perf_counter() - start
+                self._models[name] = model
+                print(f"[MODEL] Loaded {name} in {self._load_seconds[name]:.1f}s")
+        return model
+
+    def warmup(self, names=None, parallel=True):
+        """
+        Load trước các model (mặc định embedding + LLM của MODEL_KEY), trả về thời gian tổng (s).
+        parallel=True: mỗi model load trên một thread (phần lớn thời gian là đọc file / copy weight
+        lên GPU, không giữ GIL). Lỗi load của model nào được raise sau khi các model khác load xong.
+        """
+        names = list(names or (EMBEDDING, llm_name(MODEL_KEY)))
+        start = time.perf_counter()
+        if parallel and len(names) > 1:
+            with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="warmup") as pool:
+                futures = [pool.submit(self.get, name) for name in names]
+            for future in futures:
+                future.result()
+        else:
+            for name in names:
+                self.get(name)
+        return time.perf_counter() - start
+
+    def unload(self, name):
+        with self._locks.get(name, self._lock):
+            model = self._models.pop(name, None)
+            self._load_seconds.pop(name, None)
+        if model is None:
+            return False
+        del model
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        return True
+
+    def loaded(self):
+        """{tên model: số giây load} của các model đang nằm trong bộ nhớ."""
+        return dict(self._load_seconds)
+
+    def report(self, wall_seconds=None):
+        lines = ["===== Startup ====="]
+        for name, seconds in sorted(self._load_seconds.items(), key=lambda x: -x[1]):
+            lines.append(f"  {name:<24} {seconds:7.2f}s")
+        if wall_seconds is not None:
+            total = sum(self._load_seconds.values())
+            lines.append(f"  {'wall time':<24} {wall_seconds:7.2f}s (tổng tuần tự {total:.2f}s)")
+        return "\n".join(lines)
+
+
+# ============================================================
+# Loaders
+# ============================================================
+def _load_torch_embedding_model():
+    import torch
+    from sentence_transformers import SentenceTransformer
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    return SentenceTransformer(EMBED_MODEL_NAME, device=device)
+
+
+def _load_embedding_model():
+    if EMBED_BACKEND == "onnx":
+        from .onnx_embedder import OnnxEmbedder
+        return OnnxEmbedder()
+    if EMBED_BACKEND != "torch":
+        raise ValueError(f"Unknown EMBED_BACKEND: {EMBED_BACKEND}")
+    return _load_torch_embedding_model()
+
+
+def _llm_loader(model_key):
+    def load():
+        from .model_loader import load_model_with_adapter
+        return load_model_with_adapter(model_key)
+    return load
+
+
+registry = ModelRegistry()
+registry.register(EMBEDDING, _load_embedding_model)
+for _key in MODEL_OPTIONS:
+    registry.register(llm_name(_key), _llm_loader(_key))
+
+
+def get_embedding_model():
+    """Embedder EMBED_MODEL_NAME dùng chung (embed_text, build_context, ingest), theo EMBED_BACKEND."""
+    return registry.get(EMBEDDING)
+
+
+def get_llm(model_key=MODEL_KEY):
+    """(model, tokenizer) đã merge adapter của model_key, dùng chung."""
+    return registry.get(llm_name(model_key))
@@ -0,0 +1,193 @@
+# src/onnx_embedder.py
+import os
+import csv
+import json
+import time
+import numpy as np
+from .config import (
+    BASE_DIR, EMBED_MODEL_NAME, ONNX_EMBED_DIR, ONNX_NUM_THREADS,
+    EMBED_BATCH_SIZE, EMBED_MAX_LENGTH
+)
+
+_FP32_FILE = "model_fp32.onnx"
+_INT8_FILE = "model_int8.onnx"
+
+
+# ============================================================
+# Export: bge-m3 -> ONNX (CLS pooling) -> dynamic int8
+# ============================================================
+def export_onnx(out_dir=ONNX_EMBED_DIR, model_name=EMBED_MODEL_NAME, opset=17):
+    """
+    Export encoder của model_name ra ONNX (output = vector CLS, chưa normalize, giống pooling của
+    bge-m3 trong SentenceTransformer) rồi quantize dynamic int8 weight. Ghi tokenizer vào cùng thư mục.
+    """
+    import torch
+    from transformers import AutoTokenizer, AutoModel
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    class ClsPooler(torch.nn.Module):
+        def __init__(self, encoder):
+            super().__init__()
+            self.encoder = encoder
+
+        def forward(self, input_ids, attention_mask):
+            return self.encoder(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, 0]
+
+    dummy = tokenizer(["xin chào", "điều 6 khoản 2 luật lao động"], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(out_dir, _FP32_FILE)
+    # fp32 của bge-m3 > 2GB: torch tự ghi weight ra external data cạnh file .onnx
+    with torch.no_grad():
+        torch.onnx.export(
+            ClsPooler(model), (dummy["input_ids"], dummy["attention_mask"]), fp32_path,
+            input_names=["input_ids", "attention_mask"], output_names=["embedding"],
+            dynamic_axes={"input_ids": {0: "batch", 1: "seq"},
+                          "attention_mask": {0: "batch", 1: "seq"},
+                          "embedding": {0: "batch"}},
+            opset_version=opset,
+        )
+    int8_path = os.path.join(out_dir, _INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, use_external_data_format=False)
+    tokenizer.save_pretrained(out_dir)
+    with open(os.path.join(out_dir, "export.json"), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "opset": opset, "quantization": "dynamic-int8"}, f, indent=2)
+    print(f"✔ Exported {model_name} to {int8_path}")
+    return int8_path
+
+
+# ============================================================
+# Embedder
+# ============================================================
+class OnnxEmbedder:
+    """
+    Embedder bge-m3 int8 chạy bằng onnxruntime trên CPU, dùng thay SentenceTransformer
+    (cùng interface encode, vector đã L2-normalize).
+
+    Text được tokenize một lần, sắp theo số token rồi chia batch, mỗi batch chỉ pad tới text dài
+    nhất trong batch: text ngắn (query) không phải chạy qua padding của text dài.
+    """
+
+    def __init__(self, model_dir=ONNX_EMBED_DIR, num_threads=ONNX_NUM_THREADS,
+                 batch_size=EMBED_BATCH_SIZE, max_length=EMBED_MAX_LENGTH, quantized=True):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(model_dir, _INT8_FILE if quantized else _FP32_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found: {model_path} (run python -m src.onnx_embedder export)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _run(self, input_ids, attention_mask):
+        return self.session.run(["embedding"], {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+
+    def encode(self, sentences, batch_size=None, normalize_embeddings=True, **kwargs):
+        """Như SentenceTransformer.encode: str -> vector (dim,), list -> ma trận (n, dim)."""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batch_size = batch_size or self.batch_size
+
+        ids = self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+        order = np.argsort([len(x) for x in ids], kind="stable")
+        pad_id = self.tokenizer.pad_token_id
+
+        out = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            width = max(len(ids[i]) for i in rows)
+            input_ids = np.full((len(rows), width), pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(rows), width), dtype=np.int64)
+            for j, i in enumerate(rows):
+                input_ids[j, :len(ids[i])] = ids[i]
+                attention_mask[j, :len(ids[i])] = 1
+            emb = self._run(input_ids, attention_mask)
+            if out is None:
+                out = np.empty((len(texts), emb.shape[1]), dtype=np.float32)
+            out[rows] = emb
+
+        if normalize_embeddings:
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out[0] if single else out
+
+
+# ============================================================
+# Parity check: int8 ONNX vs fp32 SentenceTransformer
+# ============================================================
+def load_eval_set(eval_csv):
+    """(corpus {id: clause_text}, list (question, id đúng)) từ file eval (cột id, clause_text, question)."""
+    corpus, queries = {}, []
+    with open(eval_csv, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            corpus.setdefault(row["id"], row["clause_text"])
+            if row.get("question"):
+                queries.append((row["question"], row["id"]))
+    return corpus, queries
+
+
+def _hit_at_k(query_vecs, corpus_vecs, gold_rows, ks):
+    sims = query_vecs @ corpus_vecs.T
+    ranks = (sims > sims[np.arange(len(gold_rows)), gold_rows][:, None]).sum(axis=1)
+    return {k: float(np.mean(ranks < k)) for k in ks}
+
+
+def parity_check(eval_csv=None, reference=None, candidate=None, ks=(1, 5, 10), batch_size=EMBED_BATCH_SIZE):
+    """
+    So sánh embedder `candidate` (mặc định OnnxEmbedder int8) với `reference` (mặc định
+    SentenceTransformer fp32) trên eval set: cosine giữa 2 vector của cùng text, và hit@k khi
+    search câu hỏi trên các clause của eval set bằng từng embedder.
+    """
+    eval_csv = eval_csv or os.path.join(BASE_DIR, "data", "eval_data.csv")
+    corpus, queries = load_eval_set(eval_csv)
+    doc_ids = list(corpus)
+    row_of = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    gold_rows = np.array([row_of[doc_id] for _, doc_id in queries])
+    texts = [corpus[doc_id] for doc_id in doc_ids]
+    questions = [q for q, _ in queries]
+
+    if reference is None:
+        from .model_registry import _load_torch_embedding_model
+        reference = _load_torch_embedding_model()
+    if candidate is None:
+        candidate = OnnxEmbedder()
+
+    report = {"n_docs": len(texts), "n_queries": len(questions)}
+    vecs = {}
+    for name, model in (("reference", reference), ("candidate", candidate)):
+        start = time.perf_counter()
+        docs = np.asarray(model.encode(texts, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+        qs = np.asarray(model.encode(questions, batch_size=batch_size, normalize_embeddings=True), dtype=np.float32)
+        report[f"{name}_seconds"] = time.perf_counter() - start
+        report[f"{name}_hit@k"] = _hit_at_k(qs, docs, gold_rows, ks)
+        vecs[name] = np.vstack([docs, qs])
+
+    cos = np.sum(vecs["reference"] * vecs["candidate"], axis=1)
+    report["cosine_mean"] = float(cos.mean())
+    report["cosine_p1"] = float(np.percentile(cos, 1))
+    report["cosine_min"] = float(cos.min())
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m src.onnx_embedder export [out_dir]
+    # python -m src.onnx_embedder parity [eval_data.csv]
+    command = sys.argv[1] if len(sys.argv) > 1 else "parity"
+    if command == "export":
+        export_onnx(sys.argv[2] if len(sys.argv) > 2 else ONNX_EMBED_DIR)
+    else:
+        report = parity_check(sys.argv[2] if len(sys.argv) > 2 else None)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
@@ -1,36 +1,62 @@
 import os
-from sentence_transformers import SentenceTransformer
-import torch
+import threading
 from .config import (
     BASE_DIR, PINECONE_API_KEY, PINECONE_INDEX_NAME,
-    EMBED_MODEL_NAME, PINECONE_TOP_K
+    EMBED_MODEL_NAME, EMBED_BACKEND, PINECONE_TOP_K, EMBED_CACHE_SIZE, EMBED_CACHE_PATH,
+    EMBED_MICRO_BATCHING, EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS, EMBED_QUEUE_SIZE, PINECONE_REQUEST_TIMEOUT
 )
-from pinecone import Pinecone
+from .embedding_cache import EmbeddingCache
+from .embedding_batcher import EmbeddingBatcher
+from .model_registry import get_embedding_model
 
 # -----------------------
-# Pinecone init
+# Pinecone init (khi query lần đầu, để backend local chạy được offline)
 # -----------------------
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index_pinecone = pc.Index(PINECONE_INDEX_NAME)
+index_pinecone = None
+_pinecone_lock = threading.Lock()
+
+def get_pinecone_index():
+    """Index Pinecone dùng chung; lần đầu thường gọi đồng thời từ retrieval pool nên khởi tạo trong lock."""
+    global index_pinecone
+    if index_pinecone is None:
+        with _pinecone_lock:
+            if index_pinecone is None:
+                from pinecone import Pinecone
+                pc = Pinecone(api_key=PINECONE_API_KEY)
+                index_pinecone = pc.Index(PINECONE_INDEX_NAME)
+    return index_pinecone
 
 # -----------------------
-# Embedding model init
+# Embedding (model dùng chung trong model registry, load khi embed lần đầu)
 # -----------------------
-device = "cuda" if torch.cuda.is_available() else "cpu"
-embedding_model = SentenceTransformer(EMBED_MODEL_NAME, device=device)
+# vector int8 (onnx) hơi khác fp32 nên cache tách theo backend
+embedding_cache = EmbeddingCache(EMBED_CACHE_SIZE, path=EMBED_CACHE_PATH, model_name=f"{EMBED_MODEL_NAME}:{EMBED_BACKEND}")
+
+# query của các chat_fn chạy đồng thời được encode chung một batch
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: get_embedding_model().encode(texts, batch_size=len(texts)),
+    max_batch_size=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS, max_queue=EMBED_QUEUE_SIZE
+)
+
+def _encode_query(text):
+    if EMBED_MICRO_BATCHING:
+        return embedding_batcher.embed(text)
+    return get_embedding_model().encode(text)
 
 def embed_text(text: str):
-    emb = embedding_model.encode(text)
+    # query lặp lại (cùng text sau khi chuẩn hóa khoảng trắng) không chạy lại bge-m3
+    emb = embedding_cache.get_or_compute(text, _encode_query)
     return emb.tolist()
 
 # -----------------------
 # Query Pinecone (text hoặc vector)
 # -----------------------
-def search_pinecone(query_input, top_k=PINECONE_TOP_K, is_vector=True):
+def search_pinecone(query_input, top_k=PINECONE_TOP_K, is_vector=True, timeout=PINECONE_REQUEST_TIMEOUT):
     """
     query_input:
         - nếu is_vector=False → query_input là TEXT, sẽ embed
         - nếu is_vector=True  → query_input là VECTOR, dùng trực tiếp
+    timeout: timeout phía client (giây) của request Pinecone, None = chờ tới khi xong
 
     Example:
         search_pinecone("tìm điều khoản")  --> auto embed
@@ -41,10 +67,12 @@ def search_pinecone(query_input, top_k=PINECONE_TOP_K, is_vector=True):
         vector = query_input
     else:
         vector = embed_text(query_input)
-    matches = index_pinecone.query(
+    kwargs = {} if timeout is None else {"_request_timeout": timeout}
+    matches = get_pinecone_index().query(
         vector=vector,
         top_k=top_k,
-        include_metadata=True
+        include_metadata=True,
+        **kwargs
     )["matches"]
 
     # 3) chuẩn hóa kết quả
@@ -1,18 +1,62 @@
 # postprocessing.py
 import re
 
+# Các cụm model hay sinh tiếp sau câu trả lời (kể cả header template "### Câu hỏi:" / "### Ngữ cảnh...")
+_CUTOFF = re.compile(
+    r"(###\s*(?:ngữ\s*cảnh|câu\s*hỏi|trả\s*lời)|câu\s*hỏi\s*:|cấu\s*trúc\s*trả\s*lời\s*:|trợ\s∗lý\s∗pháp\s∗lý\s∗AItrợ\s*lý\s*pháp\s*lý\s*AI|\(trợ\s*lý\s*pháp\s*lý\s*AI\))",
+    flags=re.IGNORECASE
+)
+# Một cụm cần loại bỏ trải dài tối đa chừng này từ (tách theo khoảng trắng)
+_CUTOFF_MAX_WORDS = 6
+
+
+def cutoff_index(text: str, start: int = 0):
+    """Vị trí bắt đầu cụm cần loại bỏ đầu tiên (từ `start`), None nếu không có."""
+    match = _CUTOFF.search(text, start)
+    return match.start() if match else None
+
+
 def clean_text(raw_text: str) -> str:
     # Tìm vị trí của các cụm cần loại bỏ, bao gồm [] hoặc ()
-    match = re.search(
-        r"(câu\s*hỏi\s*:|cấu\s*trúc\s*trả\s*lời\s*:|trợ\s∗lý\s∗pháp\s∗lý\s∗AItrợ\s*lý\s*pháp\s*lý\s*AI|\(trợ\s*lý\s*pháp\s*lý\s*AI\))",
-        raw_text,
-        flags=re.IGNORECASE
-    )
-    if match:
-        return raw_text[:match.start()].strip()
+    cut = cutoff_index(raw_text)
+    if cut is not None:
+        return raw_text[:cut].strip()
     return raw_text.strip()
 
 
+class StreamingCleaner:
+    """
+    clean_text áp dụng dần cho text đang stream: feed(chunk) trả về phần đã chắc chắn hiển thị được.
+    Vài từ cuối được giữ lại tới khi có thêm text (có thể là đầu của một cụm cần loại bỏ); gặp cụm cần
+    loại bỏ thì `done` = True và text dừng ở đó. finish() trả về đúng clean_text(toàn bộ text).
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self.text = ""
+        self.done = False
+        self._checked = 0        # trước vị trí này không thể bắt đầu một cụm cần loại bỏ
+
+    def feed(self, chunk):
+        if self.done:
+            return self.text
+        self.raw += chunk
+        cut = cutoff_index(self.raw, self._checked)
+        if cut is not None:
+            self.done = True
+            self.text = self.raw[:cut].strip()
+            return self.text
+        parts = self.raw.rsplit(None, _CUTOFF_MAX_WORDS)
+        if len(parts) > _CUTOFF_MAX_WORDS:
+            self._checked = len(parts[0])
+            self.text = parts[0].strip()
+        return self.text
+
+    def finish(self):
+        self.text = clean_text(self.raw)
+        return self.text
+
+
 if __name__ == "__main__":
     TEST = """
 Đây là phần trả lời hợp lệ.
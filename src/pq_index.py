@@ -0,0 +1,303 @@
+# src/pq_index.py
+import os
+import json
+import time
+import shutil
+from datetime import datetime, timezone
+import numpy as np
+from .config import (
+    BASE_DIR, PINECONE_TOP_K, PQ_INDEX_DIR, PQ_SUBSPACES, PQ_OPQ, PQ_RERANK
+)
+from .bm25_metadata import MetadataStore
+from .embedding_artifact import EmbeddingArtifact
+from .vector_store import VectorBackend, format_match, _normalize, _item_from_record
+
+PQ_INDEX_FORMAT_VERSION = 1
+
+# Số centroid mỗi subspace (code 1 byte)
+PQ_CENTROIDS = 256
+
+_ARRAY_FILES = ("codes", "codebooks", "rotation", "vectors")
+
+
+# ============================================================
+# k-means L2 (train codebook từng subspace)
+# ============================================================
+def _assign_l2(x, centroids, batch_size=16384):
+    # argmin ||x - c||² = argmin (||c||² - 2 x·c): bỏ ||x||² (hằng theo từng dòng)
+    c_sq = (centroids * centroids).sum(1)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), batch_size):
+        assign[start:start + batch_size] = np.argmin(c_sq - 2 * (x[start:start + batch_size] @ centroids.T), axis=1)
+    return assign
+
+
+def _kmeans_l2(x, k, n_iter, rng, init=None):
+    centroids = x[rng.choice(len(x), k, replace=False)].copy() if init is None else init.copy()
+    for _ in range(n_iter):
+        assign = _assign_l2(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        # bincount theo từng chiều: nhanh hơn nhiều so với np.add.at với subspace ít chiều
+        sums = np.stack([np.bincount(assign, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = (sums[filled] / counts[filled, None]).astype(centroids.dtype)
+        # cụm rỗng: lấy lại một điểm ngẫu nhiên
+        n_empty = int((~filled).sum())
+        if n_empty:
+            centroids[~filled] = x[rng.choice(len(x), n_empty)]
+    return centroids
+
+
+# ============================================================
+# PQ index
+# ============================================================
+class PQVectorIndex(VectorBackend):
+    """
+    Index vector nén bằng product quantization (tùy chọn OPQ), search 2 bước:
+
+    1. Vector (đã chuẩn hóa, xoay bởi `rotation` nếu dùng OPQ) chia thành `m` subspace, mỗi subspace
+       lưu mã 1 byte (centroid gần nhất trong `codebooks[m]`): 1024 chiều float32 4KB -> m byte.
+       Điểm xấp xỉ của query với mọi vector = tổng bảng tra tích vô hướng (ADC), chỉ đọc `codes`.
+    2. `rerank` ứng viên điểm cao nhất được tính lại cosine exact với `vectors` (float16 trên đĩa,
+       memory-map: chỉ các dòng ứng viên được đọc vào RAM).
+
+    Điểm trả về là cosine exact như Pinecone / LocalVectorIndex.
+    """
+
+    name = "pq"
+
+    def __init__(self, codes, codebooks, rotation, vectors, items, meta=None):
+        # column-major: mã của mỗi subspace liên tục trong bộ nhớ cho vòng cộng bảng tra ADC
+        self.codes = np.asfortranarray(codes)
+        self.codebooks = codebooks
+        self.rotation = rotation
+        self.vectors = vectors
+        self.metadata = items if isinstance(items, MetadataStore) else MetadataStore.from_items(items)
+        self.meta = dict(meta or {})
+
+    @property
+    def n_vectors(self):
+        return int(len(self.codes))
+
+    @property
+    def n_subspaces(self):
+        return int(self.codebooks.shape[0])
+
+    # --------------------------------------------------------
+    # Build
+    # --------------------------------------------------------
+    @classmethod
+    def build(cls, vectors, items, m=PQ_SUBSPACES, opq=PQ_OPQ, n_iter=15, opq_iter=5,
+              train_size=32768, seed=0, meta=None):
+        """vectors[i] là embedding của items[i]; dim phải chia hết cho m."""
+        vectors = _normalize(vectors)
+        if len(vectors) != len(items):
+            raise ValueError(f"{len(vectors)} vectors for {len(items)} items")
+        n, dim = vectors.shape
+        if dim % m:
+            raise ValueError(f"dim {dim} is not divisible by {m} subspaces")
+        rng = np.random.default_rng(seed)
+        train = vectors if n <= train_size else vectors[rng.choice(n, train_size, replace=False)]
+        ks = min(PQ_CENTROIDS, len(train))
+
+        rotation = np.eye(dim, dtype=np.float32)
+        codebooks = None
+        if opq:
+            # OPQ non-parametric: xen kẽ train codebook trên X·R và cập nhật R (Procrustes)
+            # để lượng tử hóa X·R ít sai số nhất
+            for _ in range(opq_iter):
+                codebooks = cls._train_codebooks(train @ rotation, m, ks, max(2, n_iter // opq_iter), rng, codebooks)
+                recon = cls._decode(cls._encode(train @ rotation, codebooks), codebooks)
+                u, _, vt = np.linalg.svd(train.T @ recon)
+                rotation = (u @ vt).astype(np.float32)
+        codebooks = cls._train_codebooks(train @ rotation, m, ks, n_iter, rng, codebooks)
+        codes = cls._encode(vectors @ rotation, codebooks)
+
+        meta = dict(meta or {})
+        meta.update({"opq": bool(opq), "train_size": int(len(train))})
+        return cls(codes, codebooks, rotation if opq else np.zeros((0, 0), dtype=np.float32),
+                   vectors.astype(np.float16), items, meta=meta)
+
+    @classmethod
+    def from_artifact(cls, artifact, **kwargs):
+        """Build từ EmbeddingArtifact (hoặc đường dẫn) của embedding_artifact."""
+        if not isinstance(artifact, EmbeddingArtifact):
+            artifact = EmbeddingArtifact(artifact)
+        items = [_item_from_record(r) for r in artifact.records()]
+        meta = {"source_artifact": os.path.abspath(artifact.path), "model": artifact.meta.get("model", "")}
+        meta.update(kwargs.pop("meta", {}) or {})
+        return cls.build(artifact.as_float32(), items, meta=meta, **kwargs)
+
+    @staticmethod
+    def _train_codebooks(x, m, ks, n_iter, rng, init=None):
+        dsub = x.shape[1] // m
+        return np.stack([
+            _kmeans_l2(x[:, i * dsub:(i + 1) * dsub], ks, n_iter, rng, None if init is None else init[i])
+            for i in range(m)
+        ]).astype(np.float32)
+
+    @staticmethod
+    def _encode(x, codebooks):
+        m, _, dsub = codebooks.shape
+        codes = np.empty((len(x), m), dtype=np.uint8)
+        for i in range(m):
+            codes[:, i] = _assign_l2(x[:, i * dsub:(i + 1) * dsub], codebooks[i])
+        return codes
+
+    @staticmethod
+    def _decode(codes, codebooks):
+        m = codebooks.shape[0]
+        return np.concatenate([codebooks[i][codes[:, i]] for i in range(m)], axis=1)
+
+    # --------------------------------------------------------
+    # Persist (cùng layout thư mục với LocalVectorIndex)
+    # --------------------------------------------------------
+    def save(self, index_dir):
+        index_dir = os.path.abspath(index_dir)
+        tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for name in _ARRAY_FILES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp_dir, "items.jsonl"), "w", encoding="utf-8") as f:
+            for doc_id in range(len(self.metadata)):
+                f.write(json.dumps(self.metadata.get(doc_id), ensure_ascii=False) + "\n")
+
+        meta = dict(self.meta)
+        meta.update({
+            "format_version": PQ_INDEX_FORMAT_VERSION,
+            "n_vectors": self.n_vectors,
+            "dim": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "n_subspaces": self.n_subspaces,
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        })
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self.meta = meta
+
+        old_dir = f"{index_dir}.old-{os.getpid()}"
+        if os.path.exists(index_dir):
+            os.rename(index_dir, old_dir)
+        os.rename(tmp_dir, index_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir):
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"PQ vector index not found: {index_dir}")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != PQ_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported PQ index format {meta.get('format_version')} in {index_dir}")
+        # codes + codebook nhỏ, đọc hẳn vào RAM; vector đầy đủ chỉ memory-map cho bước re-rank
+        arrays = {name: np.load(os.path.join(index_dir, f"{name}.npy")) for name in _ARRAY_FILES if name != "vectors"}
+        arrays["vectors"] = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r").view(np.ndarray)
+        with open(os.path.join(index_dir, "items.jsonl"), "r", encoding="utf-8") as f:
+            store = MetadataStore.from_items(json.loads(line) for line in f if line.strip())
+        return cls(items=store, meta=meta, **arrays)
+
+    # --------------------------------------------------------
+    # Search
+    # --------------------------------------------------------
+    def approximate_scores(self, query):
+        """Tích vô hướng xấp xỉ (ADC) của query đã chuẩn hóa với mọi vector."""
+        if self.rotation.size:
+            query = query @ self.rotation
+        m, _, dsub = self.codebooks.shape
+        lut = np.einsum("mkd,md->mk", self.codebooks, query.reshape(m, dsub))
+        scores = np.zeros(self.n_vectors, dtype=np.float32)
+        for i in range(m):
+            scores += lut[i][self.codes[:, i]]
+        return scores
+
+    def search_rows(self, vector, top_k=PINECONE_TOP_K, rerank=PQ_RERANK):
+        """(rows, cosine exact) top_k; rerank=0: trả thẳng điểm ADC (không đọc vector đầy đủ)."""
+        if top_k <= 0 or not self.n_vectors:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = _normalize(vector)
+        approx = self.approximate_scores(query)
+        n_cand = min(max(rerank, top_k), self.n_vectors)
+        cand = np.argpartition(-approx, n_cand - 1)[:n_cand]
+        if rerank:
+            cand.sort()   # đọc mmap theo thứ tự dòng
+            scores = np.asarray(self.vectors[cand], dtype=np.float32) @ query
+        else:
+            scores = approx[cand]
+        k = min(top_k, len(cand))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return cand[top], scores[top]
+
+    def search(self, vector, top_k=PINECONE_TOP_K, rerank=PQ_RERANK):
+        rows, scores = self.search_rows(vector, top_k, rerank)
+        results = []
+        for row, score in zip(rows, scores):
+            item = self.metadata.get(int(row))
+            if item is not None:
+                results.append(format_match(item, score))
+        return results
+
+    def nbytes_in_memory(self):
+        """Bộ nhớ nằm thường trực trong RAM (codes + codebook + rotation; vector đầy đủ là mmap)."""
+        return int(self.codes.nbytes + self.codebooks.nbytes + self.rotation.nbytes)
+
+
+# ============================================================
+# Recall@k so với search exact
+# ============================================================
+def recall_at_k(index, queries, ks=(1, 5, 10), rerank=PQ_RERANK):
+    """
+    Recall@k trung bình của PQ index (có / không re-rank) so với search exact trên vector đầy đủ:
+    |top-k PQ ∩ top-k exact| / k, cho từng k trong ks.
+    """
+    queries = _normalize(queries)
+    max_k = max(ks)
+    full = np.asarray(index.vectors, dtype=np.float32)
+    exact_scores = queries @ full.T
+    exact = np.argsort(-exact_scores, axis=1, kind="stable")[:, :max_k]
+
+    report = {"n_queries": int(len(queries)), "rerank": int(rerank)}
+    for label, n_rerank in (("adc", 0), ("rerank", rerank)):
+        hits = {k: 0.0 for k in ks}
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            rows, _ = index.search_rows(q, max_k, n_rerank)
+            for k in ks:
+                hits[k] += len(set(rows[:k].tolist()) & set(truth[:k].tolist())) / k
+        report[f"{label}_ms_per_query"] = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        report[f"{label}_recall@k"] = {k: hits[k] / max(len(queries), 1) for k in ks}
+    return report
+
+
+def evaluate_recall(index, eval_csv=None, encode=None, ks=(1, 5, 10), rerank=PQ_RERANK):
+    """recall_at_k trên câu hỏi của eval set (cột question), embed bằng model dùng chung."""
+    from .onnx_embedder import load_eval_set
+    eval_csv = eval_csv or os.path.join(BASE_DIR, "data", "eval_data.csv")
+    _, queries = load_eval_set(eval_csv)
+    if encode is None:
+        from .model_registry import get_embedding_model
+        encode = get_embedding_model().encode
+    vectors = np.asarray(encode([q for q, _ in queries]), dtype=np.float32)
+    return recall_at_k(index, vectors, ks=ks, rerank=rerank)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m src.pq_index build embedded_laws.emb [index_dir]
+    # python -m src.pq_index recall [eval_data.csv]
+    command = sys.argv[1] if len(sys.argv) > 1 else "recall"
+    if command == "build":
+        index = PQVectorIndex.from_artifact(sys.argv[2])
+        index_dir = sys.argv[3] if len(sys.argv) > 3 else PQ_INDEX_DIR
+        index.save(index_dir)
+        print(f"✔ Saved PQ index ({index.n_vectors} vectors, {index.n_subspaces} subspaces, "
+              f"{index.nbytes_in_memory() / 1e6:.1f}MB in RAM) to {index_dir}")
+    else:
+        index = PQVectorIndex.load(PQ_INDEX_DIR)
+        report = evaluate_recall(index, sys.argv[2] if len(sys.argv) > 2 else None)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
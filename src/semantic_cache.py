@@ -0,0 +1,249 @@
+# src/semantic_cache.py
+import os
+import json
+import time
+import atexit
+import threading
+import numpy as np
+from .cache_persist import BackgroundSaver, save_npz
+from .config import (
+    COSINE_THRESHOLD, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL,
+    SHARED_RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_PATH
+)
+
+
+class SemanticCache:
+    """
+    Cache kết quả retrieval theo độ tương đồng cosine của query vector.
+
+    Query vector (đã chuẩn hóa) nằm trong ma trận cấp phát sẵn (max_entries, dim): lookup là một
+    phép nhân ma trận-vector, chi phí không tăng theo độ dài hội thoại. Query giống nhất có
+    cosine >= threshold là hit. Khi đầy, entry dùng lâu nhất bị thay (LRU); entry quá `ttl` giây
+    (None = không hết hạn) không còn được trả về.
+
+    `version` là stamp của corpus / index lúc cache được ghi: check_version(stamp) xóa toàn bộ cache
+    khi stamp đổi (corpus được cập nhật). Mọi thao tác giữ lock, dùng chung được giữa các thread.
+
+    Có `path` + `save_every`: sau mỗi `save_every` entry mới, cache được ghi ra file ở thread nền
+    (add() không chờ ghi file); lần ghi cuối khi thoát do atexit gọi save().
+    """
+
+    def __init__(self, max_entries=RETRIEVAL_CACHE_SIZE, threshold=COSINE_THRESHOLD, ttl=RETRIEVAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.matrix = None                       # cấp phát ở lần add đầu (khi biết dim)
+        self.valid = np.zeros(max_entries, dtype=bool)
+        self.created = np.zeros(max_entries)
+        self.last_used = np.zeros(max_entries)
+        self.entries = [None] * max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lookup_seconds = 0.0
+        self._max_lookup_seconds = 0.0
+        self.version = None
+        self.path = None
+        self.save_every = 0
+        self._unsaved = 0
+        self._init_sync()
+
+    def _init_sync(self):
+        self._lock = threading.RLock()
+        # chỉ một lần ghi file tại một thời điểm (thread nền và atexit)
+        self._save_lock = threading.Lock()
+        self._saver = BackgroundSaver(self.save, name="semantic-cache-save")
+
+    def __getstate__(self):
+        # lock / thread không copy / pickle được (vd khi Gradio deepcopy state)
+        state = self.__dict__.copy()
+        for name in ("_lock", "_save_lock", "_saver"):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_sync()
+
+    @classmethod
+    def from_entries(cls, entries, **kwargs):
+        """Từ list cache kiểu cũ ({query_text, query_vec, docs}), vd state Gradio rỗng []."""
+        cache = cls(**kwargs)
+        for item in entries or []:
+            if item.get("query_vec") is not None:
+                cache.add(item.get("query_text", ""), item["query_vec"], item["docs"])
+        return cache
+
+    def __len__(self):
+        return int(self.valid.sum())
+
+    def __iter__(self):
+        for slot in np.flatnonzero(self.valid):
+            yield self.entries[slot]
+
+    def _expire(self, now):
+        if self.ttl is not None:
+            self.valid &= self.created >= now - self.ttl
+
+    def check_version(self, version):
+        """Xóa cache nếu version (stamp corpus / index) khác lúc các entry được ghi."""
+        with self._lock:
+            if version != self.version:
+                if self.version is not None and len(self):
+                    print(f"[CACHE] Index changed ({self.version} -> {version}), flushed {len(self)} entries")
+                self.clear()
+                self.version = version
+
+    def lookup(self, query_vec):
+        """(entry, cosine) của query cache giống nhất nếu cosine >= threshold, ngược lại (None, cosine cao nhất)."""
+        with self._lock:
+            return self._lookup(query_vec)
+
+    def _lookup(self, query_vec):
+        start = time.perf_counter()
+        now = time.time()
+        entry, best = None, None
+        if self.matrix is not None:
+            self._expire(now)
+            if self.valid.any():
+                q = np.asarray(query_vec, dtype=np.float32)
+                q = q / max(float(np.linalg.norm(q)), 1e-12)
+                sims = self.matrix @ q
+                sims[~self.valid] = -np.inf
+                slot = int(np.argmax(sims))
+                best = float(sims[slot])
+                if best >= self.threshold:
+                    entry = self.entries[slot]
+                    self.last_used[slot] = now
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        elapsed = time.perf_counter() - start
+        self._lookup_seconds += elapsed
+        self._max_lookup_seconds = max(self._max_lookup_seconds, elapsed)
+        return entry, best
+
+    def add(self, query_text, query_vec, docs):
+        with self._lock:
+            self._add(query_text, query_vec, docs)
+            self._unsaved += 1
+            should_save = self.path and self.save_every and self._unsaved >= self.save_every
+        if should_save:
+            self._saver.request()
+
+    def _add(self, query_text, query_vec, docs):
+        q = np.asarray(query_vec, dtype=np.float32)
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_entries, len(q)), dtype=np.float32)
+        now = time.time()
+        self._expire(now)
+        free = np.flatnonzero(~self.valid)
+        if len(free):
+            slot = int(free[0])
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.evictions += 1
+        self.matrix[slot] = q / max(float(np.linalg.norm(q)), 1e-12)
+        self.valid[slot] = True
+        self.created[slot] = self.last_used[slot] = now
+        self.entries[slot] = {"query_text": query_text, "query_vec": query_vec, "docs": docs}
+        return slot
+
+    def clear(self):
+        with self._lock:
+            self.valid[:] = False
+            self.entries = [None] * self.max_entries
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "mean_lookup_ms": self._lookup_seconds * 1000 / lookups if lookups else 0.0,
+            "max_lookup_ms": self._max_lookup_seconds * 1000,
+        }
+
+    # --------------------------------------------------------
+    # Persist
+    # --------------------------------------------------------
+    def save(self, path=None):
+        """Ghi các entry còn hiệu lực (+ version) ra file .npz (file tạm tên duy nhất rồi rename)."""
+        path = path or self.path
+        if not path:
+            return
+        with self._save_lock:
+            with self._lock:
+                slots = np.flatnonzero(self.valid)
+                if self.matrix is None or not len(slots):
+                    return
+                # chỉ chép dữ liệu trong lock; serialize JSON và ghi file ngoài lock
+                entries = [(self.entries[s]["query_text"], self.entries[s]["docs"]) for s in slots]
+                matrix = self.matrix[slots]
+                created, last_used = self.created[slots], self.last_used[slots]
+                version = self.version
+                self._unsaved = 0
+            # serialize từng entry (cùng kết quả với json.dumps cả list): một lần json.dumps lớn giữ GIL
+            # hàng chục ms, làm các thread đang phục vụ request đứng chờ
+            entries = "[" + ", ".join(
+                json.dumps({"query_text": text, "docs": docs}, ensure_ascii=False) for text, docs in entries
+            ) + "]"
+            save_npz(
+                path,
+                matrix=matrix,
+                created=created,
+                last_used=last_used,
+                entries=np.array(entries),
+                version=np.array(json.dumps(version)),
+            )
+
+    def load(self, path=None):
+        """Nạp entry đã lưu (entry hết hạn bị bỏ); version được giữ để check_version so sánh."""
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path) as data:
+                matrix, created, last_used = data["matrix"], data["created"], data["last_used"]
+                entries = json.loads(str(data["entries"]))
+                version = json.loads(str(data["version"]))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[CACHE] Ignoring unreadable cache file {path}: {e}")
+            return 0
+        with self._lock:
+            self.clear()
+            self.version = version
+            # giữ các entry dùng gần nhất nếu file nhiều hơn max_entries
+            for i in np.argsort(last_used)[-self.max_entries:]:
+                slot = self._add(entries[i]["query_text"], matrix[i].tolist(), entries[i]["docs"])
+                self.created[slot], self.last_used[slot] = created[i], last_used[i]
+            self._expire(time.time())
+            n = len(self)
+        return n
+
+
+# ============================================================
+# Cache dùng chung cho mọi session trong process
+# ============================================================
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+def get_shared_cache():
+    """SemanticCache dùng chung giữa các session, nạp từ RETRIEVAL_CACHE_PATH ở lần dùng đầu."""
+    global _shared_cache
+    if _shared_cache is None:
+        with _shared_lock:
+            if _shared_cache is None:
+                cache = SemanticCache(max_entries=SHARED_RETRIEVAL_CACHE_SIZE)
+                if RETRIEVAL_CACHE_PATH:
+                    cache.path = RETRIEVAL_CACHE_PATH
+                    cache.save_every = 32
+                    cache.load()
+                    atexit.register(cache.save)
+                _shared_cache = cache
+    return _shared_cache
+
@@ -0,0 +1,97 @@
+# src/stop_sequences.py
+import csv
+from .config import GEN_STOP_WINDOW_TOKENS
+from .postprocessing import cutoff_index
+
+# torch / transformers chỉ import khi tạo stopping criteria (import module này phải nhẹ)
+
+
+def tail_has_cutoff(tokenizer, token_ids, window=GEN_STOP_WINDOW_TOKENS):
+    """Các token cuối (tối đa `window`) đã chứa cụm clean_text sẽ cắt chưa."""
+    return cutoff_index(tokenizer.decode(token_ids[-window:], skip_special_tokens=True)) is not None
+
+
+def cutoff_stopping_criteria(tokenizer, window=GEN_STOP_WINDOW_TOKENS):
+    """
+    StoppingCriteria dừng generate khi phần model vừa sinh chứa cụm clean_text sẽ cắt (xem
+    postprocessing.cutoff_index): các token sau đó đằng nào cũng bị bỏ. Mỗi bước chỉ decode `window`
+    token cuối (một cụm dài không quá vài chục token). Tạo mới cho mỗi lần gọi generate; `fired` cho
+    biết đã dừng sớm chưa.
+    """
+    import torch
+    from transformers import StoppingCriteria
+
+    class CutoffStoppingCriteria(StoppingCriteria):
+        def __init__(self):
+            self.prompt_length = None
+            self.fired = False
+
+        def __call__(self, input_ids, scores, **kwargs):
+            # lần gọi đầu tiên: input_ids = prompt + 1 token mới
+            if self.prompt_length is None:
+                self.prompt_length = input_ids.shape[1] - 1
+            start = max(self.prompt_length, input_ids.shape[1] - window)
+            done = [tail_has_cutoff(tokenizer, row[start:].tolist(), window) for row in input_ids]
+            self.fired = self.fired or any(done)
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    return CutoffStoppingCriteria()
+
+
+# ============================================================
+# Báo cáo số token tiết kiệm trên eval set
+# ============================================================
+def stop_position(tokenizer, token_ids, window=GEN_STOP_WINDOW_TOKENS):
+    """Số token đã sinh khi cutoff_stopping_criteria dừng (None nếu không dừng sớm)."""
+    if cutoff_index(tokenizer.decode(token_ids, skip_special_tokens=True)) is None:
+        return None
+    for n in range(1, len(token_ids) + 1):
+        if tail_has_cutoff(tokenizer, token_ids[max(0, n - window):n], window):
+            return n
+    return None
+
+
+def tokens_saved_report(csv_path, tokenizer, max_new_tokens=1024, column="response"):
+    """
+    Với các câu trả lời thô (chưa clean_text) trong file eval (cột `column`, vd data/*_eval_data.csv):
+    số token model đã sinh so với số token nếu dừng ở cụm cần cắt. Trả về dict thống kê.
+
+    `tokenizer` phải là tokenizer của model sinh câu trả lời (AutoTokenizer của base_model): mọi
+    số đếm là token của tokenizer đó, không phải số từ.
+    """
+    csv.field_size_limit(2 ** 31 - 1)
+    # utf-8-sig + newline="": header có BOM và câu trả lời nhiều dòng (xuống dòng trong ô) đọc đúng
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+        answers = [row[column] for row in csv.DictReader(f)]
+    generated = saved = stopped = 0
+    for answer in answers:
+        ids = tokenizer(answer, add_special_tokens=False)["input_ids"][:max_new_tokens]
+        n = stop_position(tokenizer, ids)
+        generated += len(ids)
+        if n is not None:
+            stopped += 1
+            saved += len(ids) - n
+    return {
+        "answers": len(answers),
+        "stopped_early": stopped,
+        "generated_tokens": generated,
+        "saved_tokens": saved,
+        "mean_saved_per_answer": saved / len(answers) if answers else 0.0,
+        "saved_ratio": saved / generated if generated else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    from transformers import AutoTokenizer
+    from .config import MODEL_OPTIONS, MODEL_KEY, HF_TOKEN
+
+    # python -m src.stop_sequences [model_key] data/qwen2-3b_eval_data.csv ...
+    args = sys.argv[1:]
+    model_key = args.pop(0) if args and args[0] in MODEL_OPTIONS else MODEL_KEY
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_OPTIONS[model_key]["base_model"], use_auth_token=HF_TOKEN)
+    for path in args:
+        r = tokens_saved_report(path, tokenizer)
+        print(f"{path}: {r['stopped_early']}/{r['answers']} answers stop early, "
+              f"{r['saved_tokens']}/{r['generated_tokens']} tokens saved ({r['saved_ratio']:.1%}), "
+              f"{r['mean_saved_per_answer']:.1f} tokens/answer")
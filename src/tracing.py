@@ -0,0 +1,237 @@
+# src/tracing.py
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from datetime import datetime, timezone
+import numpy as np
+from .config import TRACING_ENABLED, TRACE_LOG_PATH, TRACE_HISTOGRAM_SIZE
+
+# Trace của request đang chạy trong thread / context hiện tại (None = không trace)
+_current = contextvars.ContextVar("trace", default=None)
+
+
+# ============================================================
+# Metrics registry: phân phối thời gian từng stage
+# ============================================================
+class MetricsRegistry:
+    """
+    Thời gian (giây) của từng stage, giữ `maxlen` mẫu gần nhất mỗi stage để tính p50 / p95 / p99,
+    cùng tổng số lần và tổng thời gian từ lúc khởi động. Thread-safe.
+    """
+
+    def __init__(self, maxlen=TRACE_HISTOGRAM_SIZE):
+        self.maxlen = maxlen
+        self._samples = {}
+        self._counts = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.maxlen)
+            samples.append(seconds)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._totals[name] = self._totals.get(name, 0.0) + seconds
+
+    def summary(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}} (percentile trên các mẫu gần nhất)."""
+        with self._lock:
+            snapshot = {name: (np.asarray(s), self._counts[name], self._totals[name])
+                        for name, s in self._samples.items()}
+        summary = {}
+        for name, (samples, count, total) in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+            summary[name] = {
+                "count": count,
+                "mean_ms": total * 1000 / count,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(samples.max() * 1000),
+            }
+        return summary
+
+    def report(self):
+        lines = [f"  {'stage':<24} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}"]
+        for name, s in sorted(self.summary().items(), key=lambda x: -x[1]["p50_ms"]):
+            lines.append(f"  {name:<24} {s['count']:>7} {s['p50_ms']:>7.1f}ms {s['p95_ms']:>7.1f}ms "
+                         f"{s['p99_ms']:>7.1f}ms {s['max_ms']:>7.1f}ms")
+        return "\n".join(["===== Latency ====="] + lines)
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+            self._totals.clear()
+
+
+metrics = MetricsRegistry()
+
+
+# ============================================================
+# Trace
+# ============================================================
+class Trace:
+    """Một request: id, các span (tên, offset, thời gian) và thuộc tính (số token, cache hit...)."""
+
+    def __init__(self, name, attrs=None):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attrs = dict(attrs or {})
+        self.spans = []
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, start=None):
+        """Thêm span đã đo sẵn (vd thời gian backend chạy trên thread khác)."""
+        offset = (start if start is not None else time.perf_counter() - seconds) - self._start
+        with self._lock:
+            self.spans.append((name, offset, seconds))
+        metrics.observe(name, seconds)
+
+    def annotate(self, **attrs):
+        self.attrs.update(attrs)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def finish(self, error=None):
+        """Kết thúc trace: thời gian tổng vào metrics, ghi một dòng vào TRACE_LOG_PATH."""
+        duration = self.elapsed()
+        if error is not None:
+            self.attrs["error"] = error
+        metrics.observe(self.name, duration)
+        try:
+            _write_trace(self.to_dict(duration))
+        except OSError as e:
+            print(f"[TRACE] Cannot write trace log {TRACE_LOG_PATH}: {e}")
+
+    def to_dict(self, duration):
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(duration * 1000, 3),
+            "spans": [{"name": n, "start_ms": round(o * 1000, 3), "duration_ms": round(d * 1000, 3)}
+                      for n, o, d in self.spans],
+            "attrs": self.attrs,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.record(self.name, time.perf_counter() - self.start, self.start)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+_log_lock = threading.Lock()
+
+
+def _write_trace(record):
+    if not TRACE_LOG_PATH:
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _log_lock:
+        os.makedirs(os.path.dirname(os.path.abspath(TRACE_LOG_PATH)), exist_ok=True)
+        with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def new_trace(name, **attrs):
+    """Trace mới (None khi TRACING_ENABLED = False); caller tự activate() và finish()."""
+    return Trace(name, attrs) if TRACING_ENABLED else None
+
+
+class activate:
+    """with activate(trace): span / record / annotate trong block ghi vào trace (None = không trace)."""
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._token = None
+
+    def __enter__(self):
+        if self.trace is not None:
+            self._token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            _current.reset(self._token)
+        return False
+
+
+class start_trace:
+    """
+    with start_trace("chat_fn", session_id=...) as trace: bắt đầu trace cho request (trace là None khi
+    TRACING_ENABLED = False). Khi kết thúc: thời gian tổng vào metrics, trace ghi một dòng vào TRACE_LOG_PATH.
+    Generator (vd chat_fn_stream) không giữ trace qua yield: dùng new_trace + activate + finish.
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+        self._active = None
+
+    def __enter__(self):
+        self.trace = new_trace(self.name, **self.attrs)
+        self._active = activate(self.trace)
+        return self._active.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._active.__exit__()
+        if self.trace is not None:
+            self.trace.finish(None if exc_type is None else f"{exc_type.__name__}: {exc}")
+        return False
+
+
+def current_trace():
+    return _current.get()
+
+
+def span(name):
+    """with span("bm25"): ... đo một stage của trace hiện tại (không có trace thì không làm gì)."""
+    trace = _current.get()
+    return _NOOP if trace is None else _Span(trace, name)
+
+
+def record(name, seconds, start=None):
+    """Thêm span đã đo sẵn (start: time.perf_counter() lúc bắt đầu, mặc định = kết thúc ngay lúc gọi)."""
+    trace = _current.get()
+    if trace is not None:
+        trace.record(name, seconds, start)
+
+
+def annotate(**attrs):
+    """Gắn thuộc tính (số token, cache hit...) vào trace hiện tại."""
+    trace = _current.get()
+    if trace is not None:
+        trace.annotate(**attrs)
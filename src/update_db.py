@@ -1,10 +1,8 @@
 import json
 import os
-from dotenv import load_dotenv
-import torch
-from sentence_transformers import SentenceTransformer
-from pinecone import Pinecone
-from config import BASE_DIR, EMBED_MODEL_NAME, PINECONE_API_KEY, PINECONE_INDEX_NAME
+from .config import BASE_DIR, EMBED_BATCH_SIZE
+from .pinecone_manager import get_pinecone_index
+from .model_registry import get_embedding_model
 from tqdm import tqdm  # tiến trình
 
 # -----------------------
@@ -13,21 +11,10 @@ from tqdm import tqdm  # tiến trình
 DATA_DIR = os.path.join(BASE_DIR, "data")
 
 # -----------------------
-# Pinecone init
+# Embedding model (dùng chung qua model registry)
 # -----------------------
-load_dotenv()  # load env cho Pinecone
-pc = Pinecone(api_key=PINECONE_API_KEY)
-index_pinecone = pc.Index(PINECONE_INDEX_NAME)
-
-# -----------------------
-# Embedding model
-# -----------------------
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"✔ Sử dụng device: {device}")
-embedding_model = SentenceTransformer(EMBED_MODEL_NAME, device=device)
-
 def embed_text(text: str):
-    return embedding_model.encode(text).tolist()
+    return get_embedding_model().encode(text).tolist()
 
 # -----------------------
 # Upload lên Pinecone
@@ -49,33 +36,31 @@ def update_pinecone(jsonl_filename: str):
 
     print(f"✔ Đang upload {len(lines)} vectors từ {jsonl_filename} lên Pinecone...")
 
-    for i, line in enumerate(tqdm(lines, desc="Embedding & chuẩn bị dữ liệu")):
+    objs = []
+    for i, line in enumerate(lines):
         obj = json.loads(line)
-
-        vector_id = obj.get("id")
-        if not vector_id:
+        if not obj.get("id"):
             print(f"⚠ Bỏ qua dòng {i} vì thiếu 'id'")
             continue
-
-        clause_text = obj.get("clause_text", "")
-
-        # Embedding
-        emb = embed_text(clause_text)
-
-        # Metadata: giữ toàn bộ trừ clause_id
-        metadata = {k: v for k, v in obj.items() if k != "clause_id"}
-
-        vectors.append({
-            "id": vector_id,
-            "values": emb,
-            "metadata": metadata
-        })
-
-        if (i + 1) % 50 == 0:
-            print(f"  -> Đã xử lý {i + 1}/{len(lines)} vectors")
+        objs.append(obj)
+
+    # Embedding theo batch (embedder tự sắp text theo độ dài trong mỗi lần encode)
+    model = get_embedding_model()
+    for start in tqdm(range(0, len(objs), EMBED_BATCH_SIZE), desc="Embedding & chuẩn bị dữ liệu"):
+        batch = objs[start:start + EMBED_BATCH_SIZE]
+        embs = model.encode([obj.get("clause_text", "") for obj in batch], batch_size=EMBED_BATCH_SIZE)
+
+        for obj, emb in zip(batch, embs):
+            # Metadata: giữ toàn bộ trừ clause_id
+            metadata = {k: v for k, v in obj.items() if k != "clause_id"}
+            vectors.append({
+                "id": obj["id"],
+                "values": emb.tolist(),
+                "metadata": metadata
+            })
 
     if vectors:
-        index_pinecone.upsert(vectors=vectors)
+        get_pinecone_index().upsert(vectors=vectors)
         print(f"✔ Hoàn tất upload {len(vectors)} vectors từ {jsonl_filename} lên Pinecone")
     else:
         print("⚠ Không có vectors nào để upload!")
@@ -83,9 +68,10 @@ def update_pinecone(jsonl_filename: str):
 # -----------------------
 # Update keywords_db
 # -----------------------
-def update_keywords_db(source_filename: str, target_filename: str):
+def update_keywords_db(source_filename: str, target_filename: str, retriever=None):
     """
-    Append dữ liệu từ source JSONL vào target JSONL trong DATA_DIR
+    Append dữ liệu từ source JSONL vào target JSONL trong DATA_DIR.
+    Nếu truyền `retriever` (BM25Retriever đang chạy) thì upsert luôn vào index BM25, không cần build lại.
     """
     source_path = os.path.join(DATA_DIR, source_filename)
     target_path = os.path.join(DATA_DIR, target_filename)
@@ -95,6 +81,7 @@ def update_keywords_db(source_filename: str, target_filename: str):
         return
 
     mode = "a" 
+    objs = []
 
     with open(source_path, "r", encoding="utf-8") as infile, \
          open(target_path, mode, encoding="utf-8") as outfile:
@@ -105,12 +92,17 @@ def update_keywords_db(source_filename: str, target_filename: str):
         for i, line in enumerate(tqdm(lines, desc="Append keywords")):
             obj = json.loads(line)
             outfile.write(json.dumps(obj, ensure_ascii=False) + "\n")
+            objs.append(obj)
 
             if (i + 1) % 50 == 0:
                 print(f"  -> Đã ghi {i + 1}/{len(lines)} dòng")
 
     print(f"✔ Hoàn tất cập nhật {source_filename} vào {target_filename}")
 
+    if retriever is not None and objs:
+        retriever.upsert_documents(objs)
+        print(f"✔ Đã cập nhật {len(objs)} documents vào BM25 index")
+
 # -----------------------
 # Main
 # -----------------------
@@ -0,0 +1,359 @@
+# src/vector_store.py
+import os
+import json
+import time
+import shutil
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from .config import (
+    BASE_DIR, EMBED_MODEL_NAME, EMBED_BATCH_SIZE, PINECONE_TOP_K,
+    VECTOR_BACKEND, LOCAL_VECTOR_INDEX_DIR, LOCAL_VECTOR_NPROBE
+)
+from .bm25_metadata import MetadataStore
+from .embedding_artifact import EmbeddingArtifact, EmbeddingArtifactWriter
+
+# 2: metadata dạng cột (MetadataStore, memory-map); index bản 1 (items.jsonl) vẫn load được
+VECTOR_INDEX_FORMAT_VERSION = 2
+
+# Corpus nhỏ hơn ngưỡng này thì không chia cụm, search exact trên toàn bộ vector
+IVF_MIN_VECTORS = 10000
+
+_ARRAY_FILES = ("vectors", "row_doc", "list_ptr", "centroids")
+
+
+def format_match(item, score):
+    """Kết quả chuẩn hóa giống search_pinecone."""
+    return {
+        "id": item["id"],
+        "score": float(score),
+        "law_title": item.get("law_title", ""),
+        "article_title": item.get("article_title", ""),
+        "clause_no": item.get("clause_no", ""),
+        "article_link": item.get("article_link", ""),
+        "text": item.get("clause_text", ""),
+    }
+
+
+def _item_from_record(record):
+    """Record của artifact -> item schema keywords_db (artifact cũ dùng key metadata Pinecone text/link)."""
+    item = dict(record)
+    if "clause_text" not in item and "text" in item:
+        item["clause_text"] = item.pop("text")
+    if "article_link" not in item and "link" in item:
+        item["article_link"] = item.pop("link")
+    return item
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ============================================================
+# Backend interface
+# ============================================================
+class VectorBackend:
+    """search(vector, top_k) -> list dict {id, score, law_title, article_title, clause_no, article_link, text}"""
+
+    name = None
+
+    def search(self, vector, top_k=PINECONE_TOP_K):
+        raise NotImplementedError
+
+
+class PineconeBackend(VectorBackend):
+    name = "pinecone"
+
+    def search(self, vector, top_k=PINECONE_TOP_K):
+        # import ở đây: chỉ kết nối Pinecone khi thật sự dùng backend này
+        from .pinecone_manager import search_pinecone
+        return search_pinecone(vector, top_k)
+
+
+# ============================================================
+# Local IVF index
+# ============================================================
+class LocalVectorIndex(VectorBackend):
+    """
+    Index vector cosine trong process, lưu ra đĩa và memory-map lại khi load.
+
+    - vectors:   vector đã chuẩn hóa (float32), sắp theo cụm để mỗi cụm là một lát cắt liên tục
+    - row_doc:   row -> doc id (thứ tự dòng trong file metadata)
+    - list_ptr:  vector của cụm c nằm trong [list_ptr[c], list_ptr[c+1])
+    - centroids: tâm cụm (IVF, k-means spherical); rỗng = search exact trên toàn bộ vector
+
+    Search chỉ tính tích vô hướng với `nprobe` cụm gần query nhất. Điểm là cosine như Pinecone.
+    """
+
+    name = "local"
+
+    def __init__(self, vectors, row_doc, list_ptr, centroids, items, meta=None):
+        self.vectors = vectors
+        self.row_doc = row_doc
+        self.list_ptr = list_ptr
+        self.centroids = centroids
+        self.metadata = items if isinstance(items, MetadataStore) else MetadataStore.from_items(items)
+        self.meta = dict(meta or {})
+
+    @property
+    def n_vectors(self):
+        return int(len(self.vectors))
+
+    # --------------------------------------------------------
+    # Build
+    # --------------------------------------------------------
+    @classmethod
+    def build(cls, vectors, items, n_lists=None, n_iter=10, seed=0, meta=None):
+        """vectors[i] là embedding của items[i] (dict cùng schema với file upload Pinecone)."""
+        vectors = _normalize(vectors)
+        if len(vectors) != len(items):
+            raise ValueError(f"{len(vectors)} vectors for {len(items)} items")
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(len(vectors))) if len(vectors) >= IVF_MIN_VECTORS else 0
+
+        if n_lists <= 1:
+            row_doc = np.arange(len(vectors), dtype=np.int32)
+            list_ptr = np.array([0, len(vectors)], dtype=np.int64)
+            centroids = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        else:
+            centroids = cls._kmeans(vectors, n_lists, n_iter, seed)
+            assign = cls._assign(vectors, centroids)
+            row_doc = np.argsort(assign, kind="stable").astype(np.int32)
+            list_ptr = np.zeros(n_lists + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assign, minlength=n_lists), out=list_ptr[1:])
+
+        return cls(vectors[row_doc], row_doc, list_ptr, centroids, items, meta=meta)
+
+    @classmethod
+    def from_artifact(cls, artifact, **kwargs):
+        """Build từ EmbeddingArtifact (hoặc đường dẫn), không cần embed lại."""
+        if not isinstance(artifact, EmbeddingArtifact):
+            artifact = EmbeddingArtifact(artifact)
+        items = [_item_from_record(r) for r in artifact.records()]
+        meta = {"source_artifact": os.path.abspath(artifact.path), "model": artifact.meta.get("model", "")}
+        meta.update(kwargs.pop("meta", {}) or {})
+        return cls.build(artifact.as_float32(), items, meta=meta, **kwargs)
+
+    @staticmethod
+    def _assign(vectors, centroids, batch_size=8192):
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), batch_size):
+            assign[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+        return assign
+
+    @classmethod
+    def _kmeans(cls, vectors, n_lists, n_iter, seed, sample_per_list=256):
+        rng = np.random.default_rng(seed)
+        sample = vectors
+        if len(vectors) > n_lists * sample_per_list:
+            sample = vectors[rng.choice(len(vectors), n_lists * sample_per_list, replace=False)]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            empty = np.bincount(assign, minlength=n_lists) == 0
+            # cụm rỗng: lấy lại một vector ngẫu nhiên làm tâm
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            centroids = _normalize(sums)
+        return centroids
+
+    # --------------------------------------------------------
+    # Persist
+    # --------------------------------------------------------
+    def save(self, index_dir):
+        """Ghi index ra thư mục tạm rồi rename, để worker khác không đọc phải index ghi dở."""
+        index_dir = os.path.abspath(index_dir)
+        tmp_dir = f"{index_dir}.tmp-{os.getpid()}"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        for name in _ARRAY_FILES:
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        self.metadata.save(os.path.join(tmp_dir, "metadata"))
+
+        meta = dict(self.meta)
+        meta.update({
+            "format_version": VECTOR_INDEX_FORMAT_VERSION,
+            "n_vectors": self.n_vectors,
+            "dim": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "n_lists": int(len(self.centroids)),
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        })
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        self.meta = meta
+
+        old_dir = f"{index_dir}.old-{os.getpid()}"
+        if os.path.exists(index_dir):
+            os.rename(index_dir, old_dir)
+        os.rename(tmp_dir, index_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        meta_path = os.path.join(index_dir, "meta.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"Local vector index not found: {index_dir}")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") not in (1, VECTOR_INDEX_FORMAT_VERSION):
+            raise ValueError(f"Unsupported vector index format {meta.get('format_version')} in {index_dir}")
+        mode = "r" if mmap else None
+        # view ndarray trên vùng mmap: tránh overhead của np.memmap khi slice trên đường search
+        arrays = {
+            name: np.load(os.path.join(index_dir, f"{name}.npy"), mmap_mode=mode).view(np.ndarray)
+            for name in _ARRAY_FILES
+        }
+        if meta["format_version"] == 1:
+            with open(os.path.join(index_dir, "items.jsonl"), "r", encoding="utf-8") as f:
+                store = MetadataStore.from_items(json.loads(line) for line in f if line.strip())
+        else:
+            # metadata dạng cột, memory-map như index BM25: không parse lại JSON khi khởi động
+            store = MetadataStore.load(os.path.join(index_dir, "metadata"), mmap=mmap)
+        return cls(items=store, meta=meta, **arrays)
+
+    # --------------------------------------------------------
+    # Search
+    # --------------------------------------------------------
+    def search(self, vector, top_k=PINECONE_TOP_K, nprobe=LOCAL_VECTOR_NPROBE):
+        if top_k <= 0 or not self.n_vectors:
+            return []
+        query = _normalize(vector)
+
+        n_lists = len(self.centroids)
+        if n_lists == 0 or nprobe >= n_lists:
+            rows = None
+            scores = self.vectors @ query
+        else:
+            probe = np.argpartition(-(self.centroids @ query), nprobe)[:nprobe]
+            parts, row_parts = [], []
+            for c in probe:
+                start, end = self.list_ptr[c], self.list_ptr[c + 1]
+                if end > start:
+                    parts.append(self.vectors[start:end] @ query)
+                    row_parts.append(np.arange(start, end))
+            if not parts:
+                return []
+            scores = np.concatenate(parts)
+            rows = np.concatenate(row_parts)
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        results = []
+        for i in top:
+            row = i if rows is None else rows[i]
+            item = self.metadata.get(int(self.row_doc[row]))
+            if item is not None:
+                results.append(format_match(item, scores[i]))
+        return results
+
+
+# ============================================================
+# Backend đang dùng (VECTOR_BACKEND trong config)
+# ============================================================
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_vector_backend(name=None):
+    """
+    Backend theo VECTOR_BACKEND ("pinecone" | "local" | "pq"), khởi tạo một lần khi dùng lần đầu.
+    Lần đầu thường gọi đồng thời từ các thread của retrieval pool: lock để chỉ load index một lần.
+    """
+    name = name or VECTOR_BACKEND
+    backend = _backend
+    if backend is not None and backend.name == name:
+        return backend
+    with _backend_lock:
+        if _backend is not None and _backend.name == name:
+            return _backend
+        return _load_backend(name)
+
+
+def _load_backend(name):
+    global _backend
+    if name == "pinecone":
+        backend = PineconeBackend()
+    elif name == "local":
+        start = time.time()
+        backend = LocalVectorIndex.load(LOCAL_VECTOR_INDEX_DIR)
+        print(f"[VECTOR] Mapped local index ({backend.n_vectors} vectors, "
+              f"{len(backend.centroids)} lists) from {LOCAL_VECTOR_INDEX_DIR} ({time.time() - start:.3f}s)")
+    elif name == "pq":
+        from .config import PQ_INDEX_DIR
+        from .pq_index import PQVectorIndex
+        start = time.time()
+        backend = PQVectorIndex.load(PQ_INDEX_DIR)
+        print(f"[VECTOR] Loaded PQ index ({backend.n_vectors} vectors, {backend.n_subspaces} subspaces, "
+              f"{backend.nbytes_in_memory() / 1e6:.1f}MB in RAM) from {PQ_INDEX_DIR} ({time.time() - start:.3f}s)")
+    else:
+        raise ValueError(f"Unknown VECTOR_BACKEND: {name!r} (expected 'pinecone', 'local' or 'pq')")
+    _backend = backend
+    return backend
+
+
+def search_vectors(vector, top_k=PINECONE_TOP_K):
+    """Vector search qua backend đang cấu hình; kết quả cùng format với search_pinecone."""
+    return get_vector_backend().search(vector, top_k)
+
+
+# ============================================================
+# Build local index từ file JSONL (cùng format file upload Pinecone)
+# ============================================================
+def build_local_index(jsonl_path, index_dir=LOCAL_VECTOR_INDEX_DIR, encode=None, batch_size=EMBED_BATCH_SIZE,
+                      artifact_path=None):
+    """
+    Embed clause_text của từng dòng trong jsonl_path bằng `encode(list_text) -> array`
+    (mặc định embedding model dùng chung trong model registry) rồi build + lưu LocalVectorIndex.
+    Nếu có `artifact_path`, vector cũng được ghi ra embedding artifact để lần build sau
+    (LocalVectorIndex.from_artifact) hoặc script khác dùng lại mà không phải embed.
+    """
+    from tqdm import tqdm
+
+    if not os.path.isabs(jsonl_path):
+        jsonl_path = os.path.join(BASE_DIR, jsonl_path)
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+
+    if encode is None:
+        from .model_registry import get_embedding_model
+        encode = get_embedding_model().encode
+
+    writer = None
+    if artifact_path:
+        writer = EmbeddingArtifactWriter(artifact_path, len(items), meta={"source_path": jsonl_path,
+                                                                          "model": EMBED_MODEL_NAME})
+    vectors = []
+    for start in tqdm(range(0, len(items), batch_size), desc="Embedding"):
+        batch = items[start:start + batch_size]
+        vectors.append(np.asarray(encode([item.get("clause_text", "") for item in batch]), dtype=np.float32))
+        if writer is not None:
+            writer.write(vectors[-1], [item.get("id", "") for item in batch], batch)
+    vectors = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    if writer is not None:
+        writer.close()
+
+    index = LocalVectorIndex.build(vectors, items, meta={"source_path": jsonl_path, "model": EMBED_MODEL_NAME})
+    index.save(index_dir)
+    print(f"✔ Saved local vector index ({index.n_vectors} vectors, {len(index.centroids)} lists) to {index_dir}")
+    return index
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m src.vector_store data/updated_pc.jsonl [index_dir]   (embed lại từ JSONL)
+    # python -m src.vector_store embedded_laws.emb [index_dir]         (dùng vector có sẵn trong artifact)
+    source = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, "data", "updated_pc.jsonl")
+    index_dir = sys.argv[2] if len(sys.argv) > 2 else LOCAL_VECTOR_INDEX_DIR
+    if os.path.isdir(source):
+        index = LocalVectorIndex.from_artifact(source)
+        index.save(index_dir)
+        print(f"✔ Saved local vector index ({index.n_vectors} vectors, {len(index.centroids)} lists) to {index_dir}")
+    else:
+        build_local_index(source, index_dir)
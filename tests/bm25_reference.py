@@ -0,0 +1,89 @@
+# tests/bm25_reference.py
+import os
+import re
+import csv
+import json
+import string
+from unidecode import unidecode
+
+from src.config import BASE_DIR, LAW_SHORT_NAMES
+from src.bm25_manager import load_stopwords
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+
+
+# ============================================================
+# Reference implementation (custom_tokenizer trước khi tối ưu)
+# ============================================================
+def reference_tokenize(text, stopwords, law_short_names):
+    text = re.sub(r'<.*?>', '', text).strip()
+    text = re.sub(r'\s+', ' ', text)
+    for p in string.punctuation.replace('_', ''):
+        text = text.replace(p, ' ')
+    text = text.lower()
+
+    law_token = ""
+    for name in law_short_names:
+        if name in text:
+            law_token = "_".join(unidecode(name).split())
+            text = text.replace(name, "")
+            break
+
+    text = re.sub(r"điều\s*(\d+)", r"dieu_\1", text, flags=re.IGNORECASE)
+    text = re.sub(r"khoản\s*(\d+)", r"khoan_\1", text, flags=re.IGNORECASE)
+
+    if law_token:
+        text = law_token + " " + text.strip()
+
+    words = text.split()
+    return [w for w in words if w not in stopwords]
+
+
+# ============================================================
+# Golden file: token của reference_tokenize cho từng text
+# ============================================================
+def keyword_texts():
+    """clause_text của data/updated_kw.jsonl."""
+    with open(os.path.join(BASE_DIR, "data", "updated_kw.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line)["clause_text"] for line in f if line.strip()]
+
+
+def eval_questions():
+    """Cột question của data/eval_data.csv."""
+    with open(os.path.join(BASE_DIR, "data", "eval_data.csv"), "r", encoding="utf-8-sig", newline="") as f:
+        return [row["question"] for row in csv.DictReader(f)]
+
+
+GOLDEN_SOURCES = {
+    "updated_kw": keyword_texts,
+    "eval_questions": eval_questions,
+}
+
+
+def golden_path(name):
+    return os.path.join(GOLDEN_DIR, f"{name}.tokens.jsonl")
+
+
+def write_golden(texts, path, stopwords, law_short_names):
+    with open(path, "w", encoding="utf-8") as f:
+        for text in texts:
+            tokens = reference_tokenize(text, stopwords, law_short_names)
+            f.write(json.dumps({"text": text, "tokens": tokens}, ensure_ascii=False) + "\n")
+
+
+def read_golden(path):
+    """List (text, tokens) của golden file."""
+    with open(path, "r", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["text"], row["tokens"]) for row in rows]
+
+
+if __name__ == "__main__":
+    # python -m tests.bm25_reference: ghi lại golden file (chỉ khi cố ý đổi luật tokenize / dữ liệu)
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    stopwords = load_stopwords()
+    assert stopwords, "Stopword list is empty; check STOPWORDS_FILE"
+    for name, source in GOLDEN_SOURCES.items():
+        texts = source()
+        write_golden(texts, golden_path(name), stopwords, LAW_SHORT_NAMES)
+        print(f"Wrote {len(texts)} golden rows to {golden_path(name)}")
@@ -0,0 +1,56 @@
+# tests/test_bm25_index.py
+import os
+import shutil
+
+import pytest
+
+from src.config import BASE_DIR
+from src.bm25_index import BM25Index
+from src.bm25_manager import BM25Retriever
+
+CORPUS = os.path.join(BASE_DIR, "data", "updated_kw.jsonl")
+QUERIES = ["thời gian thử việc", "điều 5 luật lao động", "xử phạt vi phạm hành chính", "hợp đồng"]
+
+
+def _results(retriever):
+    return [[(doc["id"], round(doc["score"], 9)) for doc in retriever.search(q)] for q in QUERIES]
+
+
+@pytest.fixture
+def other_worker_wins(monkeypatch):
+    """
+    Giả lập hai worker build cùng lúc: ngay trước rename cuối của save(), worker kia đã đặt
+    index của nó (copy từ `source`) vào index_dir.
+    """
+    def install(source, index_dir):
+        real_rename = os.rename
+
+        def rename(src, dst):
+            if os.path.abspath(dst) == os.path.abspath(index_dir) and not os.path.exists(dst):
+                shutil.copytree(source, dst)
+            return real_rename(src, dst)
+
+        monkeypatch.setattr(os, "rename", rename)
+
+    return install
+
+
+def test_save_loses_rename_race(tmp_path, other_worker_wins):
+    index = BM25Index.build([["a", "b"], ["b", "c"]])
+    index.save(tmp_path / "winner")
+    other_worker_wins(tmp_path / "winner", tmp_path / "index")
+
+    assert BM25Index.build([["x"], ["y"]]).save(tmp_path / "index") is False
+    assert BM25Index.load(tmp_path / "index").vocab == index.vocab
+    assert sorted(os.listdir(tmp_path)) == ["index", "winner"]       # không còn thư mục tạm
+
+
+def test_retriever_maps_index_of_winning_worker(tmp_path, other_worker_wins, capsys):
+    winner = BM25Retriever(CORPUS, index_dir=tmp_path / "winner", persist=True)
+    other_worker_wins(tmp_path / "winner", tmp_path / "index")
+    capsys.readouterr()
+
+    retriever = BM25Retriever(CORPUS, index_dir=tmp_path / "index", persist=True)
+    assert "[BM25] Mapped index" in capsys.readouterr().out
+    assert _results(retriever) == _results(winner)
+    assert sorted(os.listdir(tmp_path)) == ["index", "winner"]
@@ -0,0 +1,79 @@
+# tests/test_bm25_tokenizer.py
+import pytest
+
+import src.bm25_tokenizer as bm25_tokenizer
+from src.config import LAW_SHORT_NAMES
+from src.bm25_manager import load_stopwords
+from src.bm25_tokenizer import VietnameseTokenizer, parse_citations
+
+from .bm25_reference import GOLDEN_SOURCES, golden_path, read_golden, reference_tokenize
+
+
+@pytest.fixture(scope="module")
+def stopwords():
+    return load_stopwords()
+
+
+@pytest.fixture(scope="module", params=sorted(GOLDEN_SOURCES))
+def golden(request):
+    return read_golden(golden_path(request.param))
+
+
+def _mismatches(rows, tokenize):
+    return [text for text, tokens in rows if tokenize(text) != tokens]
+
+
+# ============================================================
+# Golden file
+# ============================================================
+def test_stopwords_loaded(stopwords):
+    """Golden file chỉ kiểm tra được lọc stopword khi đọc được danh sách stopword."""
+    assert len(stopwords) > 1000
+    assert {"này", "về", "được"} <= stopwords
+
+
+def test_golden_is_current(golden, stopwords):
+    """Golden file khớp reference_tokenize với stopwords / LAW_SHORT_NAMES hiện tại."""
+    assert _mismatches(golden, lambda t: reference_tokenize(t, stopwords, LAW_SHORT_NAMES)) == []
+
+
+def test_tokenize_matches_golden(golden, stopwords):
+    tokenizer = VietnameseTokenizer(stopwords, LAW_SHORT_NAMES)
+    assert _mismatches(golden, tokenizer.tokenize) == []
+    assert _mismatches(golden, tokenizer.tokenize_query) == []
+
+
+def test_tokenize_many_matches_golden(golden, stopwords):
+    tokenizer = VietnameseTokenizer(stopwords, LAW_SHORT_NAMES)
+    texts = [text for text, _ in golden]
+    assert tokenizer.tokenize_many(texts) == [tokens for _, tokens in golden]
+
+
+def test_without_ahocorasick_matches_golden(golden, stopwords, monkeypatch):
+    monkeypatch.setattr(bm25_tokenizer, "ahocorasick", None)
+    tokenizer = VietnameseTokenizer(stopwords, LAW_SHORT_NAMES)
+    assert tokenizer._automaton is None
+    assert _mismatches(golden, tokenizer.tokenize) == []
+
+
+# ============================================================
+# Citation
+# ============================================================
+def test_parse_citations():
+    assert parse_citations(["luat_lao_dong", "dieu_6", "khoan_2", "khoan_3"]) == [(6, 2), (6, 3)]
+    assert parse_citations(["khoan_2", "dieu_6", "luat_lao_dong"]) == [(6, 2)]
+    assert parse_citations(["dieu_6", "dieu_7"]) == [(6, None), (7, None)]
+    assert parse_citations(["luat_lao_dong"]) == []
+
+
+def test_citations_by_law(stopwords):
+    tokenizer = VietnameseTokenizer(stopwords, LAW_SHORT_NAMES)
+    assert tokenizer.citations_by_law("Điều 6 khoản 2 luật lao động") is None
+    assert tokenizer.citations_by_law("So sánh Điều 5 luật lao động với khoản 2 điều 7 luật đầu tư") == [
+        ("luat_lao_dong", [(5, None)]),
+        ("luat_dau_tu", [(7, 2)]),
+    ]
+    assert tokenizer.citations_by_law("luật lao động điều 5 và luật đầu tư điều 7") == [
+        ("luat_lao_dong", [(5, None)]),
+        ("luat_dau_tu", [(7, None)]),
+    ]
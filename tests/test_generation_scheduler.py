@@ -0,0 +1,129 @@
+# tests/test_generation_scheduler.py
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from src.generation_scheduler import GenerationScheduler
+
+VOCAB = 96
+CUTOFF_TEXT = " Câu hỏi: "
+
+
+class CharTokenizer:
+    """Tokenizer giả: mỗi ký tự là một token, token i decode thành "t<i> " (hoặc chuỗi gán trong `texts`)."""
+
+    pad_token_id = None
+    eos_token_id = None
+
+    def __init__(self):
+        self.texts = {}
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [ord(c) % VOCAB for c in text]}
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return "".join(self.texts.get(t, f"t{t} ") for t in token_ids)
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.Qwen2Config(vocab_size=VOCAB, hidden_size=64, intermediate_size=128,
+                                      num_hidden_layers=2, num_attention_heads=4, num_key_value_heads=2,
+                                      max_position_embeddings=256, initializer_range=0.5)
+    model = transformers.Qwen2ForCausalLM(config).to(torch.float64).eval()
+    model.generation_config.eos_token_id = None
+    model.generation_config.pad_token_id = 0
+    return model
+
+
+PROMPTS = ["Điều 5", "Người lao động được nghỉ phép năm bao nhiêu ngày?", "Khoản 2 điều 7 luật đầu tư",
+           "Hợp đồng lao động", "Mức phạt khi vi phạm quy định về vệ sinh an toàn thực phẩm là bao nhiêu"]
+MAX_NEW = [12, 20, 7, 16, 10]
+
+
+def reference(model, tokenizer, prompt, max_new_tokens):
+    """Token greedy của model.generate cho riêng prompt (không batch, không pad, không dừng sớm)."""
+    input_ids = torch.tensor([tokenizer(prompt)["input_ids"]])
+    with torch.no_grad():
+        out = model.generate(input_ids, attention_mask=torch.ones_like(input_ids), max_new_tokens=max_new_tokens,
+                             min_new_tokens=max_new_tokens, do_sample=False)
+    return out[0, input_ids.shape[1]:].tolist()
+
+
+def expected(tokens, eos=None, cutoff=None):
+    """Token và finish_reason scheduler phải trả về khi sinh `tokens` với eos / token decode thành cụm cắt."""
+    kept = []
+    for token in tokens:
+        if token == eos:
+            return kept, "eos"
+        kept.append(token)
+        if token == cutoff:
+            return kept, "stop_sequence"
+    return kept, "length"
+
+
+def run(scheduler, batches, steps_between=3):
+    """Submit từng nhóm prompt (nhóm sau nhập vào batch đang chạy), chạy worker tới khi mọi request xong."""
+    scheduler._ensure_worker = lambda: None      # test tự chạy từng vòng worker
+    requests = []
+    for batch in batches:
+        requests += [scheduler.submit(prompt, max_new) for prompt, max_new in batch]
+        for _ in range(steps_between):
+            scheduler._tick(block=False)
+    while not all(request.future.done() for request in requests):
+        scheduler._tick(block=False)
+    assert scheduler._running == [] and scheduler._cache is None
+    return requests
+
+
+def test_batched_matches_sequential_generate(model):
+    tokenizer = CharTokenizer()
+    refs = [reference(model, tokenizer, p, n) for p, n in zip(PROMPTS, MAX_NEW)]
+    # nhỏ để prefill tách thành nhiều nhóm; hai nhóm sau nhập vào batch đang decode
+    scheduler = GenerationScheduler(model, tokenizer, max_batch_size=4, max_prefill_tokens=64)
+    pairs = list(zip(PROMPTS, MAX_NEW))
+    requests = run(scheduler, [pairs[:2], pairs[2:4], pairs[4:]])
+    for request, ref in zip(requests, refs):
+        assert request.finish_reason == "length"
+        assert request.token_ids == ref
+        assert request.text == tokenizer.decode(ref)
+    stats = scheduler.stats()
+    assert stats["prefills"] >= 3 and stats["prefill_rows"] == len(PROMPTS)
+    assert stats["max_running"] == 4
+
+
+def test_retire_on_eos_and_cutoff(model):
+    tokenizer = CharTokenizer()
+    refs = [reference(model, tokenizer, p, n) for p, n in zip(PROMPTS, MAX_NEW)]
+    # eos / token cắt: token thứ 3 và thứ 5 của hai prompt, nên có sequence rời batch giữa chừng
+    eos, cutoff = refs[1][2], refs[3][4]
+    assert eos != cutoff
+    tokenizer.texts[cutoff] = CUTOFF_TEXT
+    model.generation_config.eos_token_id = eos
+    try:
+        scheduler = GenerationScheduler(model, tokenizer, max_batch_size=3)
+        requests = run(scheduler, [list(zip(PROMPTS, MAX_NEW))], steps_between=1)
+    finally:
+        model.generation_config.eos_token_id = None
+    reasons = set()
+    for request, ref in zip(requests, refs):
+        tokens, reason = expected(ref, eos=eos, cutoff=cutoff)
+        assert (request.token_ids, request.finish_reason) == (tokens, reason)
+        reasons.add(reason)
+    assert {"eos", "stop_sequence"} <= reasons
+
+
+def test_cancel_leaves_batch(model):
+    tokenizer = CharTokenizer()
+    refs = [reference(model, tokenizer, p, n) for p, n in zip(PROMPTS[:2], MAX_NEW[:2])]
+    scheduler = GenerationScheduler(model, tokenizer)
+    scheduler._ensure_worker = lambda: None
+    first, second = (scheduler.submit(p, n) for p, n in zip(PROMPTS[:2], MAX_NEW[:2]))
+    scheduler._tick(block=False)
+    first.cancel()
+    while not second.future.done():
+        scheduler._tick(block=False)
+    assert first.finish_reason == "cancelled"
+    assert second.token_ids == refs[1]
@@ -0,0 +1,31 @@
+# tests/test_pinecone_manager.py
+import sys
+import time
+import types
+import threading
+
+import src.pinecone_manager as pinecone_manager
+
+
+def test_index_created_once_under_concurrent_first_use(monkeypatch):
+    clients = []
+
+    class Pinecone:
+        def __init__(self, api_key):
+            clients.append(self)
+            time.sleep(0.05)
+
+        def Index(self, name):
+            return object()
+
+    monkeypatch.setitem(sys.modules, "pinecone", types.SimpleNamespace(Pinecone=Pinecone))
+    monkeypatch.setattr(pinecone_manager, "index_pinecone", None)
+    indexes = []
+    threads = [threading.Thread(target=lambda: indexes.append(pinecone_manager.get_pinecone_index()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(clients) == 1
+    assert len({id(index) for index in indexes}) == 1
@@ -0,0 +1,28 @@
+# tests/test_stop_sequences.py
+from src.stop_sequences import tokens_saved_report
+
+
+class CharTokenizer:
+    """Tokenizer giả: mỗi ký tự là một token (số token khác hẳn số từ)."""
+
+    def __call__(self, text, add_special_tokens=True):
+        return {"input_ids": [ord(c) for c in text]}
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        return "".join(chr(t) for t in token_ids)
+
+
+def test_tokens_saved_report_counts_model_tokens(tmp_path):
+    stopped = "Người lao động được nghỉ.\r\nCâu hỏi: tiếp theo"
+    kept = "Không có cụm cần cắt"
+    path = tmp_path / "eval.csv"
+    # file do Excel / pandas ghi: BOM ở đầu, câu trả lời nhiều dòng nằm trong ô có ngoặc kép
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(f'response,câu hỏi\r\n"{stopped}",q1\r\n{kept},q2\r\n')
+
+    report = tokens_saved_report(str(path), CharTokenizer())
+    stop_at = stopped.index("Câu hỏi:") + len("Câu hỏi:")
+    assert report["answers"] == 2
+    assert report["stopped_early"] == 1
+    assert report["generated_tokens"] == len(stopped) + len(kept)
+    assert report["saved_tokens"] == len(stopped) - stop_at
@@ -0,0 +1,72 @@
+# tests/test_vector_store.py
+import os
+import json
+import time
+import threading
+
+import numpy as np
+import pytest
+
+import src.vector_store as vector_store
+from src.config import BASE_DIR
+from src.vector_store import LocalVectorIndex, get_vector_backend
+
+
+@pytest.fixture(scope="module")
+def items():
+    with open(os.path.join(BASE_DIR, "data", "updated_kw.jsonl"), "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture(scope="module")
+def vectors(items):
+    return np.random.default_rng(0).standard_normal((len(items), 16)).astype(np.float32)
+
+
+def _search_all(index, vectors):
+    return [index.search(v, top_k=5) for v in vectors[:20]]
+
+
+def test_save_load_maps_columnar_metadata(tmp_path, items, vectors):
+    index = LocalVectorIndex.build(vectors, items, n_lists=4)
+    index.save(tmp_path / "index")
+    assert not os.path.exists(tmp_path / "index" / "items.jsonl")
+
+    loaded = LocalVectorIndex.load(tmp_path / "index")
+    assert _search_all(loaded, vectors) == _search_all(index, vectors)
+    assert [loaded.metadata.get(i) for i in range(len(items))] == [index.metadata.get(i) for i in range(len(items))]
+
+
+def test_load_format_1_items_jsonl(tmp_path, items, vectors):
+    index = LocalVectorIndex.build(vectors, items)
+    index.save(tmp_path / "index")
+    # index bản 1: metadata là items.jsonl
+    with open(tmp_path / "index" / "items.jsonl", "w", encoding="utf-8") as f:
+        for doc_id in range(len(items)):
+            f.write(json.dumps(index.metadata.get(doc_id), ensure_ascii=False) + "\n")
+    meta_path = tmp_path / "index" / "meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    meta_path.write_text(json.dumps(dict(meta, format_version=1)), encoding="utf-8")
+
+    assert _search_all(LocalVectorIndex.load(tmp_path / "index"), vectors) == _search_all(index, vectors)
+
+
+def test_backend_loaded_once_under_concurrent_first_use(monkeypatch, items, vectors):
+    index = LocalVectorIndex.build(vectors, items)
+    loads = []
+
+    def slow_load(index_dir):
+        loads.append(index_dir)
+        time.sleep(0.05)
+        return index
+
+    monkeypatch.setattr(vector_store, "_backend", None)
+    monkeypatch.setattr(LocalVectorIndex, "load", staticmethod(slow_load))
+    backends = []
+    threads = [threading.Thread(target=lambda: backends.append(get_vector_backend("local"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loads) == 1
+    assert all(backend is index for backend in backends)